@@ -0,0 +1,71 @@
+# Microbenchmark of the per row cost of building attribute extraction prompts.
+# Run from the repository root: python benchmark/prompt_build.py
+
+import copy
+import json
+import timeit
+from argparse import ArgumentParser
+
+from autolabel import AutolabelConfig
+from autolabel.tasks import AttributeExtractionTask
+
+BANKING_CONFIG = "tests/assets/banking/config_banking.json"
+
+
+def build_config(num_attributes: int) -> AutolabelConfig:
+    """Banking config with extra attributes that have options and a json schema"""
+    config = json.load(open(BANKING_CONFIG))
+    attributes = config["prompt"]["attributes"]
+    options = attributes[0]["options"]
+    for i in range(num_attributes - 1):
+        attributes.append(
+            {
+                "name": f"attribute_{i}",
+                "description": f"Description of attribute {i}",
+                "options": options,
+                "task_type": "classification",
+            }
+            if i % 2 == 0
+            else {
+                "name": f"attribute_{i}",
+                "description": f"Description of attribute {i}",
+                "schema": '{"type": "object", "properties": {"value": {"type": "string"}, "score": {"type": "number"}}}',
+            },
+        )
+    return AutolabelConfig(config)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--attributes", type=int, default=10)
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    task = AttributeExtractionTask(build_config(args.attributes))
+    row = {"example": "I still have not received my new card, when will it arrive?"}
+    examples = [
+        {"example": f"Seed example {i}", "label": "card_arrival"} for i in range(8)
+    ]
+
+    def build(**kwargs):
+        return task.construct_prompt(
+            copy.copy(row), copy.deepcopy(examples), **kwargs,
+        )
+
+    # Overriding the output guidelines with the same text builds the prompt the
+    # way every row did before the prompt plan, and must give the same prompt
+    assert build() == build(output_guidelines_override=task.output_guidelines)
+
+    per_row = timeit.timeit(
+        lambda: build(output_guidelines_override=task.output_guidelines),
+        number=args.rows,
+    )
+    planned = timeit.timeit(build, number=args.rows)
+    print(f"attributes: {args.attributes}, rows: {args.rows}")
+    print(f"rendered per row: {1e6 * per_row / args.rows:.1f} us/row")
+    print(f"prompt plan:      {1e6 * planned / args.rows:.1f} us/row")
+    print(f"speedup:          {per_row / planned:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
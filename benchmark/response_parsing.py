@@ -0,0 +1,129 @@
+# Microbenchmark of the per row cost of parsing attribute extraction responses.
+# Run from the repository root: python benchmark/response_parsing.py
+
+import json
+import random
+import re
+import timeit
+from argparse import ArgumentParser
+
+import json5
+from langchain.schema import Generation
+
+from autolabel import AutolabelConfig
+from autolabel.tasks import AttributeExtractionTask
+
+BANKING_CONFIG = "tests/assets/banking/config_banking.json"
+
+
+def build_config(num_attributes: int, num_options: int) -> AutolabelConfig:
+    """Banking config with classification and multilabel attributes that have many options"""
+    config = json.load(open(BANKING_CONFIG))
+    attributes = config["prompt"]["attributes"]
+    attributes[0]["task_type"] = "classification"
+    for i in range(num_attributes - 1):
+        attributes.append(
+            {
+                "name": f"attribute_{i}",
+                "description": f"Description of attribute {i}",
+                "options": [f"option_{i}_{j}" for j in range(num_options)],
+                "task_type": (
+                    "classification" if i % 2 == 0 else "multilabel_classification"
+                ),
+            },
+        )
+    return AutolabelConfig(config)
+
+
+def build_responses(config: AutolabelConfig, num_responses: int):
+    """Mostly strict json responses, some in markdown fences or surrounded by text, and a few that only json5 accepts"""
+    rng = random.Random(0)
+    responses = []
+    for i in range(num_responses):
+        label = {}
+        for attribute in config.attributes():
+            options = attribute["options"]
+            if attribute["task_type"] == "multilabel_classification":
+                label[attribute["name"]] = ";".join(rng.sample(options, 3))
+            else:
+                label[attribute["name"]] = rng.choice(options)
+        text = json.dumps(label, indent=2)
+        if i % 10 == 1:
+            text = f"```json\n{text}\n```"
+        elif i % 10 == 2:
+            text = f"Here are the extracted attributes:\n{text}\nLet me know if you need more."
+        elif i % 20 == 3:
+            text = text.replace('"', "'").rstrip("}") + ",}"
+        responses.append(Generation(text=text))
+    return responses
+
+
+def parse_before(task: AttributeExtractionTask, response: Generation) -> dict:
+    """The parser before the json fast path, without the warnings it logs"""
+    try:
+        completion_text = response.text.lstrip("```json").rstrip("```")
+        llm_label = {}
+        for k, v in json5.loads(completion_text).items():
+            llm_label[k] = v if isinstance(v, (list, dict)) else str(v)
+    except Exception:
+        json_start, json_end = response.text.find("{"), response.text.rfind("}")
+        json_str = re.sub(
+            r'"[^"]*"',
+            lambda m: m.group().replace("\n", "\\n"),
+            response.text[json_start : json_end + 1],
+        )
+        llm_label = {}
+        for k, v in json5.loads(json_str).items():
+            llm_label[k] = v if isinstance(v, (list, dict)) else str(v)
+    for attribute in task.config.attributes():
+        attr_options = attribute.get("options")
+        attr_type = attribute.get("task_type")
+        if attr_options is not None and len(attr_options) > 0:
+            attr_label = str(llm_label.get(attribute["name"]))
+            if attr_type == "classification":
+                if attr_label not in attr_options:
+                    llm_label.pop(attribute["name"], None)
+            elif attr_type == "multilabel_classification":
+                labels = attr_label.split(task.config.label_separator())
+                filtered = [x for x in labels if x.strip() in attr_options]
+                llm_label[attribute["name"]] = task.config.label_separator().join(
+                    filtered,
+                )
+                if len(filtered) == 0:
+                    llm_label.pop(attribute["name"], None)
+    return llm_label
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--attributes", type=int, default=10)
+    parser.add_argument("--options", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    config = build_config(args.attributes, args.options)
+    task = AttributeExtractionTask(config)
+    responses = build_responses(config, args.rows)
+
+    for response in responses:
+        assert parse_before(task, response) == (
+            task.parse_llm_response(response, {}, "").label
+        )
+
+    before = timeit.timeit(
+        lambda: [parse_before(task, response) for response in responses], number=1,
+    )
+    after = timeit.timeit(
+        lambda: [task.parse_llm_response(response, {}, "") for response in responses],
+        number=1,
+    )
+    print(
+        f"attributes: {args.attributes}, options: {args.options}, rows: {args.rows}",
+    )
+    print(f"json5 parser:     {1e6 * before / args.rows:.1f} us/row")
+    print(f"tiered parser:    {1e6 * after / args.rows:.1f} us/row")
+    print(f"speedup:          {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
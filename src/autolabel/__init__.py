@@ -2,6 +2,7 @@ from importlib import metadata
 
 from .configs import AutolabelConfig
 from .dataset import AutolabelDataset
+from .distributed import ShardedLabelingRunner
 from .labeler import LabelingAgent
 from .task_chain import TaskChainOrchestrator
 from .utils import get_data
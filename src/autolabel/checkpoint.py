@@ -0,0 +1,91 @@
+"""Checkpoint journal that lets interrupted labeling runs resume where they stopped."""
+
+import logging
+import os
+import pickle
+from typing import Dict, Tuple
+
+from autolabel.schema import LLMAnnotation
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointJournal:
+
+    """
+    Append-only file of the rows completed by a labeling run. Every completed row is
+    recorded as a pickled (row index, annotation, cost) record and flushed to disk
+    immediately, so after a crash a restart with the same run id can load the
+    journal and only label the rows that are missing from it.
+    """
+
+    FILE_EXTENSION = ".journal"
+
+    def __init__(self, checkpoint_dir: str, run_id: str) -> None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.run_id = run_id
+        self.path = os.path.join(checkpoint_dir, f"{run_id}{self.FILE_EXTENSION}")
+        self.file = None
+
+    def load(self) -> Dict[int, Tuple[LLMAnnotation, float]]:
+        """
+        Reads the rows completed so far.
+
+        Returns:
+            Mapping from row index to the annotation and cost recorded for that row
+
+        Raises:
+            Exception: if a record other than a partially written last record cannot be loaded, e.g. because it refers to a class that was renamed. The journal is left untouched.
+
+        """
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, "rb") as f:
+            valid_offset = 0
+            while True:
+                try:
+                    index, annotation, cost = pickle.load(f)
+                except Exception as e:
+                    if valid_offset == os.path.getsize(self.path):
+                        break
+                    # A record torn by a crash runs to the end of the file. Any
+                    # other record that fails to load is not dropped, since the
+                    # records after it would be dropped with it
+                    torn = isinstance(e, (EOFError, pickle.UnpicklingError))
+                    if torn and not f.read(1):
+                        logger.warning(
+                            f"Ignoring partially written record at the end of checkpoint journal {self.path}: {e!r}",
+                        )
+                        break
+                    logger.error(
+                        f"Failed to load the record at offset {valid_offset} of checkpoint journal {self.path}",
+                    )
+                    raise
+                completed[index] = (annotation, cost)
+                valid_offset = f.tell()
+        if valid_offset < os.path.getsize(self.path):
+            # Drop the partially written record left behind by a crash so new
+            # records are appended after the last complete one
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_offset)
+        return completed
+
+    def record(self, index: int, annotation: LLMAnnotation, cost: float) -> None:
+        """Appends a completed row to the journal"""
+        if self.file is None:
+            self.file = open(self.path, "ab")
+        pickle.dump((index, annotation, cost), self.file)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> "CheckpointJournal":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
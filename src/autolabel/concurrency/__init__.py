@@ -0,0 +1,17 @@
+from .aimd import AIMDConcurrencyController
+from .batching import MicroBatcher
+from .deadline import (
+    Deadline,
+    DeadlineExceeded,
+    deadline_exceeded_error,
+    deadline_scope,
+    get_deadline,
+    stop_at_deadline,
+    timeout_before_deadline,
+)
+from .dedup import PromptDeduplicator
+from .dispatcher import BoundedDispatcher, RequeueItem
+from .hedging import HedgingPolicy
+from .pipeline import StagedPipeline, StageStats
+from .rate_limiter import RateLimiter, TokenBucket, get_rate_limiter
+from .scheduler import SizeAwareScheduler
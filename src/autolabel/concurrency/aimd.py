@@ -0,0 +1,79 @@
+"""Additive-increase/multiplicative-decrease (AIMD) concurrency control."""
+
+import logging
+from time import monotonic
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AIMDConcurrencyController:
+
+    """
+    Adapts the number of in-flight LLM requests to the capacity of the provider.
+    The limit grows additively (by additive_increase per limit successful calls)
+    while calls succeed and is cut multiplicatively on rate limit or timeout errors.
+    Backoffs that arrive within cooldown_seconds of the previous cut are ignored,
+    since they usually come from requests that were issued before the cut.
+    """
+
+    DEFAULT_ADDITIVE_INCREASE = 1.0
+    DEFAULT_MULTIPLICATIVE_DECREASE = 0.5
+    DEFAULT_COOLDOWN_SECONDS = 1.0
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        initial_concurrency: Optional[int] = None,
+        additive_increase: float = DEFAULT_ADDITIVE_INCREASE,
+        multiplicative_decrease: float = DEFAULT_MULTIPLICATIVE_DECREASE,
+        cooldown_seconds: float = DEFAULT_COOLDOWN_SECONDS,
+    ) -> None:
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise ValueError(
+                f"Expected 1 <= min_concurrency <= max_concurrency, got {min_concurrency} and {max_concurrency}",
+            )
+        if not 0 < multiplicative_decrease < 1:
+            raise ValueError(
+                f"multiplicative_decrease must be between 0 and 1, got {multiplicative_decrease}",
+            )
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.cooldown_seconds = cooldown_seconds
+        self._limit = float(
+            min(
+                max(initial_concurrency or min_concurrency, min_concurrency),
+                max_concurrency,
+            ),
+        )
+        self._last_decrease = None
+
+    @property
+    def limit(self) -> int:
+        """Returns the current number of requests that are allowed to be in flight"""
+        return int(self._limit)
+
+    def on_success(self) -> None:
+        """Records a successful call. Every limit successes raise the limit by additive_increase."""
+        self._limit = min(
+            self._limit + self.additive_increase / self._limit,
+            float(self.max_concurrency),
+        )
+
+    def on_backoff(self) -> None:
+        """Records a rate limit or timeout error and cuts the limit multiplicatively."""
+        now = monotonic()
+        if (
+            self._last_decrease is not None
+            and now - self._last_decrease < self.cooldown_seconds
+        ):
+            return
+        self._last_decrease = now
+        self._limit = max(
+            self._limit * self.multiplicative_decrease,
+            float(self.min_concurrency),
+        )
+        logger.info(f"Backing off, concurrency limit reduced to {self.limit}")
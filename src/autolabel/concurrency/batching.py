@@ -0,0 +1,137 @@
+"""Micro-batching of prompts submitted concurrently by individual rows."""
+
+import asyncio
+import json
+import logging
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from autolabel.schema import RefuelLLMResult
+
+from .deadline import Deadline, deadline_scope, get_deadline
+
+if TYPE_CHECKING:
+    from autolabel.models import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingBatch:
+    def __init__(self, output_schema: Optional[Dict], use_cache: bool = True) -> None:
+        self.output_schema = output_schema
+        self.use_cache = use_cache
+        self.prompts: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.num_tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        # Earliest deadline of the rows in the batch
+        self.deadline: Optional[Deadline] = None
+
+
+class MicroBatcher:
+
+    """
+    Groups prompts that are submitted concurrently by individual rows into a single
+    BaseModel.label call. Prompts are only batched together if they share the same
+    output schema and the same use_cache setting. A batch is sent as soon as it holds batch_size prompts, when adding
+    another prompt would exceed max_batch_tokens, or when it has waited
+    max_wait_seconds for more prompts to arrive. The batch is labeled under the
+    earliest deadline of the rows in it.
+    """
+
+    DEFAULT_MAX_WAIT_SECONDS = 0.01
+
+    def __init__(
+        self,
+        llm: "BaseModel",
+        batch_size: int,
+        max_batch_tokens: Optional[int] = None,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+    ) -> None:
+        if batch_size < 1:
+            raise ValueError(f"batch_size must be a positive integer, got {batch_size}")
+        self.llm = llm
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait_seconds = max_wait_seconds
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._running = set()
+
+    async def label(
+        self, prompt: str, output_schema: Optional[Dict], use_cache: bool = True,
+    ) -> RefuelLLMResult:
+        """
+        Labels a single prompt as part of a batch.
+
+        Args:
+            prompt: the prompt to label
+            output_schema: the output schema of the prompt
+            use_cache: passed to BaseModel.label. With use_cache=False the prompt is sent to the provider even if an identical prompt is in the same batch
+        Returns:
+            RefuelLLMResult containing only the result for this prompt
+
+        """
+        loop = asyncio.get_running_loop()
+        key = json.dumps([output_schema, use_cache], sort_keys=True)
+        num_tokens = self.llm.get_num_tokens(prompt) if self.max_batch_tokens else 0
+
+        batch = self._pending.get(key)
+        if (
+            batch is not None
+            and self.max_batch_tokens
+            and batch.num_tokens + num_tokens > self.max_batch_tokens
+        ):
+            self._flush(key, batch)
+            batch = None
+        if batch is None:
+            batch = _PendingBatch(output_schema, use_cache=use_cache)
+            batch.timer = loop.call_later(
+                self.max_wait_seconds, self._flush, key, batch,
+            )
+            self._pending[key] = batch
+
+        future = loop.create_future()
+        batch.prompts.append(prompt)
+        batch.futures.append(future)
+        batch.num_tokens += num_tokens
+        batch.deadline = Deadline.earliest(batch.deadline, get_deadline())
+        if len(batch.prompts) >= self.batch_size:
+            self._flush(key, batch)
+        return await future
+
+    def _flush(self, key: str, batch: _PendingBatch) -> None:
+        if self._pending.get(key) is not batch:
+            return
+        del self._pending[key]
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._label_batch(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _label_batch(self, batch: _PendingBatch) -> None:
+        try:
+            # The task inherits the deadline of the row that flushed the batch, which
+            # is not necessarily the earliest one
+            with deadline_scope(batch.deadline):
+                result = await self.llm.label(
+                    batch.prompts, batch.output_schema, use_cache=batch.use_cache,
+                )
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, future in enumerate(batch.futures):
+            if future.done():
+                continue
+            future.set_result(
+                RefuelLLMResult(
+                    generations=[result.generations[i]],
+                    errors=[result.errors[i]],
+                    costs=[result.costs[i]] if result.costs else [],
+                    latencies=[result.latencies[i]] if result.latencies else [],
+                    cached_tokens=(
+                        [result.cached_tokens[i]] if result.cached_tokens else []
+                    ),
+                ),
+            )
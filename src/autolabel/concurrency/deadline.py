@@ -0,0 +1,104 @@
+"""Deadlines that bound how long labeling a row or a whole run may take."""
+
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Iterator, Optional
+
+from tenacity.stop import stop_base
+
+from autolabel.schema import ErrorType, LabelingError
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+
+    """Raised when work does not finish before its deadline"""
+
+
+class Deadline:
+
+    """A point in time (on the monotonic clock) by which some work has to be done"""
+
+    def __init__(self, expires_at: float) -> None:
+        self.expires_at = expires_at
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    @staticmethod
+    def earliest(*deadlines: Optional["Deadline"]) -> Optional["Deadline"]:
+        """Returns the deadline that expires first, ignoring None"""
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if not deadlines:
+            return None
+        return min(deadlines, key=lambda deadline: deadline.expires_at)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    async def wait_for(self, awaitable: Awaitable) -> Any:
+        """Awaits awaitable, cancelling it and raising DeadlineExceeded if the deadline expires first"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(self.remaining(), 0))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("Deadline exceeded")
+
+
+def deadline_exceeded_error() -> LabelingError:
+    """Error recorded for prompts that were not labeled before their deadline"""
+    return LabelingError(
+        error_type=ErrorType.DEADLINE_EXCEEDED_ERROR,
+        error_message="Deadline exceeded before the prompt was labeled",
+    )
+
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar(
+    "autolabel_deadline", default=None,
+)
+
+
+def get_deadline() -> Optional[Deadline]:
+    """Returns the deadline of the work running in the current context, if any"""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Sets the deadline of the work running in the current context (and the tasks it
+    starts). A scope can only tighten the deadline it is nested in.
+    """
+    deadline = Deadline.earliest(get_deadline(), deadline)
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class stop_at_deadline(stop_base):
+
+    """Tenacity stop condition that gives up retrying when the next attempt would start after the current deadline"""
+
+    def __call__(self, retry_state) -> bool:
+        deadline = get_deadline()
+        if deadline is None:
+            return False
+        upcoming_sleep = getattr(retry_state, "upcoming_sleep", 0) or 0
+        return deadline.remaining() <= upcoming_sleep
+
+
+def timeout_before_deadline(timeout: float) -> float:
+    """Clips a request timeout so that the request does not outlive the current deadline"""
+    deadline = get_deadline()
+    if deadline is None:
+        return timeout
+    return max(min(timeout, deadline.remaining()), 0.001)
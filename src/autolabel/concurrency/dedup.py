@@ -0,0 +1,117 @@
+"""Deduplication of identical prompts within a labeling run."""
+
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from autolabel.schema import RefuelLLMResult
+
+logger = logging.getLogger(__name__)
+
+
+class PromptDeduplicator:
+
+    """
+    Sends one LLM request per unique (prompt, output schema) pair in a run and fans
+    the result out to every row that constructs the same prompt, including rows
+    that arrive while the first request is still in flight. Duplicates are charged
+    no cost. Results with errors are not reused, so a failed prompt is sent again
+    the next time it is seen. At most max_entries results are kept, least recently
+    used first out.
+    """
+
+    DEFAULT_MAX_ENTRIES = 100_000
+
+    def __init__(self, max_entries: Optional[int] = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.results: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self.num_requests = 0
+        self.num_deduplicated = 0
+
+    @staticmethod
+    def key(
+        prompt: str, output_schema: Optional[Dict], sample: Optional[int] = None,
+    ) -> str:
+        return hashlib.sha256(
+            (
+                prompt
+                + "\x00"
+                + json.dumps(output_schema, sort_keys=True)
+                + ("" if sample is None else f"\x00{sample}")
+            ).encode("utf-8"),
+        ).hexdigest()
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Fraction of rows that reused the result of an identical prompt"""
+        total = self.num_requests + self.num_deduplicated
+        return self.num_deduplicated / total if total > 0 else 0.0
+
+    async def label(
+        self,
+        prompt: str,
+        output_schema: Optional[Dict],
+        label_func: Callable[[str, Optional[Dict]], Awaitable[RefuelLLMResult]],
+        sample: Optional[int] = None,
+    ) -> RefuelLLMResult:
+        """
+        Returns the result of labeling prompt, calling label_func only if no identical prompt was labeled before.
+
+        Args:
+            prompt: the prompt to label
+            output_schema: the output schema of the prompt
+            label_func: labels a single prompt
+            sample: index of an independent sample of the prompt (self-consistency). Only the same sample of identical prompts is deduplicated
+        Returns:
+            RefuelLLMResult for the single prompt
+
+        """
+        key = self.key(prompt, output_schema, sample)
+        future = self.results.get(key)
+        if future is not None:
+            self.results.move_to_end(key)
+            self.num_deduplicated += 1
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The row that sent the prompt was cancelled, send it again
+                self.num_deduplicated -= 1
+                return await self.label(prompt, output_schema, label_func, sample)
+            return RefuelLLMResult(
+                generations=result.generations,
+                errors=result.errors,
+                costs=[0.0 for _ in result.costs],
+                latencies=result.latencies,
+                cached_tokens=[0 for _ in result.cached_tokens],
+            )
+
+        future = asyncio.get_running_loop().create_future()
+        self.results[key] = future
+        if self.max_entries and len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+        self.num_requests += 1
+        try:
+            result = await label_func(prompt, output_schema)
+        except asyncio.CancelledError:
+            self._forget(key, future)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._forget(key, future)
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no duplicate is waiting
+            future.exception()
+            raise
+        if any(error is not None for error in result.errors):
+            self._forget(key, future)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        if self.results.get(key) is future:
+            del self.results[key]
@@ -0,0 +1,160 @@
+"""Bounded-concurrency dispatch of async work items."""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Optional, Tuple
+
+from .aimd import AIMDConcurrencyController
+
+logger = logging.getLogger(__name__)
+
+
+class RequeueItem(Exception):
+
+    """
+    Raised by a dispatched function to signal that the item hit a transient error
+    (e.g. a rate limit) and should be dispatched again later. result is used as the
+    final result for the item if it runs out of requeue attempts.
+    """
+
+    def __init__(self, result: Any = None) -> None:
+        super().__init__("Item requeued")
+        self.result = result
+
+
+class BoundedDispatcher:
+
+    """
+    Runs an async function over a stream of items while keeping at most
+    max_concurrency calls in flight. Items are pulled from the input lazily, so
+    only the in-flight items are held in memory at any point in time.
+
+    If a controller is provided, the bound follows controller.limit instead and the
+    controller is told about every successful call and every requeued item.
+    batch_size scales the bound for callers whose items are grouped into batches
+    further downstream. Results are yielded in completion order; callers that put
+    them back in input order can set max_reorder, so that no item is dispatched
+    more than max_reorder items after the earliest unfinished one. This bounds the
+    results they have to buffer while an early item is slow.
+    """
+
+    DEFAULT_MAX_REQUEUES = 5
+    DEFAULT_REQUEUE_DELAY_SECONDS = 1.0
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        controller: Optional[AIMDConcurrencyController] = None,
+        batch_size: int = 1,
+        max_requeues: int = DEFAULT_MAX_REQUEUES,
+        requeue_delay_seconds: float = DEFAULT_REQUEUE_DELAY_SECONDS,
+        max_reorder: Optional[int] = None,
+    ) -> None:
+        if max_concurrency < 1:
+            raise ValueError(
+                f"max_concurrency must be a positive integer, got {max_concurrency}",
+            )
+        self.max_concurrency = max_concurrency
+        self.controller = controller
+        self.batch_size = batch_size
+        self.max_requeues = max_requeues
+        self.requeue_delay_seconds = requeue_delay_seconds
+        self.max_reorder = max_reorder
+
+    def _limit(self) -> int:
+        limit = self.controller.limit if self.controller else self.max_concurrency
+        return limit * self.batch_size
+
+    async def _run(
+        self, func: Callable[[Any], Awaitable[Any]], item: Any, delay: float,
+    ) -> Any:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await func(item)
+
+    def _reorder_full(
+        self, num_dispatched: int, pending: dict, requeued: deque,
+    ) -> bool:
+        """Whether the next item is more than max_reorder items after the earliest unfinished item"""
+        if not self.max_reorder:
+            return False
+        unfinished = [index for index, _ in pending.values()]
+        unfinished.extend(index for index, _ in requeued)
+        if not unfinished:
+            return False
+        return num_dispatched - min(unfinished) >= self.max_reorder
+
+    async def map(
+        self,
+        func: Callable[[Any], Awaitable[Any]],
+        items: Iterable,
+    ) -> AsyncIterator[Tuple[int, Any]]:
+        """
+        Applies func to every item and yields (index, result) pairs in completion order.
+
+        Args:
+            func: async function that is called once per item. It can raise RequeueItem to have the item dispatched again
+            items: iterable of items to process
+        Returns:
+            AsyncIterator over (index, result) pairs where index is the position of the item in items
+
+        """
+        iterator = enumerate(items)
+        exhausted = False
+        # Requeued items are dispatched before new items from the input
+        requeued = deque()
+        attempts = {}
+        pending = {}
+        num_dispatched = 0
+        try:
+            while True:
+                while len(pending) < self._limit():
+                    if requeued:
+                        index, item = requeued.popleft()
+                        delay = self.requeue_delay_seconds * 2 ** (attempts[index] - 1)
+                    elif not exhausted and not self._reorder_full(
+                        num_dispatched, pending, requeued,
+                    ):
+                        try:
+                            index, item = next(iterator)
+                        except StopIteration:
+                            exhausted = True
+                            continue
+                        num_dispatched += 1
+                        delay = 0
+                    else:
+                        break
+                    task = asyncio.ensure_future(self._run(func, item, delay))
+                    pending[task] = (index, item)
+
+                if not pending:
+                    return
+
+                done, _ = await asyncio.wait(
+                    pending.keys(), return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in sorted(done, key=lambda t: pending[t][0]):
+                    index, item = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except RequeueItem as e:
+                        if self.controller:
+                            self.controller.on_backoff()
+                        attempts[index] = attempts.get(index, 0) + 1
+                        if attempts[index] <= self.max_requeues:
+                            logger.debug(f"Requeueing item {index}")
+                            requeued.append((index, item))
+                            continue
+                        logger.warning(
+                            f"Item {index} was requeued {self.max_requeues} times, giving up",
+                        )
+                        result = e.result
+                    else:
+                        if self.controller:
+                            self.controller.on_success()
+                    attempts.pop(index, None)
+                    yield index, result
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,133 @@
+"""Hedged provider requests that cut the tail latency of a labeling run."""
+
+import asyncio
+import bisect
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Iterable, Optional, Tuple
+
+from autolabel.schema import RefuelLLMResult
+
+logger = logging.getLogger(__name__)
+
+
+class HedgingPolicy:
+
+    """
+    Sends a duplicate of a provider request that has not returned after the given
+    percentile of recently observed latencies, and keeps whichever request finishes
+    first. Hedging starts once min_samples latencies have been observed, and at
+    most max_hedge_fraction of the requests are duplicated so that a slow provider
+    is not flooded with extra load.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        max_hedge_fraction: float = 0.05,
+        min_samples: int = 20,
+        window_size: int = 1000,
+    ) -> None:
+        if not 0 < percentile < 1:
+            raise ValueError("percentile must be between 0 and 1")
+        if not 0 <= max_hedge_fraction <= 1:
+            raise ValueError("max_hedge_fraction must be between 0 and 1")
+        self.percentile = percentile
+        self.max_hedge_fraction = max_hedge_fraction
+        self.min_samples = min_samples
+        self.window = deque(maxlen=window_size)
+        self.sorted_window = []
+        self.num_requests = 0
+        self.num_hedged = 0
+        self.num_hedges_won = 0
+
+    def record(self, latencies: Iterable[float]) -> None:
+        """Adds the latencies reported for successful requests to the sliding window"""
+        for latency in latencies:
+            if not latency or latency <= 0:
+                continue
+            if len(self.window) == self.window.maxlen:
+                oldest = self.window[0]
+                del self.sorted_window[bisect.bisect_left(self.sorted_window, oldest)]
+            self.window.append(latency)
+            bisect.insort(self.sorted_window, latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Returns how long to wait before hedging a request, or None if too few latencies were observed"""
+        if len(self.sorted_window) < self.min_samples:
+            return None
+        index = min(
+            int(self.percentile * len(self.sorted_window)),
+            len(self.sorted_window) - 1,
+        )
+        return self.sorted_window[index]
+
+    def _can_hedge(self) -> bool:
+        return self.num_hedged + 1 <= self.max_hedge_fraction * self.num_requests
+
+    async def run(
+        self, request: Callable[[], Awaitable[RefuelLLMResult]],
+    ) -> Tuple[RefuelLLMResult, bool]:
+        """
+        Runs request, hedging it with a second call of request if it is slow.
+
+        Args:
+            request: sends the provider request. It is called a second time to hedge
+        Returns:
+            RefuelLLMResult of the request that finished first, and whether a hedged request was sent. The provider bills both requests
+
+        """
+        self.num_requests += 1
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(request())
+        hedge = None
+        if delay is None:
+            result = await primary
+            self.record(_successful_latencies(result))
+            return result, False
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._can_hedge():
+                result = await primary
+                self.record(_successful_latencies(result))
+                return result, False
+
+            self.num_hedged += 1
+            logger.debug(f"Request did not return within {delay:.2f}s, hedging it")
+            hedge = asyncio.ensure_future(request())
+            pending = {primary, hedge}
+            error, failed_result = None, None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    result = task.result()
+                    # Prefer the other request if this one came back with errors
+                    if pending and any(e is not None for e in result.errors):
+                        failed_result = result
+                        continue
+                    if task is hedge:
+                        self.num_hedges_won += 1
+                    self.record(_successful_latencies(result))
+                    return result, True
+            # Neither request succeeded
+            if failed_result is not None:
+                return failed_result, True
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+
+def _successful_latencies(result: RefuelLLMResult) -> Iterable[float]:
+    return [
+        latency
+        for latency, error in zip(result.latencies, result.errors)
+        if error is None
+    ]
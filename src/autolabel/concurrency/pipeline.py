@@ -0,0 +1,110 @@
+"""Staged labeling pipeline that moves CPU-bound work off the event loop."""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+
+    """
+    Counters for one stage of the pipeline. queued is the number of rows waiting
+    for a worker, active the number being processed. Comparing the queue depths of
+    the stages shows which stage limits throughput.
+    """
+
+    def __init__(self) -> None:
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.max_queued = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self) -> None:
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def start(self) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+
+    def finish(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+
+
+class StagedPipeline:
+
+    """
+    Runs the stages of labeling a row. Blocking stages (prompt construction,
+    response parsing) run in a pool of worker threads when num_workers > 0, so that
+    the event loop stays free to drive LLM requests. Async stages (the LLM call) run
+    on the event loop and are only tracked. With num_workers = 0 every stage runs
+    inline on the event loop, as before.
+    """
+
+    def __init__(self, num_workers: int = 0) -> None:
+        self.num_workers = num_workers
+        self.executor = (
+            ThreadPoolExecutor(
+                max_workers=num_workers, thread_name_prefix="autolabel-worker",
+            )
+            if num_workers > 0
+            else None
+        )
+        self.stats: Dict[str, StageStats] = {}
+
+    def _stage_stats(self, stage: str) -> StageStats:
+        if stage not in self.stats:
+            self.stats[stage] = StageStats()
+        return self.stats[stage]
+
+    async def run_blocking(self, stage: str, func: Callable, *args, **kwargs) -> Any:
+        """Runs a blocking function as part of stage, in a worker thread if there is a worker pool"""
+        stats = self._stage_stats(stage)
+        stats.enqueue()
+
+        def work() -> Any:
+            stats.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.finish()
+
+        if self.executor is None:
+            return work()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, work)
+
+    @asynccontextmanager
+    async def track(self, stage: str) -> AsyncIterator[None]:
+        """Tracks a row going through an async stage that runs on the event loop"""
+        stats = self._stage_stats(stage)
+        stats.enqueue()
+        stats.start()
+        try:
+            yield
+        finally:
+            stats.finish()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Returns the number of rows waiting in or going through each stage"""
+        return {
+            f"{stage} queue": stats.queued + stats.active
+            for stage, stats in self.stats.items()
+        }
+
+    def close(self) -> None:
+        for stage, stats in self.stats.items():
+            logger.info(
+                f"Stage {stage}: {stats.completed} rows, max queue depth {stats.max_queued}",
+            )
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
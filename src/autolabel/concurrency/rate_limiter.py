@@ -0,0 +1,157 @@
+"""Token-bucket rate limiting of LLM requests against provider quotas."""
+
+import asyncio
+import logging
+import threading
+from time import monotonic
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+
+    """
+    A bucket that holds up to capacity units and refills continuously at
+    refill_rate units per second. Callers wait until the units they need are
+    available. Requests for more than capacity units are clamped to capacity so
+    they can still go through once the bucket is full.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float) -> None:
+        if capacity <= 0 or refill_rate <= 0:
+            raise ValueError(
+                f"capacity and refill_rate must be positive, got {capacity} and {refill_rate}",
+            )
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._available = capacity
+        self._last_refill = monotonic()
+        # A thread lock rather than an asyncio lock, so that the bucket can be
+        # shared across event loops (e.g. agents run one after another with
+        # asyncio.run). It is never held across an await.
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = monotonic()
+        self._available = min(
+            self.capacity,
+            self._available + (now - self._last_refill) * self.refill_rate,
+        )
+        self._last_refill = now
+
+    def try_acquire(self, amount: float) -> float:
+        """
+        Takes amount units from the bucket if they are available.
+
+        Returns:
+            0 if the units were taken, otherwise the number of seconds to wait before they are expected to be available
+
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._available >= amount:
+                self._available -= amount
+                return 0.0
+            return (amount - self._available) / self.refill_rate
+
+    def refund(self, amount: float) -> None:
+        """Returns units that were taken from the bucket but not used"""
+        with self._lock:
+            self._available = min(self.capacity, self._available + amount)
+
+
+class RateLimiter:
+
+    """
+    Limits requests to an LLM provider to a requests per minute (RPM) and a tokens
+    per minute (TPM) budget. Either budget can be left unset. Each budget is a
+    token bucket holding one minute worth of quota, so short bursts up to the
+    per-minute budget are allowed and the long run rate never exceeds it.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_bucket = (
+            TokenBucket(requests_per_minute, requests_per_minute / 60)
+            if requests_per_minute
+            else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+            if tokens_per_minute
+            else None
+        )
+
+    async def acquire(self, num_tokens: int = 0, num_requests: int = 1) -> None:
+        """
+        Waits until num_requests requests using num_tokens tokens in total can be sent without exceeding the budgets.
+
+        Args:
+            num_tokens: estimated number of tokens (prompt and completion) used by the requests
+            num_requests: number of requests that are about to be sent
+
+        """
+        while True:
+            wait = 0.0
+            if self.request_bucket:
+                wait = self.request_bucket.try_acquire(num_requests)
+            if wait == 0 and self.token_bucket:
+                wait = self.token_bucket.try_acquire(num_tokens)
+                if wait > 0 and self.request_bucket:
+                    # Only take from the buckets when both budgets allow it
+                    self.request_bucket.refund(num_requests)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+
+_RATE_LIMITERS: Dict[Tuple[str, str], RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(
+    provider: str,
+    model_name: str,
+    requests_per_minute: Optional[int] = None,
+    tokens_per_minute: Optional[int] = None,
+) -> Optional[RateLimiter]:
+    """
+    Returns the rate limiter for a provider and model. Limiters are shared by every
+    model instance in the process, since the quota applies to all of them together.
+
+    Args:
+        provider: the model provider (e.g. openai)
+        model_name: the model name (e.g. gpt-4o)
+        requests_per_minute: requests per minute budget for the model
+        tokens_per_minute: tokens per minute budget for the model
+    Returns:
+        The shared RateLimiter, or None if neither budget is set
+
+    """
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    key = (provider, model_name)
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(key)
+        if (
+            limiter is None
+            or limiter.requests_per_minute != requests_per_minute
+            or limiter.tokens_per_minute != tokens_per_minute
+        ):
+            if limiter is not None:
+                logger.warning(
+                    f"Rate limits for {provider}/{model_name} changed, replacing the shared rate limiter",
+                )
+            limiter = RateLimiter(
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=tokens_per_minute,
+            )
+            _RATE_LIMITERS[key] = limiter
+    return limiter
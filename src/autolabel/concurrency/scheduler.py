@@ -0,0 +1,47 @@
+"""Ordering rows by the size of their prompts before they are sent to the LLM."""
+
+import logging
+from typing import List, Union
+
+from autolabel.schema import SchedulingStrategy
+
+logger = logging.getLogger(__name__)
+
+
+class SizeAwareScheduler:
+
+    """
+    Decides the order in which rows are dispatched from the number of tokens in
+    their prompts. Longest first starts the most expensive rows early so that they
+    do not hold up the end of the run. Interleaved alternates between the longest
+    and the shortest remaining rows, so that the tokens sent per minute stay close
+    to the average instead of spiking when long prompts cluster together.
+    """
+
+    def __init__(self, strategy: Union[str, SchedulingStrategy]) -> None:
+        self.strategy = SchedulingStrategy(strategy)
+
+    def order(self, num_tokens: List[int]) -> List[int]:
+        """
+        Returns the order in which to dispatch rows.
+
+        Args:
+            num_tokens: number of prompt tokens of each row
+        Returns:
+            A permutation of range(len(num_tokens))
+
+        """
+        # Sorting is stable, so rows of the same size keep their dataset order
+        by_size = sorted(range(len(num_tokens)), key=lambda i: -num_tokens[i])
+        if self.strategy == SchedulingStrategy.LONGEST_FIRST:
+            return by_size
+
+        order = []
+        longest, shortest = 0, len(by_size) - 1
+        while longest <= shortest:
+            order.append(by_size[longest])
+            longest += 1
+            if longest <= shortest:
+                order.append(by_size[shortest])
+                shortest -= 1
+        return order
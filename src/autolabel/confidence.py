@@ -18,6 +18,7 @@ from tenacity import (
 )
 
 from autolabel.cache import BaseCache
+from autolabel.concurrency import stop_at_deadline, timeout_before_deadline
 from autolabel.models import BaseModel
 from autolabel.schema import ConfidenceCacheEntry, LLMAnnotation, TaskType
 
@@ -303,7 +304,7 @@ class ConfidenceCalculator:
 
     @retry(
         reraise=True,
-        stop=stop_after_attempt(5),
+        stop=stop_after_attempt(5) | stop_at_deadline(),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         before_sleep=before_sleep_log(logger, logging.WARNING),
         retry=retry_if_not_exception_type(ValueError),
@@ -320,7 +321,10 @@ class ConfidenceCalculator:
             raise ValueError("Endpoint not provided")
         async with httpx.AsyncClient() as client:
             response = await client.post(
-                self.endpoint, json=payload, headers=headers, timeout=30,
+                self.endpoint,
+                json=payload,
+                headers=headers,
+                timeout=timeout_before_deadline(30),
             )
             # raise Exception if status != 200
             response.raise_for_status()
@@ -38,6 +38,14 @@ class AutolabelConfig(BaseConfig):
     MODEL_PARAMS_KEY = "params"
     MODEL_ENDPOINT_KEY = "endpoint"
     COMPUTE_CONFIDENCE_KEY = "compute_confidence"
+    REQUESTS_PER_MINUTE_KEY = "requests_per_minute"
+    TOKENS_PER_MINUTE_KEY = "tokens_per_minute"
+    HEDGE_LATENCY_PERCENTILE_KEY = "hedge_latency_percentile"
+    MAX_HEDGE_FRACTION_KEY = "max_hedge_fraction"
+    SELF_CONSISTENCY_SAMPLES_KEY = "self_consistency_samples"
+    CASCADE_KEY = "cascade"
+    ESCALATE_BELOW_KEY = "escalate_below"
+    PROMPT_CACHING_KEY = "prompt_caching"
 
     # Embedding config keys (config["embedding"][<key>])
     EMBEDDING_PROVIDER_KEY = "provider"
@@ -181,6 +189,34 @@ class AutolabelConfig(BaseConfig):
         """Returns true if the model is able to return a confidence score along with its predictions"""
         return self._model_config.get(self.COMPUTE_CONFIDENCE_KEY, False)
 
+    def self_consistency_samples(self) -> int:
+        """Returns the number of samples drawn per row and voted on for self-consistency. Defaults to 1, no sampling"""
+        return self._model_config.get(self.SELF_CONSISTENCY_SAMPLES_KEY, 1) or 1
+
+    def prompt_caching(self) -> bool:
+        """Returns whether the part of the prompt that is the same for every row is sent as a separate segment that the provider can cache. Defaults to False"""
+        return self._model_config.get(self.PROMPT_CACHING_KEY, False)
+
+    def cascade(self) -> List[Dict]:
+        """Returns the models that rows are escalated to, in order, when the confidence of the previous model is below the escalate_below threshold of the next one. Defaults to no cascade"""
+        return self._model_config.get(self.CASCADE_KEY, [])
+
+    def requests_per_minute(self) -> int:
+        """Returns the maximum number of requests per minute that can be sent to the model. Defaults to no limit"""
+        return self._model_config.get(self.REQUESTS_PER_MINUTE_KEY, None)
+
+    def tokens_per_minute(self) -> int:
+        """Returns the maximum number of tokens (prompt and completion) per minute that can be sent to the model. Defaults to no limit"""
+        return self._model_config.get(self.TOKENS_PER_MINUTE_KEY, None)
+
+    def hedge_latency_percentile(self) -> float:
+        """Returns the latency percentile after which a slow request is duplicated, keeping whichever copy returns first. Defaults to no hedging"""
+        return self._model_config.get(self.HEDGE_LATENCY_PERCENTILE_KEY, None)
+
+    def max_hedge_fraction(self) -> float:
+        """Returns the maximum fraction of requests that may be duplicated by hedging"""
+        return self._model_config.get(self.MAX_HEDGE_FRACTION_KEY, 0.05)
+
     # Embedding config
     def embedding_provider(self) -> str:
         """Returns the name of the entity that provides the model used for computing embeddings"""
@@ -77,6 +77,43 @@ schema = {
                 "name": {"type": "string"},
                 "compute_confidence": {"type": ["boolean", "null"]},
                 "params": {"type": ["object", "null"]},
+                "cascade": {
+                    "type": ["array", "null"],
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "provider": {"type": "string"},
+                            "name": {"type": "string"},
+                            "params": {"type": ["object", "null"]},
+                            "escalate_below": {
+                                "type": "number",
+                                "minimum": 0,
+                                "maximum": 1,
+                            },
+                        },
+                        "required": ["provider", "name", "escalate_below"],
+                        "additionalProperties": True,
+                    },
+                },
+                "self_consistency_samples": {
+                    "type": ["integer", "null"],
+                    "minimum": 1,
+                },
+                "prompt_caching": {"type": ["boolean", "null"]},
+                "requests_per_minute": {"type": ["integer", "null"], "minimum": 1},
+                "tokens_per_minute": {"type": ["integer", "null"], "minimum": 1},
+                "hedge_latency_percentile": {
+                    "type": ["number", "null"],
+                    "minimum": 0,
+                    "exclusiveMinimum": True,
+                    "maximum": 1,
+                    "exclusiveMaximum": True,
+                },
+                "max_hedge_fraction": {
+                    "type": ["number", "null"],
+                    "minimum": 0,
+                    "maximum": 1,
+                },
             },
             "required": ["provider", "name"],
             "additionalProperties": True,
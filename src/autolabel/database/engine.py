@@ -1,9 +1,11 @@
+import os
 from typing import Optional
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine.base import Engine
 
 DB_ENGINE = None
+DB_ENGINE_PID = None
 
 # This creates one global ".autolabel.db" in your home directory.
 # Having one global SQLite database in ~ is a poor idea, since
@@ -13,9 +15,32 @@ DB_ENGINE = None
 
 DB_PATH = ".autolabel.v15.db"
 
+# Seconds a connection waits for another process to release its write lock
+# before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = 60
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    # Write-ahead logging lets readers in other processes proceed while one
+    # process writes, which is what sharded labeling runs need
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
 
 def create_db_engine(db_path: Optional[str] = DB_PATH) -> Engine:
-    global DB_ENGINE
+    global DB_ENGINE, DB_ENGINE_PID
+    if DB_ENGINE is not None and DB_ENGINE_PID != os.getpid():
+        # Connections must not be shared with a parent process, so a forked
+        # process creates its own engine
+        DB_ENGINE.dispose(close=False)
+        DB_ENGINE = None
     if DB_ENGINE is None:
-        DB_ENGINE = create_engine(f"sqlite:///{db_path}", pool_size=0)
+        DB_ENGINE = create_engine(
+            f"sqlite:///{db_path}",
+            pool_size=0,
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT_SECONDS},
+        )
+        event.listen(DB_ENGINE, "connect", _configure_sqlite_connection)
+        DB_ENGINE_PID = os.getpid()
     return DB_ENGINE
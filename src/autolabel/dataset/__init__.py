@@ -1,2 +1,4 @@
 from .dataset import AutolabelDataset
+from .sinks import BaseSink, CsvSink, JsonlSink, ParquetSink, SinkFactory
+from .streaming import StreamingDataset
 from .validation import TaskDataValidation
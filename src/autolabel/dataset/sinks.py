@@ -0,0 +1,194 @@
+import csv
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from autolabel.configs import AutolabelConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _to_scalar(value: Any) -> Any:
+    """Serializes nested values (e.g. attribute labels) to json strings for flat file formats"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _check_columns(rows: List[Dict], fieldnames: List[str]) -> None:
+    """Raises a ValueError if a row has a column that is not one of fieldnames, which would be dropped from the output"""
+    columns = set(fieldnames)
+    for row in rows:
+        unknown = row.keys() - columns
+        if unknown:
+            raise ValueError(
+                f"Row has columns that are not in the output file: {sorted(unknown)}. Declare all output columns with fieldnames",
+            )
+
+
+class BaseSink(ABC):
+
+    """
+    Destination that labeled rows are appended to as they are produced. Rows are
+    flushed to disk on every write, so the output written so far survives a crash.
+    """
+
+    def __init__(self, path: str, append: bool = False) -> None:
+        self.path = path
+        self.append = append
+
+    @abstractmethod
+    def write(self, rows: List[Dict]) -> None:
+        pass
+
+    @abstractmethod
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "BaseSink":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class JsonlSink(BaseSink):
+    def __init__(self, path: str, append: bool = False) -> None:
+        super().__init__(path, append)
+        self.file = open(path, "a" if append else "w", encoding="utf-8")
+
+    def write(self, rows: List[Dict]) -> None:
+        for row in rows:
+            self.file.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class CsvSink(BaseSink):
+
+    """
+    Writes rows as csv. The columns are fieldnames if given, otherwise the keys of
+    the first row. Rows with a key that is not a column raise a ValueError instead
+    of being written without it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        delimiter: str = ",",
+        fieldnames: Optional[List[str]] = None,
+    ) -> None:
+        super().__init__(path, append)
+        self.delimiter = delimiter
+        self.fieldnames = fieldnames
+        self.write_header = True
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            # Keep the column order of the rows that were already written
+            with open(path, newline="", encoding="utf-8") as f:
+                self.fieldnames = next(csv.reader(f, delimiter=delimiter))
+            self.write_header = False
+        self.file = open(path, "a" if append else "w", newline="", encoding="utf-8")
+        self.writer = None
+
+    def write(self, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        if self.writer is None:
+            self.fieldnames = self.fieldnames or list(rows[0].keys())
+            self.writer = csv.DictWriter(
+                self.file, fieldnames=self.fieldnames, delimiter=self.delimiter,
+            )
+            if self.write_header:
+                self.writer.writeheader()
+        _check_columns(rows, self.fieldnames)
+        self.writer.writerows(
+            {k: _to_scalar(v) for k, v in row.items()} for row in rows
+        )
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ParquetSink(BaseSink):
+
+    """
+    Writes every call to write as a parquet row group. All columns are stored as
+    strings so that the schema does not depend on the values in the first rows.
+    The columns are fieldnames if given, otherwise the keys of the first row, and
+    rows with a key that is not a column raise a ValueError. Parquet files cannot
+    be appended to, so append is not supported.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        fieldnames: Optional[List[str]] = None,
+    ) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required to write parquet files. Please install it with: pip install 'refuel-autolabel[parquet]'",
+            )
+        if append:
+            raise ValueError("Appending to parquet files is not supported")
+        super().__init__(path, append)
+        self.pa = pa
+        self.pq = pq
+        self.fieldnames = fieldnames
+        self.writer = None
+
+    def write(self, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        if self.writer is None:
+            self.fieldnames = self.fieldnames or list(rows[0].keys())
+            self.schema = self.pa.schema(
+                [(key, self.pa.string()) for key in self.fieldnames],
+            )
+            self.writer = self.pq.ParquetWriter(self.path, self.schema)
+        _check_columns(rows, self.fieldnames)
+        columns = {
+            name: [
+                None if row.get(name) is None else str(_to_scalar(row.get(name)))
+                for row in rows
+            ]
+            for name in self.schema.names
+        }
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+class SinkFactory:
+
+    """Creates the sink for an output file based on its extension"""
+
+    @staticmethod
+    def from_path(
+        path: str,
+        config: Optional[AutolabelConfig] = None,
+        append: bool = False,
+        fieldnames: Optional[List[str]] = None,
+    ) -> BaseSink:
+        """fieldnames declares the columns of csv and parquet files, which otherwise are the keys of the first row"""
+        if path.endswith(".jsonl"):
+            return JsonlSink(path, append=append)
+        elif path.endswith(".csv"):
+            delimiter = config.delimiter() if config else ","
+            return CsvSink(
+                path, append=append, delimiter=delimiter, fieldnames=fieldnames,
+            )
+        elif path.endswith(".parquet"):
+            return ParquetSink(path, append=append, fieldnames=fieldnames)
+        raise ValueError(f"Unsupported output file format: {path}")
@@ -0,0 +1,179 @@
+import logging
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import pandas as pd
+
+from autolabel.configs import AutolabelConfig
+from autolabel.schema import LLMAnnotation
+from autolabel.tasks import BaseTask
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingDataset:
+
+    """
+    A dataset that is read lazily, a chunk of rows at a time, instead of being
+    loaded into memory as a dataframe. Used for labeling datasets that are larger
+    than memory.
+    """
+
+    DEFAULT_CHUNK_SIZE = 1000
+
+    def __init__(
+        self,
+        dataset: Union[str, Iterable[Dict]],
+        config: Union[AutolabelConfig, str, Dict],
+        max_items: Optional[int] = None,
+        start_index: int = 0,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> None:
+        """
+        Initializes the dataset.
+
+        Args:
+            dataset: Path to a csv/jsonl/parquet file, or an iterable of rows.
+            config: The config to be used for labeling. Could be a path to a json file or a dictionary.
+            max_items: The maximum number of items to read from the dataset.
+            start_index: The index to start reading the dataset from.
+            chunk_size: The number of rows read from the file at a time.
+
+        """
+        if not (isinstance(config, AutolabelConfig)):
+            self.config = AutolabelConfig(config)
+        else:
+            self.config = config
+        if isinstance(dataset, str) and not dataset.endswith(
+            (".csv", ".jsonl", ".parquet"),
+        ):
+            raise ValueError(f"Unsupported dataset file format: {dataset}")
+        self.dataset = dataset
+        self.max_items = max_items
+        self.start_index = start_index
+        self.chunk_size = chunk_size
+
+    def __iter__(self) -> Iterator[Dict]:
+        stop = self.start_index + self.max_items if self.max_items else None
+        return islice(self._read_rows(), self.start_index, stop)
+
+    def chunks(self) -> Iterator[pd.DataFrame]:
+        """Yields the rows [start_index, start_index + max_items) of the dataset as dataframes of at most chunk_size rows"""
+        if not isinstance(self.dataset, str):
+            rows = iter(self)
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    return
+                yield pd.DataFrame(chunk)
+
+        position = 0
+        stop = self.start_index + self.max_items if self.max_items else None
+        for chunk in self._read_chunks():
+            chunk_start, position = position, position + len(chunk)
+            if position <= self.start_index:
+                continue
+            if stop is not None and chunk_start >= stop:
+                return
+            first = max(self.start_index - chunk_start, 0)
+            last = len(chunk) if stop is None else min(stop - chunk_start, len(chunk))
+            yield chunk.iloc[first:last]
+
+    def _read_rows(self) -> Iterator[Dict]:
+        if not isinstance(self.dataset, str):
+            yield from self.dataset
+            return
+
+        for chunk in self._read_chunks():
+            yield from chunk.to_dict(orient="records")
+
+    def _read_chunks(self) -> Iterator[pd.DataFrame]:
+        if self.dataset.endswith(".csv"):
+            chunks = pd.read_csv(
+                self.dataset,
+                sep=self.config.delimiter(),
+                dtype="str",
+                quoting=3 if self.config.disable_quoting() else 0,
+                chunksize=self.chunk_size,
+            )
+        elif self.dataset.endswith(".jsonl"):
+            chunks = pd.read_json(
+                self.dataset, lines=True, dtype="str", chunksize=self.chunk_size,
+            )
+        else:
+            chunks = self._read_parquet_chunks()
+        yield from chunks
+
+    def _read_parquet_chunks(self) -> Iterator[pd.DataFrame]:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "pyarrow is required to stream parquet files. Please install it with: pip install 'refuel-autolabel[parquet]'",
+            )
+        parquet_file = pq.ParquetFile(self.dataset)
+        for batch in parquet_file.iter_batches(batch_size=self.chunk_size):
+            yield batch.to_pandas()
+
+    def generate_label_name(self, col_name: str, label_column: str = None) -> str:
+        label_column = label_column or f"{self.config.task_name()}_task"
+        return f"{label_column}_{col_name}"
+
+    def output_columns(self, input_columns: Iterable[str]) -> List[str]:
+        """Returns the columns of the rows that annotation_to_row returns for input rows with the given columns"""
+        columns = list(input_columns)
+        columns.append(self.generate_label_name("label"))
+        for attr in self.config.attributes():
+            columns.append(self.generate_label_name("label", attr["name"]))
+        columns.extend(
+            [
+                self.generate_label_name("error"),
+                self.generate_label_name("prompt"),
+                self.generate_label_name("successfully_labeled"),
+            ],
+        )
+        if self.config.confidence():
+            columns.append(self.generate_label_name("confidence"))
+            for attr in self.config.attributes():
+                columns.append(self.generate_label_name("confidence", attr["name"]))
+        if self.config.chain_of_thought():
+            columns.append(self.generate_label_name("explanation"))
+        # An input column with the name of a label column is overwritten by it
+        return list(dict.fromkeys(columns))
+
+    def annotation_to_row(self, row: Dict, annotation: LLMAnnotation) -> Dict:
+        """
+        Returns the output row for a labeled input row. The label columns match the
+        ones AutolabelDataset.process_labels adds, except for the annotation object
+        itself and row level metrics, which are not kept in streaming mode.
+        """
+        output_row = dict(row)
+        output_row[self.generate_label_name("label")] = annotation.label
+        for attr in self.config.attributes():
+            output_row[self.generate_label_name("label", attr["name"])] = (
+                annotation.label.get(attr["name"], "")
+                if annotation.successfully_labeled
+                else BaseTask.NULL_LABEL_TOKEN
+            )
+        output_row[self.generate_label_name("error")] = (
+            str(annotation.error) if annotation.error is not None else None
+        )
+        output_row[self.generate_label_name("prompt")] = annotation.prompt
+        output_row[self.generate_label_name("successfully_labeled")] = (
+            annotation.successfully_labeled
+        )
+        if self.config.confidence():
+            output_row[self.generate_label_name("confidence")] = (
+                annotation.confidence_score
+            )
+            for attr in self.config.attributes():
+                output_row[self.generate_label_name("confidence", attr["name"])] = (
+                    annotation.confidence_score.get(attr["name"], 0.0)
+                    if annotation.successfully_labeled
+                    else 0.0
+                )
+        if self.config.chain_of_thought():
+            output_row[self.generate_label_name("explanation")] = (
+                annotation.explanation
+            )
+        return output_row
@@ -0,0 +1,3 @@
+from .coordinator import WorkQueueCoordinator, WorkQueueWorker
+from .sharded import ShardedLabelingRunner
+from .work_queue import BaseWorkQueue, RedisWorkQueue, SQLiteWorkQueue, WorkLease
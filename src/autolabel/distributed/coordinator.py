@@ -0,0 +1,220 @@
+"""Coordinator/worker mode that spreads a labeling run over several machines."""
+
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import socket
+import uuid
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from autolabel.dataset import AutolabelDataset, JsonlSink, SinkFactory
+from autolabel.schema import RunOptions
+
+from .work_queue import BaseWorkQueue, WorkLease
+
+logger = logging.getLogger(__name__)
+
+
+def _part_path(output_dir: str, run_id: str, start_index: int) -> str:
+    return os.path.join(output_dir, run_id, f"part-{start_index:012d}.jsonl")
+
+
+class WorkQueueCoordinator:
+
+    """
+    Splits a labeling run into row ranges, puts them on a shared work queue and
+    merges the labeled ranges that the workers write to the shared output
+    directory once the run is done.
+    """
+
+    def __init__(self, queue: BaseWorkQueue, run_id: str, output_dir: str) -> None:
+        self.queue = queue
+        self.run_id = run_id
+        self.output_dir = output_dir
+
+    def submit(
+        self,
+        num_rows: int,
+        range_size: int = 1000,
+        start_index: int = 0,
+        max_items: Optional[int] = None,
+    ) -> int:
+        """
+        Enqueues the rows [start_index, start_index + max_items) of the dataset as ranges of range_size rows. Submitting the same run again does not add duplicate ranges.
+
+        Args:
+            num_rows: number of rows in the dataset
+            range_size: number of rows leased by a worker at a time
+            start_index: first row to label
+            max_items: maximum number of rows to label
+        Returns:
+            The number of ranges in the run
+
+        """
+        end_index = num_rows
+        if max_items and max_items > 0:
+            end_index = min(num_rows, start_index + max_items)
+        ranges = [
+            (start, min(range_size, end_index - start))
+            for start in range(start_index, end_index, range_size)
+        ]
+        self.queue.enqueue(self.run_id, ranges)
+        return len(ranges)
+
+    def progress(self) -> Dict[str, int]:
+        """Returns the number of pending, leased and done ranges"""
+        return self.queue.counts(self.run_id)
+
+    def merge(self, output_name: str) -> None:
+        """
+        Concatenates the labeled ranges, in dataset order, into output_name (csv, jsonl or parquet). Raises ValueError if ranges of the run are still pending or leased.
+        """
+        if not self.queue.is_done(self.run_id):
+            raise ValueError(
+                f"Run {self.run_id} is not done yet, progress: {self.progress()}",
+            )
+        parts = sorted(
+            glob.glob(os.path.join(self.output_dir, self.run_id, "part-*.jsonl")),
+        )
+        if output_name.endswith(".jsonl"):
+            with open(output_name, "wb") as output_file:
+                for part in parts:
+                    with open(part, "rb") as part_file:
+                        shutil.copyfileobj(part_file, output_file)
+            return
+        with SinkFactory.from_path(output_name) as sink:
+            for part in parts:
+                sink.write(
+                    pd.read_json(part, lines=True, dtype=str).to_dict(orient="records"),
+                )
+
+
+class WorkQueueWorker:
+
+    """
+    Leases row ranges from a shared work queue and labels them with a LabelingAgent
+    until no work is left. The lease is renewed in the background while a range is
+    being labeled, so only ranges of workers that died are handed out again. If a
+    renewal fails the range was handed to another worker, so labeling it is
+    cancelled and nothing is written. Each labeled range is written to its own file
+    in the shared output directory, so a range that is labeled twice simply
+    overwrites its file.
+    """
+
+    DEFAULT_LEASE_SECONDS = 600.0
+    DEFAULT_POLL_SECONDS = 5.0
+
+    def __init__(
+        self,
+        agent,
+        queue: BaseWorkQueue,
+        run_id: str,
+        dataset: AutolabelDataset,
+        output_dir: str,
+        worker_id: Optional[str] = None,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        poll_seconds: float = DEFAULT_POLL_SECONDS,
+    ) -> None:
+        """
+        Args:
+            agent: LabelingAgent used to label the leased ranges
+            queue: the shared work queue
+            run_id: the run to work on
+            dataset: the full dataset. Leased ranges are labeled with dataset.get_slice
+            output_dir: shared directory the labeled ranges are written to
+            worker_id: identifies this worker in the queue. Defaults to the hostname and a random suffix
+            lease_seconds: how long a lease lasts without being renewed
+            poll_seconds: how long to wait before asking again when all remaining ranges are leased by other workers
+
+        """
+        self.agent = agent
+        self.queue = queue
+        self.run_id = run_id
+        self.dataset = dataset
+        self.output_dir = output_dir
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        os.makedirs(os.path.join(output_dir, run_id), exist_ok=True)
+
+    def run(self, options: Optional[RunOptions] = None) -> List[WorkLease]:
+        return asyncio.run(self.arun(options=options))
+
+    async def arun(self, options: Optional[RunOptions] = None) -> List[WorkLease]:
+        """
+        Labels ranges until the run is done.
+
+        Args:
+            options: passed to LabelingAgent.arun for every range
+        Returns:
+            The leases of the ranges this worker completed
+
+        """
+        completed = []
+        while True:
+            lease = self.queue.lease(self.run_id, self.worker_id, self.lease_seconds)
+            if lease is None:
+                if self.queue.is_done(self.run_id):
+                    return completed
+                # Other workers hold the remaining ranges, wait in case a lease expires
+                await asyncio.sleep(self.poll_seconds)
+                continue
+            if await self._label_range(lease, options):
+                completed.append(lease)
+
+    async def _label_range(
+        self, lease: WorkLease, options: Optional[RunOptions] = None,
+    ) -> bool:
+        logger.info(
+            f"Worker {self.worker_id} labeling rows [{lease.start_index}, {lease.start_index + lease.max_items})",
+        )
+        labeling = asyncio.ensure_future(
+            self.agent.arun(
+                self.dataset,
+                max_items=lease.max_items,
+                start_index=lease.start_index,
+                skip_eval=True,
+                options=options,
+            ),
+        )
+        heartbeat = asyncio.ensure_future(self._renew_lease(lease, labeling))
+        try:
+            dataset = await labeling
+        except asyncio.CancelledError:
+            # The heartbeat cancels labeling once the lease is lost, any other
+            # cancellation is passed on
+            if not heartbeat.done():
+                raise
+            logger.warning(
+                f"Lease on rows [{lease.start_index}, {lease.start_index + lease.max_items}) was lost, stopped labeling the range",
+            )
+            return False
+        finally:
+            heartbeat.cancel()
+
+        # The annotation objects are not serializable, the other label columns are
+        df = dataset.df.drop(columns=[dataset.generate_label_name("annotation")])
+        path = _part_path(self.output_dir, self.run_id, lease.start_index)
+        tmp_path = f"{path}.{self.worker_id}.tmp"
+        with JsonlSink(tmp_path) as sink:
+            sink.write(df.to_dict(orient="records"))
+        # Rename atomically so that a partially written range is never merged
+        os.replace(tmp_path, path)
+
+        if not self.queue.complete(lease):
+            logger.warning(
+                f"Lease on rows [{lease.start_index}, {lease.start_index + lease.max_items}) was lost before the range was completed",
+            )
+            return False
+        return True
+
+    async def _renew_lease(self, lease: WorkLease, labeling: asyncio.Future) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self.queue.renew(lease, self.lease_seconds):
+                labeling.cancel()
+                return
@@ -0,0 +1,171 @@
+"""Labeling a dataset with one LabelingAgent per local worker process."""
+
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+from rich.console import Console
+
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import AutolabelDataset
+from autolabel.metrics import BaseMetric
+from autolabel.schema import LLMAnnotation, RunOptions
+from autolabel.tasks import TaskFactory
+from autolabel.utils import maybe_round, print_table
+
+logger = logging.getLogger(__name__)
+
+METRIC_TABLE_STYLE = "cyan bold"
+
+
+def _label_shard(
+    config: Dict,
+    df: pd.DataFrame,
+    agent_kwargs: Dict,
+    options: Optional[RunOptions],
+) -> Tuple[List[LLMAnnotation], float]:
+    """Labels one shard of the dataset in a worker process. Returns the annotations and the cost of labeling them."""
+    # Imported here so that spawned workers pay for the import, not the pickling
+    from autolabel.labeler import LabelingAgent
+
+    agent = LabelingAgent(config=config, console_output=False, **agent_kwargs)
+    dataset = AutolabelDataset(df, agent.config)
+    dataset = agent.run(dataset, skip_eval=True, options=options)
+    annotations = dataset.df[dataset.generate_label_name("annotation")].tolist()
+    return annotations, sum(annotation.cost or 0.0 for annotation in annotations)
+
+
+class ShardedLabelingRunner:
+
+    """
+    Labels a dataset across local processes. The dataset is split into num_shards
+    contiguous shards and each shard is labeled by a LabelingAgent in its own
+    worker process. The annotations are merged back in dataset order and the task
+    metrics are computed once over the merged annotations.
+
+    Workers share the SQLite caches. Every process opens its own connections, and
+    the database runs in write-ahead logging mode with a busy timeout so that
+    concurrent writes from several workers wait for each other instead of failing.
+    """
+
+    def __init__(
+        self,
+        config: Union[AutolabelConfig, str, Dict],
+        num_shards: Optional[int] = None,
+        agent_kwargs: Optional[Dict[str, Any]] = None,
+        mp_context: str = "spawn",
+        console_output: bool = True,
+    ) -> None:
+        """
+        Args:
+            config: the labeling config
+            num_shards: number of shards and worker processes. Defaults to the number of cores
+            agent_kwargs: keyword arguments used to create the LabelingAgent in every worker. They must be picklable
+            mp_context: multiprocessing start method used for the workers
+            console_output: whether to print progress, cost and metrics
+
+        """
+        self.config = (
+            config if isinstance(config, AutolabelConfig) else AutolabelConfig(config)
+        )
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.agent_kwargs = agent_kwargs or {}
+        self.mp_context = mp_context
+        self.console = Console(quiet=not console_output)
+        self.eval_result = None
+        self.cost = 0.0
+
+    def shard(self, dataset: AutolabelDataset) -> List[AutolabelDataset]:
+        """Splits the dataset into at most num_shards contiguous shards of (nearly) equal size"""
+        num_rows = len(dataset.df)
+        num_shards = max(1, min(self.num_shards, num_rows))
+        shard_size, remainder = divmod(num_rows, num_shards)
+        shards = []
+        start_index = 0
+        for i in range(num_shards):
+            max_items = shard_size + (1 if i < remainder else 0)
+            shards.append(
+                dataset.get_slice(max_items=max_items, start_index=start_index),
+            )
+            start_index += max_items
+        return shards
+
+    def run(
+        self,
+        dataset: AutolabelDataset,
+        output_name: Optional[str] = None,
+        max_items: Optional[int] = None,
+        start_index: int = 0,
+        additional_metrics: Optional[List[BaseMetric]] = [],
+        skip_eval: Optional[bool] = False,
+        options: Optional[RunOptions] = None,
+    ) -> AutolabelDataset:
+        """
+        Labels the dataset with one worker process per shard.
+
+        Args:
+            dataset: the dataset to be labeled
+            output_name: if provided, the labeled dataset is saved to this file
+            max_items: maximum items in dataset to be annotated
+            start_index: skips annotating [0, start_index)
+            additional_metrics: metrics computed over the merged annotations in addition to the task metrics
+            skip_eval: if True, no metrics are computed
+            options: passed to LabelingAgent.run in every worker
+        Returns:
+            The labeled dataset, in the original order
+
+        """
+        dataset = dataset.get_slice(max_items=max_items, start_index=start_index)
+        shards = self.shard(dataset)
+        self.console.print(
+            f"Labeling {len(dataset.df)} rows in {len(shards)} worker processes",
+        )
+
+        llm_labels = []
+        self.cost = 0.0
+        with ProcessPoolExecutor(
+            max_workers=len(shards),
+            mp_context=multiprocessing.get_context(self.mp_context),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _label_shard,
+                    self.config.config,
+                    shard.df,
+                    self.agent_kwargs,
+                    options,
+                )
+                for shard in shards
+            ]
+            # Collect in shard order so that the labels line up with the dataset
+            for i, future in enumerate(futures):
+                annotations, cost = future.result()
+                llm_labels.extend(annotations)
+                self.cost += cost
+                logger.info(f"Shard {i} finished labeling {len(annotations)} rows")
+
+        self.eval_result = None
+        table = {}
+        if not skip_eval and dataset.gt_labels:
+            task = TaskFactory.from_config(self.config)
+            self.eval_result = task.eval(
+                llm_labels, dataset.gt_labels, additional_metrics=additional_metrics,
+            )
+            for m in self.eval_result:
+                if isinstance(m.value, list):
+                    continue
+                if m.show_running:
+                    table[m.name] = m.value
+                else:
+                    self.console.print(f"{m.name}:\n{m.value}")
+
+        self.console.print(f"Actual Cost: {maybe_round(self.cost)}")
+        print_table(table, console=self.console, default_style=METRIC_TABLE_STYLE)
+
+        dataset.process_labels(llm_labels, self.eval_result)
+        if output_name:
+            dataset.save(output_file_name=output_name)
+        return dataset
@@ -0,0 +1,322 @@
+"""Shared queues of dataset row ranges that labeling workers lease work from."""
+
+import logging
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class WorkLease(BaseModel):
+
+    """A row range leased by a worker. The lease is lost if it is not renewed or completed before it expires."""
+
+    run_id: str
+    start_index: int
+    max_items: int
+    worker_id: str
+    token: str
+    expires_at: float
+
+
+class BaseWorkQueue(ABC):
+
+    """
+    Queue of the row ranges of a labeling run. Workers lease a range, label it and
+    mark it complete. Ranges whose lease expires (e.g. because the worker died) are
+    handed out again to the next worker that asks for work.
+    """
+
+    @abstractmethod
+    def initialize(self) -> None:
+        pass
+
+    @abstractmethod
+    def enqueue(self, run_id: str, ranges: List[Tuple[int, int]]) -> None:
+        """Adds (start_index, max_items) row ranges to the run. Ranges that were already added are ignored."""
+
+    @abstractmethod
+    def lease(
+        self, run_id: str, worker_id: str, lease_seconds: float,
+    ) -> Optional[WorkLease]:
+        """Leases the next available range, or returns None if there is no range to work on right now."""
+
+    @abstractmethod
+    def renew(self, lease: WorkLease, lease_seconds: float) -> bool:
+        """Extends a lease. Returns False if the lease expired and was handed to another worker."""
+
+    @abstractmethod
+    def complete(self, lease: WorkLease) -> bool:
+        """Marks a leased range as done. Returns False if the lease is no longer held by the worker."""
+
+    @abstractmethod
+    def counts(self, run_id: str) -> Dict[str, int]:
+        """Returns the number of pending, leased and done ranges of the run"""
+
+    def is_done(self, run_id: str) -> bool:
+        """Whether no range of the run is pending or leased. A run without any ranges (e.g. of an empty dataset) is done, so submit the run before starting its workers"""
+        counts = self.counts(run_id)
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+
+class SQLiteWorkQueue(BaseWorkQueue):
+
+    """
+    Work queue stored in a SQLite database. Useful for running several workers on a
+    single machine or for testing. SQLite locking is unreliable on network file
+    systems, so use RedisWorkQueue to spread a run across machines.
+    """
+
+    def __init__(
+        self,
+        db_path: str = ".autolabel_work_queue.db",
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        Args:
+            db_path: path of the SQLite database
+            clock: returns the current time in seconds, lease expiry times are measured with it. Defaults to time.time
+
+        """
+        self.db_path = db_path
+        self.clock = clock
+        self.connection = None
+
+    def initialize(self) -> None:
+        # Transactions are managed explicitly so that leases can take the write
+        # lock before reading (BEGIN IMMEDIATE)
+        self.connection = sqlite3.connect(
+            self.db_path, timeout=60, isolation_level=None, check_same_thread=False,
+        )
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS work_ranges (
+                run_id TEXT NOT NULL,
+                start_index INTEGER NOT NULL,
+                max_items INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker_id TEXT,
+                token TEXT,
+                expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (run_id, start_index)
+            )
+            """,
+        )
+
+    def enqueue(self, run_id: str, ranges: List[Tuple[int, int]]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO work_ranges (run_id, start_index, max_items) VALUES (?, ?, ?)",
+                [(run_id, start, count) for start, count in ranges],
+            )
+
+    def lease(
+        self, run_id: str, worker_id: str, lease_seconds: float,
+    ) -> Optional[WorkLease]:
+        now = self.clock()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute(
+                """
+                SELECT start_index, max_items, status FROM work_ranges
+                WHERE run_id = ? AND (status = 'pending' OR (status = 'leased' AND expires_at < ?))
+                ORDER BY start_index LIMIT 1
+                """,
+                (run_id, now),
+            ).fetchone()
+            if row is None:
+                self.connection.execute("COMMIT")
+                return None
+            start_index, max_items, status = row
+            if status == "leased":
+                logger.warning(
+                    f"Lease on rows [{start_index}, {start_index + max_items}) expired, reissuing it",
+                )
+            lease = WorkLease(
+                run_id=run_id,
+                start_index=start_index,
+                max_items=max_items,
+                worker_id=worker_id,
+                token=uuid.uuid4().hex,
+                expires_at=now + lease_seconds,
+            )
+            self.connection.execute(
+                """
+                UPDATE work_ranges SET status = 'leased', worker_id = ?, token = ?, expires_at = ?, attempts = attempts + 1
+                WHERE run_id = ? AND start_index = ?
+                """,
+                (worker_id, lease.token, lease.expires_at, run_id, start_index),
+            )
+            self.connection.execute("COMMIT")
+            return lease
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def renew(self, lease: WorkLease, lease_seconds: float) -> bool:
+        expires_at = self.clock() + lease_seconds
+        with self.connection:
+            cursor = self.connection.execute(
+                """
+                UPDATE work_ranges SET expires_at = ?
+                WHERE run_id = ? AND start_index = ? AND status = 'leased' AND token = ?
+                """,
+                (expires_at, lease.run_id, lease.start_index, lease.token),
+            )
+        if cursor.rowcount == 1:
+            lease.expires_at = expires_at
+            return True
+        return False
+
+    def complete(self, lease: WorkLease) -> bool:
+        with self.connection:
+            cursor = self.connection.execute(
+                """
+                UPDATE work_ranges SET status = 'done', expires_at = NULL
+                WHERE run_id = ? AND start_index = ? AND status = 'leased' AND token = ?
+                """,
+                (lease.run_id, lease.start_index, lease.token),
+            )
+        return cursor.rowcount == 1
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        counts = {"pending": 0, "leased": 0, "done": 0}
+        for status, count in self.connection.execute(
+            "SELECT status, COUNT(*) FROM work_ranges WHERE run_id = ? GROUP BY status",
+            (run_id,),
+        ):
+            counts[status] = count
+        return counts
+
+
+class RedisWorkQueue(BaseWorkQueue):
+
+    """
+    Work queue stored in Redis (or any server that speaks the Redis protocol and
+    supports Lua scripts), so that workers on several machines can share a run.
+    Leasing, renewing and completing are Lua scripts and therefore atomic.
+    """
+
+    LEASE_SCRIPT = """
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    for _, item in ipairs(expired) do
+        redis.call('ZREM', KEYS[2], item)
+        redis.call('HDEL', KEYS[3], item)
+        redis.call('LPUSH', KEYS[1], item)
+    end
+    local item = redis.call('LPOP', KEYS[1])
+    if item then
+        redis.call('ZADD', KEYS[2], ARGV[2], item)
+        redis.call('HSET', KEYS[3], item, ARGV[3])
+    end
+    return item
+    """
+
+    RENEW_SCRIPT = """
+    if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    return 1
+    """
+
+    COMPLETE_SCRIPT = """
+    if redis.call('HGET', KEYS[2], ARGV[1]) ~= ARGV[2] then
+        return 0
+    end
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('HDEL', KEYS[2], ARGV[1])
+    redis.call('SADD', KEYS[3], ARGV[1])
+    return 1
+    """
+
+    def __init__(self, endpoint: str, db: int = 0) -> None:
+        self.endpoint = endpoint
+        self.db = db
+
+    def initialize(self) -> None:
+        try:
+            from redis import Redis
+
+            self.redis = Redis.from_url(self.endpoint, db=self.db)
+        except ImportError:
+            raise ImportError(
+                "redis is required to use the Redis work queue. Please install it with the following command: pip install redis",
+            )
+        self.lease_script = self.redis.register_script(self.LEASE_SCRIPT)
+        self.renew_script = self.redis.register_script(self.RENEW_SCRIPT)
+        self.complete_script = self.redis.register_script(self.COMPLETE_SCRIPT)
+
+    def _keys(self, run_id: str) -> Dict[str, str]:
+        prefix = f"autolabel:work_queue:{run_id}"
+        return {
+            "ranges": f"{prefix}:ranges",
+            "pending": f"{prefix}:pending",
+            "leased": f"{prefix}:leased",
+            "tokens": f"{prefix}:tokens",
+            "done": f"{prefix}:done",
+        }
+
+    def enqueue(self, run_id: str, ranges: List[Tuple[int, int]]) -> None:
+        keys = self._keys(run_id)
+        for start, count in ranges:
+            item = f"{start}:{count}"
+            # The set of known ranges makes enqueueing the same run twice a no-op
+            if self.redis.sadd(keys["ranges"], item):
+                self.redis.rpush(keys["pending"], item)
+
+    def lease(
+        self, run_id: str, worker_id: str, lease_seconds: float,
+    ) -> Optional[WorkLease]:
+        keys = self._keys(run_id)
+        now = time.time()
+        token = f"{worker_id}:{uuid.uuid4().hex}"
+        item = self.lease_script(
+            keys=[keys["pending"], keys["leased"], keys["tokens"]],
+            args=[now, now + lease_seconds, token],
+        )
+        if item is None:
+            return None
+        start, count = item.decode("utf-8").split(":")
+        return WorkLease(
+            run_id=run_id,
+            start_index=int(start),
+            max_items=int(count),
+            worker_id=worker_id,
+            token=token,
+            expires_at=now + lease_seconds,
+        )
+
+    def renew(self, lease: WorkLease, lease_seconds: float) -> bool:
+        keys = self._keys(lease.run_id)
+        expires_at = time.time() + lease_seconds
+        renewed = self.renew_script(
+            keys=[keys["leased"], keys["tokens"]],
+            args=[f"{lease.start_index}:{lease.max_items}", lease.token, expires_at],
+        )
+        if renewed:
+            lease.expires_at = expires_at
+        return bool(renewed)
+
+    def complete(self, lease: WorkLease) -> bool:
+        keys = self._keys(lease.run_id)
+        return bool(
+            self.complete_script(
+                keys=[keys["leased"], keys["tokens"], keys["done"]],
+                args=[f"{lease.start_index}:{lease.max_items}", lease.token],
+            ),
+        )
+
+    def counts(self, run_id: str) -> Dict[str, int]:
+        keys = self._keys(run_id)
+        return {
+            "pending": self.redis.llen(keys["pending"]),
+            "leased": self.redis.zcard(keys["leased"]),
+            "done": self.redis.scard(keys["done"]),
+        }
@@ -1,16 +1,28 @@
 import asyncio
+import copy
+import functools
 import io
+import itertools
 import json
 import logging
 import os
 import pickle
 from collections import defaultdict
-from typing import Dict, List, Optional, Tuple, Union
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 from rich.console import Console
-from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from transformers import AutoTokenizer
 
 from autolabel.cache import (
@@ -19,36 +31,62 @@ from autolabel.cache import (
     SQLAlchemyGenerationCache,
     SQLAlchemyTransformCache,
 )
+from autolabel.checkpoint import CheckpointJournal
+from autolabel.concurrency import (
+    AIMDConcurrencyController,
+    BoundedDispatcher,
+    Deadline,
+    DeadlineExceeded,
+    MicroBatcher,
+    PromptDeduplicator,
+    RequeueItem,
+    SizeAwareScheduler,
+    StagedPipeline,
+    deadline_exceeded_error,
+    deadline_scope,
+)
 from autolabel.confidence import ConfidenceCalculator
 from autolabel.configs import AutolabelConfig
-from autolabel.dataset import AutolabelDataset
+from autolabel.dataset import (
+    AutolabelDataset,
+    BaseSink,
+    SinkFactory,
+    StreamingDataset,
+)
 from autolabel.few_shot import (
     DEFAULT_EMBEDDING_PROVIDER,
     PROVIDER_TO_MODEL,
     BaseExampleSelector,
     BaseLabelSelector,
     ExampleSelectorFactory,
+    FixedExampleSelector,
     LabelSelector,
 )
 from autolabel.metrics import BaseMetric
 from autolabel.models import BaseModel, ModelFactory
+from autolabel.planner import RunPlan, RunPlanner
 from autolabel.schema import (
     AggregationFunction,
+    ErrorType,
+    LabelingError,
     LLMAnnotation,
     MetricResult,
+    RefuelLLMResult,
+    RunOptions,
+    SchedulingStrategy,
     TaskType,
 )
 from autolabel.tasks import TaskFactory
 from autolabel.transforms import BaseTransform, TransformFactory
 from autolabel.utils import (
+    atrack_with_stats,
+    calculate_md5,
     gather_async_tasks_with_progress,
     get_format_variables,
     in_notebook,
     maybe_round,
     print_table,
     safe_serialize_to_string,
-    track,
-    track_with_stats,
 )
 
 logger = logging.getLogger(__name__)
@@ -74,6 +112,13 @@ MERGE_FUNCTION = {
 
 class LabelingAgent:
     COST_KEY = "Cost in $"
+    REQUEUE_ERROR_TYPES = (ErrorType.RATE_LIMIT_ERROR, ErrorType.TIMEOUT_ERROR)
+    # Number of labeled rows written to the output at a time in streaming mode
+    STREAMING_WRITE_BATCH_SIZE = 100
+    # Synthetic dataset generation requests at most this many rows at a time, and
+    # gives up on a label after this many requests in a row return no rows
+    SYNTHETIC_ROWS_PER_REQUEST = 50
+    MAX_FAILED_GENERATION_REQUESTS = 3
 
     def __init__(
         self,
@@ -114,10 +159,21 @@ class LabelingAgent:
         self.config = (
             config if isinstance(config, AutolabelConfig) else AutolabelConfig(config)
         )
+        if self.config.cascade() and not self.config.confidence():
+            raise ValueError(
+                "Rows are escalated through the model cascade by confidence. Please set compute_confidence to true in the model config.",
+            )
         self.task = TaskFactory.from_config(self.config)
         self.llm: BaseModel = ModelFactory.from_config(
             self.config, cache=self.generation_cache, tokenizer=confidence_tokenizer,
         )
+        if (
+            self.config.self_consistency_samples() > 1
+            and self.llm.model_params.get("temperature") == 0
+        ):
+            logger.warning(
+                "self_consistency_samples is set but the model samples with temperature 0, so every sample gets the same label. Please set a temperature above 0 in the model params.",
+            )
 
         if self.config.confidence_chunk_column():
             if not confidence_tokenizer:
@@ -126,6 +182,7 @@ class LabelingAgent:
                 )
             else:
                 self.confidence_tokenizer = confidence_tokenizer
+        self._confidence_tokenizer = confidence_tokenizer
         score_type = "logprob_average_per_key"
         self.confidence = ConfidenceCalculator(
             score_type=score_type,
@@ -150,6 +207,7 @@ class LabelingAgent:
         start_index: int = 0,
         additional_metrics: Optional[List[BaseMetric]] = [],
         skip_eval: Optional[bool] = False,
+        options: Optional[RunOptions] = None,
     ) -> Tuple[pd.Series, pd.DataFrame, List[MetricResult]]:
         return asyncio.run(
             self.arun(
@@ -159,6 +217,7 @@ class LabelingAgent:
                 start_index=start_index,
                 additional_metrics=additional_metrics,
                 skip_eval=skip_eval,
+                options=options,
             ),
         )
 
@@ -170,6 +229,7 @@ class LabelingAgent:
         start_index: int = 0,
         additional_metrics: Optional[List[BaseMetric]] = [],
         skip_eval: Optional[bool] = False,
+        options: Optional[RunOptions] = None,
     ) -> Tuple[pd.Series, pd.DataFrame, List[MetricResult]]:
         """
         Labels data in a given dataset. Output written to new CSV file.
@@ -179,11 +239,329 @@ class LabelingAgent:
             max_items: maximum items in dataset to be annotated
             output_name: custom name of output CSV file
             start_index: skips annotating [0, start_index)
+            options: concurrency, batching, checkpointing and time limits of the run, see RunOptions. Defaults to labeling one row at a time
 
         """
+        options = options or RunOptions()
+        run_deadline = (
+            Deadline.after(options.time_budget) if options.time_budget else None
+        )
+        run_id = options.run_id
+        if options.checkpoint_dir and not run_id:
+            run_id = self._get_run_id(dataset)
         dataset = dataset.get_slice(max_items=max_items, start_index=start_index)
-        llm_labels = []
 
+        self._initialize_selectors(dataset.df.keys().tolist())
+        self._initialize_prompt_caching()
+
+        cost = 0.0
+        postfix_dict = {}
+        num_rows = len(dataset.inputs)
+        llm_labels = [None] * num_rows
+        num_completed = 0
+        evaluator = (
+            self.task.get_running_evaluator()
+            if not skip_eval and dataset.gt_labels
+            else None
+        )
+
+        pipeline = StagedPipeline(num_workers=options.num_workers)
+        deduplicator = PromptDeduplicator() if options.deduplicate else None
+        journal = None
+        pending_indices = list(range(num_rows))
+        try:
+            if options.checkpoint_dir:
+                journal = CheckpointJournal(options.checkpoint_dir, run_id)
+                # Journal records are keyed by the row index in the unsliced dataset
+                for index, (annotation, row_cost) in journal.load().items():
+                    if start_index <= index < start_index + num_rows:
+                        llm_labels[index - start_index] = annotation
+                        cost += row_cost
+                        num_completed += 1
+                        if evaluator:
+                            evaluator.update(
+                                annotation,
+                                self._row_gt_labels(dataset, index - start_index),
+                            )
+                pending_indices = [i for i in pending_indices if llm_labels[i] is None]
+                if num_completed:
+                    logger.info(
+                        f"Resuming run {journal.run_id}, {num_completed} rows were already labeled",
+                    )
+                postfix_dict[self.COST_KEY] = f"{cost:.2f}"
+
+            constructed_prompts = None
+            if options.schedule and pending_indices:
+                pending_indices, constructed_prompts = await self._schedule_rows(
+                    dataset, pending_indices, options.schedule, pipeline,
+                )
+
+            results = self._dispatch_rows(
+                self._rows_before_deadline(
+                    (dataset.inputs[i] for i in pending_indices), run_deadline,
+                ),
+                options,
+                pipeline=pipeline,
+                deduplicator=deduplicator,
+                run_deadline=run_deadline,
+                constructed_prompts=constructed_prompts,
+            )
+            if self.console_output:
+                results = atrack_with_stats(
+                    results,
+                    postfix_dict,
+                    total=len(pending_indices),
+                    console=self.console,
+                )
+            elif self.use_tqdm:
+                results = tqdm_asyncio(results, total=len(pending_indices))
+
+            async for pending_index, (annotation, row_cost) in results:
+                current_index = pending_indices[pending_index]
+                llm_labels[current_index] = annotation
+                # Rows that ran out of time are labeled again when the run is resumed
+                if journal and not self._missed_deadline(annotation):
+                    journal.record(start_index + current_index, annotation, row_cost)
+                num_completed += 1
+
+                cost += row_cost
+                postfix_dict[self.COST_KEY] = f"{cost:.2f}"
+                if options.num_workers > 0:
+                    postfix_dict.update(pipeline.queue_depths())
+
+                if evaluator:
+                    evaluator.update(
+                        annotation, self._row_gt_labels(dataset, current_index),
+                    )
+                    for m in evaluator.result():
+                        if m.show_running:
+                            postfix_dict[m.name] = (
+                                f"{m.value:.4f}"
+                                if isinstance(m.value, float)
+                                else m.value
+                            )
+        finally:
+            pipeline.close()
+            if journal:
+                journal.close()
+
+        if self.config.cascade() and not (run_deadline and run_deadline.expired()):
+            # The escalated rows are a new dataset, which is not checkpointed
+            cost += await self._escalate_rows(
+                dataset,
+                llm_labels,
+                options.copy(
+                    update={
+                        "checkpoint_dir": None,
+                        "run_id": None,
+                        "time_budget": (
+                            run_deadline.remaining() if run_deadline else None
+                        ),
+                    },
+                ),
+            )
+
+        num_skipped = 0
+        for i, annotation in enumerate(llm_labels):
+            if annotation is None:
+                llm_labels[i] = self._deadline_annotation(dataset.inputs[i])
+                num_skipped += 1
+        if num_skipped:
+            self.console.print(
+                f"Time budget of {options.time_budget}s ran out, {num_skipped} rows were not labeled",
+            )
+
+        eval_result = None
+        table = {}
+
+        # if true labels are provided, evaluate accuracy of predictions
+        if not skip_eval and dataset.gt_labels:
+            eval_result = self.task.eval(
+                llm_labels,
+                (
+                    dataset.gt_labels[: len(llm_labels)]
+                    if isinstance(dataset.gt_labels, list)
+                    else {k: v[: len(llm_labels)] for k, v in dataset.gt_labels.items()}
+                ),
+                additional_metrics=additional_metrics,
+            )
+            # TODO: serialize and write to file
+            for m in eval_result:
+                if isinstance(m.value, list):
+                    continue
+                if m.show_running:
+                    table[m.name] = m.value
+                else:
+                    self.console.print(f"{m.name}:\n{m.value}")
+
+        self.eval_result = eval_result
+
+        # print cost
+        self.console.print(f"Actual Cost: {maybe_round(cost)}")
+        if deduplicator:
+            self._print_dedup_summary(deduplicator)
+        if self.config.prompt_caching():
+            self._print_prompt_caching_summary(
+                sum(annotation.cached_input_tokens or 0 for annotation in llm_labels),
+                sum(annotation.input_tokens or 0 for annotation in llm_labels),
+            )
+        print_table(table, console=self.console, default_style=METRIC_TABLE_STYLE)
+
+        dataset.process_labels(llm_labels, eval_result)
+        # Only save to csv if output_name is provided or dataset is a string
+        if not output_name and isinstance(dataset, str):
+            output_name = (
+                dataset.rsplit(".", 1)[0] + "_labeled." + dataset.rsplit(".", 1)[1]
+            )
+
+        if output_name:
+            dataset.save(output_file_name=output_name)
+        return dataset
+
+    def run_streaming(
+        self,
+        dataset: Union[StreamingDataset, str, Iterable[Dict]],
+        output_name: str,
+        max_items: Optional[int] = None,
+        start_index: int = 0,
+        options: Optional[RunOptions] = None,
+    ) -> float:
+        return asyncio.run(
+            self.arun_streaming(
+                dataset=dataset,
+                output_name=output_name,
+                max_items=max_items,
+                start_index=start_index,
+                options=options,
+            ),
+        )
+
+    async def arun_streaming(
+        self,
+        dataset: Union[StreamingDataset, str, Iterable[Dict]],
+        output_name: str,
+        max_items: Optional[int] = None,
+        start_index: int = 0,
+        options: Optional[RunOptions] = None,
+    ) -> float:
+        """
+        Labels a dataset without loading it into memory. Rows are read lazily and appended to the output file as they are labeled, in dataset order. Annotations are not kept after they are written and no evaluation is run.
+
+        Args:
+            dataset: path to a csv/jsonl/parquet file, an iterable of rows or a StreamingDataset
+            output_name: path of the csv/jsonl/parquet file to write labeled rows to
+            max_items: maximum items in dataset to be annotated
+            start_index: skips annotating [0, start_index)
+            options: concurrency, batching and row timeout of the run, see RunOptions. Checkpointing, time budgets and scheduling are not supported
+        Returns:
+            The total cost of labeling the dataset
+
+        """
+        options = options or RunOptions()
+        unsupported = [
+            name
+            for name in ("checkpoint_dir", "run_id", "time_budget", "schedule")
+            if getattr(options, name) is not None
+        ]
+        if unsupported:
+            raise ValueError(
+                f"Streaming runs do not support the run options {', '.join(unsupported)}",
+            )
+        if not isinstance(dataset, StreamingDataset):
+            dataset = StreamingDataset(
+                dataset, self.config, max_items=max_items, start_index=start_index,
+            )
+        rows = iter(dataset)
+        first_row = next(rows, None)
+        if first_row is None:
+            logger.warning("Dataset is empty, nothing to label")
+            return 0.0
+        self._initialize_selectors(list(first_row.keys()))
+        self._initialize_prompt_caching()
+
+        # Input rows are kept only while they are being labeled or waiting for the
+        # rows before them to be written
+        input_rows = {}
+
+        def track_rows(rows: Iterable[Dict]) -> Iterable[Dict]:
+            for index, row in enumerate(rows):
+                input_rows[index] = row
+                yield row
+
+        cost = 0.0
+        num_prompt_tokens, num_cached_tokens = 0, 0
+        postfix_dict = {}
+        pipeline = StagedPipeline(num_workers=options.num_workers)
+        deduplicator = PromptDeduplicator() if options.deduplicate else None
+        results = self._dispatch_rows(
+            track_rows(itertools.chain([first_row], rows)),
+            options,
+            pipeline=pipeline,
+            deduplicator=deduplicator,
+            # Rows are written in order, so the rows that finished while an earlier
+            # row is still being labeled are buffered. Bound them by the number of
+            # rows in flight
+            max_reorder=options.max_concurrency * options.batch_size,
+        )
+        if self.console_output:
+            results = atrack_with_stats(
+                results, postfix_dict, total=None, console=self.console,
+            )
+        elif self.use_tqdm:
+            results = tqdm_asyncio(results)
+
+        completed_rows = {}
+        next_index = 0
+        try:
+            with SinkFactory.from_path(
+                output_name,
+                config=self.config,
+                fieldnames=dataset.output_columns(first_row.keys()),
+            ) as sink:
+                buffer = []
+                async for current_index, (annotation, row_cost) in results:
+                    completed_rows[current_index] = dataset.annotation_to_row(
+                        input_rows.pop(current_index), annotation,
+                    )
+                    while next_index in completed_rows:
+                        buffer.append(completed_rows.pop(next_index))
+                        next_index += 1
+                    if len(buffer) >= self.STREAMING_WRITE_BATCH_SIZE:
+                        sink.write(buffer)
+                        buffer = []
+
+                    cost += row_cost
+                    num_prompt_tokens += annotation.input_tokens or 0
+                    num_cached_tokens += annotation.cached_input_tokens or 0
+                    postfix_dict[self.COST_KEY] = f"{cost:.2f}"
+                    if options.num_workers > 0:
+                        postfix_dict.update(pipeline.queue_depths())
+                sink.write(buffer)
+        finally:
+            pipeline.close()
+
+        self.console.print(f"Actual Cost: {maybe_round(cost)}")
+        if deduplicator:
+            self._print_dedup_summary(deduplicator)
+        if self.config.prompt_caching():
+            self._print_prompt_caching_summary(num_cached_tokens, num_prompt_tokens)
+        return cost
+
+    def _row_gt_labels(self, dataset: AutolabelDataset, index: int) -> Optional[Dict]:
+        """Returns the ground truth labels of a row, keyed by attribute name"""
+        if isinstance(dataset.gt_labels, dict):
+            return {k: v[index] for k, v in dataset.gt_labels.items()}
+        return None
+
+    def _get_run_id(self, dataset: AutolabelDataset) -> str:
+        """Returns an id for labeling the dataset with the current config, used to find the checkpoint journal of the run"""
+        dataset_hash = pd.util.hash_pandas_object(dataset.df, index=False).sum()
+        return calculate_md5(
+            {"config": self.config.config, "dataset": str(dataset_hash)},
+        )
+
+    def _initialize_selectors(self, columns: List[str]) -> None:
+        """Initializes the few shot example selector and the label selectors if they were not passed in."""
         # Get the seed examples from the dataset config
         seed_examples = self.config.few_shot_example_set()
 
@@ -215,7 +593,7 @@ class LabelingAgent:
             self.example_selector = ExampleSelectorFactory.initialize_selector(
                 self.config,
                 [safe_serialize_to_string(example) for example in seed_examples],
-                dataset.df.keys().tolist(),
+                columns,
                 cache=self.generation_cache is not None,
             )
 
@@ -239,220 +617,658 @@ class LabelingAgent:
                     )
                     self.label_selector_map[attribute["name"]] = label_selector
 
-        current_index = 0
-        cost = 0.0
-        postfix_dict = {}
+    def _initialize_prompt_caching(self) -> None:
+        """Tells the LLM which start of the prompt is the same for every row, if prompt caching is enabled"""
+        if not self.config.prompt_caching():
+            return
+        # Only fixed seed examples are the same for every row, unless they are
+        # filtered by the labels selected for the row
+        examples = None
+        if self.example_selector is None:
+            examples = []
+        elif (
+            isinstance(self.example_selector, FixedExampleSelector)
+            and not self.label_selector_map
+        ):
+            examples = self.example_selector.select_examples("")
+        self.llm.cacheable_prefix = self.task.static_prompt_prefix(examples) or None
 
-        indices = range(current_index, len(dataset.inputs))
-        selected_labels = None
-        for current_index in (
-            track_with_stats(
-                indices,
-                postfix_dict,
-                total=len(dataset.inputs) - current_index,
-                console=self.console,
+    def _dispatch_rows(
+        self,
+        rows: Iterable[Dict],
+        options: RunOptions,
+        pipeline: Optional[StagedPipeline] = None,
+        deduplicator: Optional[PromptDeduplicator] = None,
+        run_deadline: Optional[Deadline] = None,
+        constructed_prompts: Optional[Dict[int, Tuple]] = None,
+        max_reorder: Optional[int] = None,
+    ) -> AsyncIterator[Tuple[int, Tuple[LLMAnnotation, float]]]:
+        """Labels rows concurrently and yields (index, (annotation, cost)) in completion order. With max_reorder, no row is sent more than max_reorder rows after the earliest unfinished row."""
+        batcher = (
+            MicroBatcher(
+                self.llm,
+                batch_size=options.batch_size,
+                max_batch_tokens=options.max_batch_tokens,
             )
-            if self.console_output
-            else tqdm(indices)
-            if self.use_tqdm
-            else indices
-        ):
-            chunk = dataset.inputs[current_index]
-            examples = []
+            if options.batch_size > 1
+            else None
+        )
+        controller = (
+            AIMDConcurrencyController(
+                max_concurrency=options.max_concurrency,
+                initial_concurrency=max(1, options.max_concurrency // 2),
+            )
+            if options.adaptive_concurrency
+            else None
+        )
+        # Keep enough rows in flight to fill max_concurrency batches
+        dispatcher = BoundedDispatcher(
+            max_concurrency=options.max_concurrency,
+            controller=controller,
+            batch_size=options.batch_size,
+            max_reorder=max_reorder,
+        )
+        return dispatcher.map(
+            functools.partial(
+                self._label_row,
+                batcher=batcher,
+                requeue_errors=options.adaptive_concurrency,
+                pipeline=pipeline or StagedPipeline(),
+                deduplicator=deduplicator,
+                row_timeout=options.row_timeout,
+                run_deadline=run_deadline,
+                constructed_prompts=constructed_prompts,
+            ),
+            rows,
+        )
 
-            if self.label_selector_map:
-                # Create toEmbed string using the example template from the config
-                example_template = self.config.example_template()
-                toEmbed = example_template.format_map(defaultdict(str, chunk))
-                selected_labels_map = {}
-                selected_labels_desc_map = {}
-                for attribute in self.config.attributes():
-                    attribute_name = attribute.get("name")
-                    label_selector = self.label_selector_map.get(attribute_name)
-                    if label_selector:
-                        (
-                            selected_labels,
-                            selected_labels_desc,
-                        ) = label_selector.select_labels(toEmbed)
-                        selected_labels_map[attribute_name] = selected_labels
-                        selected_labels_desc_map[attribute_name] = selected_labels_desc
-                if self.example_selector:
-                    examples = self.example_selector.select_examples(
-                        safe_serialize_to_string(chunk),
-                        selected_labels_map=selected_labels_map,
-                    )
-            elif self.example_selector:
-                examples = self.example_selector.select_examples(
-                    safe_serialize_to_string(chunk),
-                )
+    async def _label_row(
+        self,
+        chunk: Dict,
+        batcher: Optional[MicroBatcher] = None,
+        requeue_errors: bool = False,
+        pipeline: Optional[StagedPipeline] = None,
+        deduplicator: Optional[PromptDeduplicator] = None,
+        row_timeout: Optional[float] = None,
+        run_deadline: Optional[Deadline] = None,
+        constructed_prompts: Optional[Dict[int, Tuple]] = None,
+    ) -> Tuple[LLMAnnotation, float]:
+        """
+        Labels a single row of the dataset.
+
+        Args:
+            chunk: the row to be labeled
+            batcher: if provided, the prompt is sent to the LLM as part of a batch
+            requeue_errors: if True, raises RequeueItem when the LLM call fails with a rate limit or timeout error so that the row is retried
+            pipeline: runs the prompt construction and response parsing stages, in worker threads if it has any
+            deduplicator: if provided, the LLM is only called if no identical prompt was labeled before in the run
+            row_timeout: maximum number of seconds spent labeling the row, including retries
+            run_deadline: deadline of the whole run
+            constructed_prompts: prompts that were constructed ahead of time, keyed by the id() of their row
+        Returns:
+            The annotation for the row and the cost incurred while labeling it
 
-            # Construct Prompt to pass to LLM
-            final_prompt, output_schema = self.task.construct_prompt(
+        """
+        pipeline = pipeline or StagedPipeline()
+        deadline = Deadline.earliest(
+            run_deadline, Deadline.after(row_timeout) if row_timeout else None,
+        )
+        with deadline_scope(deadline):
+            return await self._label_row_before_deadline(
                 chunk,
-                examples,
-                selected_labels_map=selected_labels_map
-                if self.label_selector_map
-                else None,
-                selected_labels_desc_map=selected_labels_desc_map
-                if self.label_selector_map
-                else None,
-                max_input_tokens=self.llm.max_context_length,
-                get_num_tokens=self.llm.get_num_tokens,
+                batcher=batcher,
+                requeue_errors=requeue_errors,
+                pipeline=pipeline,
+                deduplicator=deduplicator,
+                deadline=deadline,
+                constructed_prompts=constructed_prompts,
+            )
+
+    async def _label_row_before_deadline(
+        self,
+        chunk: Dict,
+        batcher: Optional[MicroBatcher],
+        requeue_errors: bool,
+        pipeline: StagedPipeline,
+        deduplicator: Optional[PromptDeduplicator],
+        deadline: Optional[Deadline],
+        constructed_prompts: Optional[Dict[int, Tuple]] = None,
+    ) -> Tuple[LLMAnnotation, float]:
+        if constructed_prompts and id(chunk) in constructed_prompts:
+            (
+                final_prompt,
+                output_schema,
+                selected_labels_map,
+            ) = constructed_prompts.pop(id(chunk))
+        else:
+            (
+                final_prompt,
+                output_schema,
+                selected_labels_map,
+            ) = await pipeline.run_blocking(
+                "prompt", self._construct_row_prompt, chunk,
             )
-            response = await self.llm.label([final_prompt], output_schema)
-            for i, generations, error, latency in zip(
-                range(len(response.generations)),
-                response.generations,
-                response.errors,
-                response.latencies,
+        if self.config.self_consistency_samples() > 1:
+            annotations, error, cost = await self._sample_row_annotations(
+                chunk,
+                final_prompt,
+                output_schema,
+                selected_labels_map,
+                num_samples=self.config.self_consistency_samples(),
+                pipeline=pipeline,
+                batcher=batcher,
+                deduplicator=deduplicator,
+                deadline=deadline,
+            )
+            annotation = await self._aggregate_row_annotations(
+                annotations, error=error,
+            )
+            annotation.cost = cost
+            if (
+                requeue_errors
+                and error is not None
+                and error.error_type in self.REQUEUE_ERROR_TYPES
             ):
-                input_tokens = self.llm.get_num_tokens(final_prompt)
-                if error is not None:
-                    annotation = LLMAnnotation(
-                        successfully_labeled=False,
-                        label=self.task.NULL_LABEL_TOKEN,
-                        raw_response="",
-                        curr_sample=pickle.dumps(chunk),
-                        prompt=final_prompt,
-                        confidence_score=0,
-                        error=error,
-                        input_tokens=input_tokens,
-                        cost=0,
-                        latency=0,
-                    )
-                else:
-                    annotations = []
-                    for generation in generations:
-                        annotation = self.task.parse_llm_response(
-                            generation,
-                            chunk,
-                            final_prompt,
-                            selected_labels_map=selected_labels_map
-                            if self.label_selector_map
-                            else None,
-                        )
-                        annotation.input_tokens = input_tokens
-                        annotation.output_tokens = self.llm.get_num_tokens(
-                            annotation.raw_response,
-                        )
-                        annotation.cost = sum(response.costs)
-                        annotation.latency = latency
-
-                        if self.config.confidence():
-                            try:
-                                keys = (
-                                    {
-                                        attribute_dict.get(
-                                            "name", "",
-                                        ): attribute_dict.get("task_type", "")
-                                        for attribute_dict in self.config.attributes()
-                                    }
-                                    if self.config.task_type()
-                                    == TaskType.ATTRIBUTE_EXTRACTION
-                                    else None
-                                )
-                                annotation.confidence_score = (
-                                    await self.confidence.calculate(
-                                        model_generation=annotation, keys=keys,
-                                    )
-                                )
-                            except Exception as e:
-                                logger.exception(
-                                    f"Error calculating confidence score: {e}",
-                                )
-                                logger.warning(
-                                    f"Could not calculate confidence score for annotation: {annotation}",
-                                )
-                                annotation.confidence_score = {}
-                        annotations.append(annotation)
-                    annotation = self.majority_annotation(annotations)
-
-                llm_labels.append(annotation)
-
-            cost += sum(response.costs)
-            postfix_dict[self.COST_KEY] = f"{cost:.2f}"
-
-            # Evaluate the task every eval_every examples
-            if not skip_eval and (current_index + 1) % 100 == 0:
-                if dataset.gt_labels:
-                    eval_result = self.task.eval(
-                        llm_labels,
-                        (
-                            dataset.gt_labels[: len(llm_labels)]
-                            if isinstance(dataset.gt_labels, list)
-                            else {
-                                k: v[: len(llm_labels)]
-                                for k, v in dataset.gt_labels.items()
-                            }
+                raise RequeueItem(result=(annotation, cost))
+            return annotation, cost
+
+        label_func = functools.partial(self._request_label, batcher=batcher)
+        async with pipeline.track("llm"):
+            if deduplicator is not None:
+                request = deduplicator.label(final_prompt, output_schema, label_func)
+            else:
+                request = label_func(final_prompt, output_schema)
+            response = await self._await_before_deadline(request, deadline)
+        annotations = await pipeline.run_blocking(
+            "parse",
+            self._parse_row_generations,
+            chunk,
+            final_prompt,
+            generations=response.generations[0],
+            error=response.errors[0],
+            latency=response.latencies[0],
+            cost=sum(response.costs),
+            selected_labels_map=selected_labels_map,
+            cached_tokens=(response.cached_tokens[0] if response.cached_tokens else 0),
+        )
+        annotation = await self._aggregate_row_annotations(
+            annotations, error=response.errors[0],
+        )
+        if (
+            requeue_errors
+            and response.errors[0] is not None
+            and response.errors[0].error_type in self.REQUEUE_ERROR_TYPES
+        ):
+            raise RequeueItem(result=(annotation, sum(response.costs)))
+        return annotation, sum(response.costs)
+
+    async def _sample_row_annotations(
+        self,
+        chunk: Dict,
+        final_prompt: str,
+        output_schema: Optional[Dict],
+        selected_labels_map: Optional[Dict[str, List[str]]],
+        num_samples: int,
+        pipeline: StagedPipeline,
+        batcher: Optional[MicroBatcher] = None,
+        deduplicator: Optional[PromptDeduplicator] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Tuple[List[LLMAnnotation], Optional[LabelingError], float]:
+        """
+        Draws num_samples generations for a row concurrently and stops as soon as no
+        label can overtake the leading one, cancelling the outstanding requests.
+        Samples are batched, deduplicated and cut off at the deadline like the
+        prompts of rows without self-consistency.
+
+        Returns:
+            The annotations of the samples that completed, the error if no sample succeeded, and the cost of all completed samples
+
+        """
+        label_func = functools.partial(
+            self._request_label, batcher=batcher, use_cache=False,
+        )
+
+        def request_sample(sample: int) -> Awaitable[RefuelLLMResult]:
+            if deduplicator is not None:
+                # Rows with the same prompt share their samples
+                return deduplicator.label(
+                    final_prompt, output_schema, label_func, sample=sample,
+                )
+            return label_func(final_prompt, output_schema)
+
+        samples = [
+            asyncio.ensure_future(
+                self._await_before_deadline(request_sample(sample), deadline),
+            )
+            for sample in range(num_samples)
+        ]
+        annotations = []
+        errors = []
+        cost = 0.0
+        votes = defaultdict(int)
+        try:
+            async with pipeline.track("llm"):
+                for num_done, sample in enumerate(asyncio.as_completed(samples), 1):
+                    response = await sample
+                    cost += sum(response.costs)
+                    if response.errors[0] is not None:
+                        errors.append(response.errors[0])
+                        continue
+                    sample_annotations = await pipeline.run_blocking(
+                        "parse",
+                        self._parse_row_generations,
+                        chunk,
+                        final_prompt,
+                        generations=response.generations[0],
+                        error=None,
+                        latency=response.latencies[0],
+                        cost=sum(response.costs),
+                        selected_labels_map=selected_labels_map,
+                        cached_tokens=(
+                            response.cached_tokens[0] if response.cached_tokens else 0
                         ),
-                        additional_metrics=additional_metrics,
                     )
+                    annotations.extend(sample_annotations)
+                    for sample_annotation in sample_annotations:
+                        votes[str(sample_annotation.label)] += 1
+                    counts = sorted(votes.values(), reverse=True) + [0, 0]
+                    if counts[0] > counts[1] + (num_samples - num_done):
+                        break
+        finally:
+            cancelled = [sample for sample in samples if not sample.done()]
+            for sample in cancelled:
+                sample.cancel()
+            await asyncio.gather(*cancelled, return_exceptions=True)
+        if cancelled:
+            logger.debug(
+                f"Majority reached early, cancelled {len(cancelled)} of {num_samples} samples",
+            )
 
-                    for m in eval_result:
-                        # This is a row wise metric
-                        if isinstance(m.value, list):
-                            continue
-                        if m.show_running:
-                            postfix_dict[m.name] = (
-                                f"{m.value:.4f}"
-                                if isinstance(m.value, float)
-                                else m.value
-                            )
+        if annotations:
+            return annotations, None, cost
+        # Every sample failed, or returned no generations
+        error = (
+            errors[0]
+            if errors
+            else LabelingError(
+                error_type=ErrorType.INVALID_LLM_RESPONSE_ERROR,
+                error_message="No sample returned a generation",
+            )
+        )
+        annotations = self._parse_row_generations(
+            chunk,
+            final_prompt,
+            generations=[],
+            error=error,
+            latency=0,
+            cost=cost,
+            selected_labels_map=selected_labels_map,
+        )
+        return annotations, error, cost
 
-        eval_result = None
-        table = {}
+    async def _escalate_rows(
+        self,
+        dataset: AutolabelDataset,
+        llm_labels: List[Optional[LLMAnnotation]],
+        options: RunOptions,
+    ) -> float:
+        """
+        Relabels the rows whose confidence is below the threshold of the next model in
+        the cascade with that model, for every model in turn, and merges the
+        annotations into llm_labels. Every model is run with the given options.
 
-        # if true labels are provided, evaluate accuracy of predictions
-        if not skip_eval and dataset.gt_labels:
-            eval_result = self.task.eval(
-                llm_labels,
-                (
-                    dataset.gt_labels[: len(llm_labels)]
-                    if isinstance(dataset.gt_labels, list)
-                    else {k: v[: len(llm_labels)] for k, v in dataset.gt_labels.items()}
+        Returns:
+            The cost of labeling the escalated rows
+
+        """
+        cost = 0.0
+        for tier in self.config.cascade():
+            threshold = tier[AutolabelConfig.ESCALATE_BELOW_KEY]
+            indices = [
+                i
+                for i, annotation in enumerate(llm_labels)
+                if annotation is not None
+                and self._needs_escalation(annotation, threshold)
+            ]
+            if not indices:
+                continue
+            self.console.print(
+                f"Escalating {len(indices)} of {len(llm_labels)} rows to {tier['name']}",
+            )
+            tier_agent = self._cascade_agent(tier)
+            escalated = await tier_agent.arun(
+                AutolabelDataset(
+                    dataset.df.iloc[indices].reset_index(drop=True), tier_agent.config,
                 ),
-                additional_metrics=additional_metrics,
+                skip_eval=True,
+                options=options,
             )
-            # TODO: serialize and write to file
-            for m in eval_result:
-                if isinstance(m.value, list):
-                    continue
-                if m.show_running:
-                    table[m.name] = m.value
-                else:
-                    self.console.print(f"{m.name}:\n{m.value}")
+            for i, annotation in zip(
+                indices, escalated.df[escalated.generate_label_name("annotation")],
+            ):
+                cost += annotation.cost or 0.0
+                llm_labels[i] = self._merge_escalated(
+                    llm_labels[i], annotation, threshold,
+                )
+        return cost
+
+    def _cascade_agent(self, tier: Dict) -> "LabelingAgent":
+        """Creates an agent that labels with the given model of the cascade and otherwise shares this agent's config"""
+        config = copy.deepcopy(self.config.config)
+        model = {k: v for k, v in tier.items() if k != AutolabelConfig.ESCALATE_BELOW_KEY}
+        model.setdefault(AutolabelConfig.COMPUTE_CONFIDENCE_KEY, True)
+        config[AutolabelConfig.MODEL_CONFIG_KEY] = model
+        return LabelingAgent(
+            config=config,
+            example_selector=self.example_selector,
+            label_selector_map=self.label_selector_map,
+            console_output=self.console_output,
+            generation_cache=self.generation_cache,
+            transform_cache=self.transform_cache,
+            confidence_cache=self.confidence_cache,
+            confidence_tokenizer=self._confidence_tokenizer,
+            confidence_endpoint=self.confidence.endpoint,
+            use_tqdm=self.use_tqdm,
+        )
 
-        self.eval_result = eval_result
+    @staticmethod
+    def _needs_escalation(annotation: LLMAnnotation, threshold: float) -> bool:
+        if not annotation.successfully_labeled or annotation.confidence_score is None:
+            return True
+        if isinstance(annotation.confidence_score, dict):
+            return any(
+                score < threshold for score in annotation.confidence_score.values()
+            )
+        return annotation.confidence_score < threshold
 
-        # print cost
-        self.console.print(f"Actual Cost: {maybe_round(cost)}")
-        print_table(table, console=self.console, default_style=METRIC_TABLE_STYLE)
+    @staticmethod
+    def _merge_escalated(
+        annotation: LLMAnnotation, escalated: LLMAnnotation, threshold: float,
+    ) -> LLMAnnotation:
+        """
+        Merges the annotation of a row from a stronger model into the previous one. For
+        attribute extraction only the attributes below threshold are taken from the
+        stronger model, otherwise the whole annotation is replaced.
+        """
+        cost = (annotation.cost or 0.0) + (escalated.cost or 0.0)
+        if not escalated.successfully_labeled:
+            merged = annotation.copy()
+        elif (
+            annotation.successfully_labeled
+            and isinstance(annotation.label, dict)
+            and isinstance(annotation.confidence_score, dict)
+            and isinstance(escalated.confidence_score, dict)
+        ):
+            merged = annotation.copy(deep=True)
+            for key, score in annotation.confidence_score.items():
+                if score < threshold and key in escalated.label:
+                    merged.label[key] = escalated.label[key]
+                    merged.confidence_score[key] = escalated.confidence_score.get(
+                        key, 0.0,
+                    )
+        else:
+            merged = escalated.copy()
+        merged.cost = cost
+        return merged
 
-        dataset.process_labels(llm_labels, eval_result)
-        # Only save to csv if output_name is provided or dataset is a string
-        if not output_name and isinstance(dataset, str):
-            output_name = (
-                dataset.rsplit(".", 1)[0] + "_labeled." + dataset.rsplit(".", 1)[1]
+    async def _schedule_rows(
+        self,
+        dataset: AutolabelDataset,
+        pending_indices: List[int],
+        schedule: Union[str, SchedulingStrategy],
+        pipeline: StagedPipeline,
+    ) -> Tuple[List[int], Dict[int, Tuple]]:
+        """Constructs the prompts of the pending rows and orders the rows by the number of tokens in their prompts."""
+        constructed = await asyncio.gather(
+            *[
+                pipeline.run_blocking(
+                    "prompt", self._construct_row_prompt, dataset.inputs[i],
+                )
+                for i in pending_indices
+            ],
+        )
+        num_tokens = [self.llm.get_num_tokens(prompt) for prompt, _, _ in constructed]
+        order = SizeAwareScheduler(schedule).order(num_tokens)
+        # Rows are dicts, which are not hashable, so they are keyed by identity
+        constructed_prompts = {
+            id(dataset.inputs[i]): prompt
+            for i, prompt in zip(pending_indices, constructed)
+        }
+        return [pending_indices[j] for j in order], constructed_prompts
+
+    @staticmethod
+    def _rows_before_deadline(
+        rows: Iterable[Dict], deadline: Optional[Deadline],
+    ) -> Iterable[Dict]:
+        for row in rows:
+            if deadline is not None and deadline.expired():
+                return
+            yield row
+
+    def _missed_deadline(self, annotation: LLMAnnotation) -> bool:
+        return (
+            annotation.error is not None
+            and annotation.error.error_type == ErrorType.DEADLINE_EXCEEDED_ERROR
+        )
+
+    def _deadline_annotation(self, chunk: Dict) -> LLMAnnotation:
+        """Annotation for a row that was not dispatched before the run deadline"""
+        return LLMAnnotation(
+            successfully_labeled=False,
+            label=self.task.NULL_LABEL_TOKEN,
+            raw_response="",
+            curr_sample=pickle.dumps(chunk),
+            prompt="",
+            confidence_score=0,
+            error=deadline_exceeded_error(),
+            cost=0,
+            latency=0,
+        )
+
+    async def _request_label(
+        self,
+        prompt: str,
+        output_schema: Optional[Dict],
+        batcher: Optional[MicroBatcher] = None,
+        use_cache: bool = True,
+    ) -> RefuelLLMResult:
+        """Sends a single prompt to the LLM, as part of a batch if a batcher is provided."""
+        if batcher is not None:
+            return await batcher.label(prompt, output_schema, use_cache=use_cache)
+        return await self.llm.label([prompt], output_schema, use_cache=use_cache)
+
+    async def _await_before_deadline(
+        self, request: Awaitable[RefuelLLMResult], deadline: Optional[Deadline],
+    ) -> RefuelLLMResult:
+        """Awaits the result of a single prompt, or returns a DEADLINE_EXCEEDED_ERROR result if the deadline expires first"""
+        if deadline is None:
+            return await request
+        # BaseModel.label honors the deadline itself, this also bounds the time
+        # spent waiting on a batch or a deduplicated prompt
+        try:
+            return await deadline.wait_for(request)
+        except DeadlineExceeded:
+            return RefuelLLMResult(
+                generations=[[]],
+                errors=[deadline_exceeded_error()],
+                costs=[0.0],
+                latencies=[0.0],
             )
 
-        if output_name:
-            dataset.save(output_file_name=output_name)
-        return dataset
+    def _print_dedup_summary(self, deduplicator: PromptDeduplicator) -> None:
+        self.console.print(
+            f"Deduplicated rows: {deduplicator.num_deduplicated} of {deduplicator.num_requests + deduplicator.num_deduplicated} ({deduplicator.dedup_ratio:.1%})",
+        )
+
+    def _print_prompt_caching_summary(
+        self, num_cached_tokens: int, num_prompt_tokens: int,
+    ) -> None:
+        cached_ratio = num_cached_tokens / num_prompt_tokens if num_prompt_tokens else 0
+        self.console.print(
+            f"Cached prompt tokens: {num_cached_tokens} of {num_prompt_tokens} ({cached_ratio:.1%})",
+        )
+
+    def _construct_row_prompt(
+        self, chunk: Dict,
+    ) -> Tuple[str, Dict, Optional[Dict[str, List[str]]]]:
+        """Selects labels and few shot examples for a row and constructs the prompt to send to the LLM."""
+        examples = []
+        selected_labels_map = None
+        selected_labels_desc_map = None
+
+        if self.label_selector_map:
+            # Create toEmbed string using the example template from the config
+            example_template = self.config.example_template()
+            toEmbed = example_template.format_map(defaultdict(str, chunk))
+            selected_labels_map = {}
+            selected_labels_desc_map = {}
+            for attribute in self.config.attributes():
+                attribute_name = attribute.get("name")
+                label_selector = self.label_selector_map.get(attribute_name)
+                if label_selector:
+                    (
+                        selected_labels,
+                        selected_labels_desc,
+                    ) = label_selector.select_labels(toEmbed)
+                    selected_labels_map[attribute_name] = selected_labels
+                    selected_labels_desc_map[attribute_name] = selected_labels_desc
+            if self.example_selector:
+                examples = self.example_selector.select_examples(
+                    safe_serialize_to_string(chunk),
+                    selected_labels_map=selected_labels_map,
+                )
+        elif self.example_selector:
+            examples = self.example_selector.select_examples(
+                safe_serialize_to_string(chunk),
+            )
+
+        # Construct Prompt to pass to LLM
+        final_prompt, output_schema = self.task.construct_prompt(
+            chunk,
+            examples,
+            selected_labels_map=selected_labels_map,
+            selected_labels_desc_map=selected_labels_desc_map,
+            max_input_tokens=self.llm.max_context_length,
+            get_num_tokens=self.llm.get_num_tokens,
+            get_token_offsets=self.llm.get_token_offsets,
+        )
+        return final_prompt, output_schema, selected_labels_map
+
+    def _parse_row_generations(
+        self,
+        chunk: Dict,
+        final_prompt: str,
+        generations: List,
+        error: Optional[LabelingError],
+        latency: float,
+        cost: float,
+        selected_labels_map: Optional[Dict[str, List[str]]] = None,
+        cached_tokens: int = 0,
+    ) -> List[LLMAnnotation]:
+        """Parses each of the LLM generations for a row into an annotation."""
+        input_tokens = self.llm.get_num_tokens(final_prompt)
+        if error is not None:
+            return [
+                LLMAnnotation(
+                    successfully_labeled=False,
+                    label=self.task.NULL_LABEL_TOKEN,
+                    raw_response="",
+                    curr_sample=pickle.dumps(chunk),
+                    prompt=final_prompt,
+                    confidence_score=0,
+                    error=error,
+                    input_tokens=input_tokens,
+                    cost=0,
+                    latency=0,
+                ),
+            ]
+
+        annotations = []
+        for generation in generations:
+            annotation = self.task.parse_llm_response(
+                generation,
+                chunk,
+                final_prompt,
+                selected_labels_map=selected_labels_map,
+            )
+            annotation.input_tokens = input_tokens
+            annotation.cached_input_tokens = cached_tokens
+            annotation.output_tokens = self.llm.get_num_tokens(
+                annotation.raw_response,
+            )
+            annotation.cost = cost
+            annotation.latency = latency
+            annotations.append(annotation)
+        return annotations
+
+    async def _aggregate_row_annotations(
+        self, annotations: List[LLMAnnotation], error: Optional[LabelingError] = None,
+    ) -> LLMAnnotation:
+        """Computes confidence for the annotations of a row if configured, and returns the majority annotation."""
+        if not self.config.confidence() or error is not None:
+            return self.majority_annotation(annotations)
+
+        keys = (
+            {
+                attribute_dict.get("name", ""): attribute_dict.get("task_type", "")
+                for attribute_dict in self.config.attributes()
+            }
+            if self.config.task_type() == TaskType.ATTRIBUTE_EXTRACTION
+            else None
+        )
+        for annotation in annotations:
+            try:
+                annotation.confidence_score = await self.confidence.calculate(
+                    model_generation=annotation, keys=keys,
+                )
+            except Exception as e:
+                logger.exception(
+                    f"Error calculating confidence score: {e}",
+                )
+                logger.warning(
+                    f"Could not calculate confidence score for annotation: {annotation}",
+                )
+                annotation.confidence_score = {}
+        return self.majority_annotation(annotations)
 
     def plan(
         self,
-        dataset: AutolabelDataset,
+        dataset: Union[AutolabelDataset, str],
         max_items: Optional[int] = None,
         start_index: int = 0,
-    ) -> None:
+        max_concurrency: int = 1,
+        samples_per_stratum: int = RunPlanner.DEFAULT_SAMPLES_PER_STRATUM,
+        seconds_per_request: float = RunPlanner.DEFAULT_SECONDS_PER_REQUEST,
+    ) -> RunPlan:
         """
-        Calculates and prints the cost of calling autolabel.run() on a given dataset
+        Estimates and prints the cost and duration of calling autolabel.run() on a given dataset. The estimate is computed from a sample of rows stratified by input length, so a dataset file is streamed once and never loaded into memory.
 
         Args:
-            dataset: path to a CSV dataset
+            dataset: the dataset, or path to a csv/jsonl/parquet file
+            max_items: maximum number of rows to plan for
+            start_index: first row to plan for
+            max_concurrency: number of rows that would be labeled at the same time
+            samples_per_stratum: number of rows sampled from each input length stratum
+            seconds_per_request: assumed latency of a single provider request
+        Returns:
+            RunPlan with the estimated cost, tokens and wall-clock time
 
         """
-        dataset = dataset.get_slice(max_items=max_items, start_index=start_index)
+        if isinstance(dataset, str):
+            chunks = StreamingDataset(
+                dataset,
+                self.config,
+                max_items=max_items,
+                start_index=start_index,
+                chunk_size=RunPlanner.DEFAULT_CHUNK_SIZE,
+            ).chunks()
+            first_chunk = next(chunks, pd.DataFrame())
+            columns = first_chunk.columns.tolist()
+            chunks = itertools.chain([first_chunk], chunks)
+        else:
+            dataset = dataset.get_slice(max_items=max_items, start_index=start_index)
+            chunks = [dataset.df]
+            columns = dataset.df.keys().tolist()
 
         if (
             self.config.confidence()
@@ -463,9 +1279,6 @@ class LabelingAgent:
                 "REFUEL_API_KEY environment variable must be set to compute confidence scores. You can request an API key at https://refuel-ai.typeform.com/llm-access.",
             )
 
-        prompt_list = []
-        total_cost = 0
-
         # Get the seed examples from the dataset config
         seed_examples = self.config.few_shot_example_set()
 
@@ -487,50 +1300,61 @@ class LabelingAgent:
         self.example_selector = ExampleSelectorFactory.initialize_selector(
             self.config,
             [safe_serialize_to_string(example) for example in seed_examples],
-            dataset.df.keys().tolist(),
+            columns,
             cache=self.generation_cache is not None,
         )
 
-        input_limit = min(len(dataset.inputs), 100) if max_items is None else max_items  # type: ignore
-        for input_i in track(
-            dataset.inputs[:input_limit],
-            description="Generating Prompts...",
-            console=self.console,
-        ):
-            # TODO: Check if this needs to use the example selector
+        def build_prompt(row: Dict) -> str:
             if self.example_selector:
                 examples = self.example_selector.select_examples(
-                    safe_serialize_to_string(input_i),
+                    safe_serialize_to_string(row),
                 )
             else:
                 examples = []
-
-            final_prompt, output_schema = self.task.construct_prompt(
-                input_i,
+            final_prompt, _ = self.task.construct_prompt(
+                row,
                 examples,
                 max_input_tokens=self.llm.max_context_length,
                 get_num_tokens=self.llm.get_num_tokens,
+                get_token_offsets=self.llm.get_token_offsets,
             )
-            prompt_list.append((final_prompt, output_schema))
+            return final_prompt
 
-            # Calculate the number of tokens
-            curr_cost = self.llm.get_cost(prompt=final_prompt, label="")
-            total_cost += curr_cost
+        planner = RunPlanner(
+            self.llm,
+            build_prompt,
+            input_columns=get_format_variables(self.config.example_template()),
+            samples_per_stratum=samples_per_stratum,
+        )
+        with self.console.status("Sampling rows..."):
+            plan = planner.estimate(
+                chunks,
+                max_concurrency=max_concurrency,
+                seconds_per_request=seconds_per_request,
+                requests_per_minute=self.config.requests_per_minute(),
+                tokens_per_minute=self.config.tokens_per_minute(),
+            )
 
-        total_cost = total_cost * (len(dataset.inputs) / input_limit)
         table = {
-            "Total Estimated Cost": f"${maybe_round(total_cost)}",
-            "Number of Examples": len(dataset.inputs),
-            "Average cost per example": f"${maybe_round(total_cost / len(dataset.inputs))}",
+            "Total Estimated Cost": f"${maybe_round(plan.total_cost)}",
+            f"{plan.confidence_level:.0%} Confidence Interval": f"${maybe_round(plan.cost_lower_bound)} - ${maybe_round(plan.cost_upper_bound)}",
+            "Number of Examples": plan.num_rows,
+            "Average cost per example": f"${maybe_round(plan.cost_per_row)}",
+            "Examples Sampled": plan.num_sampled_rows,
+            "Estimated Tokens": plan.total_tokens,
+            "Projected Time": f"{maybe_round(plan.projected_seconds / 60)} minutes",
+            "Limited By": plan.limited_by,
         }
         table = {"parameter": list(table.keys()), "value": list(table.values())}
 
         print_table(
             table, show_header=False, console=self.console, styles=COST_TABLE_STYLES,
         )
-        self.console.rule("Prompt Example")
-        self.console.print(f"{prompt_list[0]}", markup=False)
-        self.console.rule()
+        if plan.example_prompt is not None:
+            self.console.rule("Prompt Example")
+            self.console.print(plan.example_prompt, markup=False)
+            self.console.rule()
+        return plan
 
     async def async_run_transform(
         self, transform: BaseTransform, dataset: AutolabelDataset,
@@ -585,12 +1409,16 @@ class LabelingAgent:
         seed_examples: Union[str, List[Dict]],
         include_label: bool = True,
         return_annotations: bool = False,
+        max_concurrency: int = 1,
+        overwrite: bool = False,
     ) -> List[Dict]:
         return asyncio.run(
             self.agenerate_explanations(
                 seed_examples=seed_examples,
                 include_label=include_label,
                 return_annotations=return_annotations,
+                max_concurrency=max_concurrency,
+                overwrite=overwrite,
             ),
         )
 
@@ -599,8 +1427,20 @@ class LabelingAgent:
         seed_examples: Union[str, List[Dict]],
         include_label: bool = True,
         return_annotations: bool = False,
+        max_concurrency: int = 1,
+        overwrite: bool = False,
     ) -> Union[List[Dict], Tuple[List[Dict], List[LLMAnnotation]]]:
-        """Use LLM to generate explanations for why examples are labeled the way that they are."""
+        """
+        Use LLM to generate explanations for why examples are labeled the way that they are.
+
+        Args:
+            seed_examples: path to a seed file or a list of seed examples. A seed file is updated in place every STREAMING_WRITE_BATCH_SIZE explanations, so an interrupted run keeps its progress.
+            include_label: whether to include the label of the example in the explanation prompt
+            return_annotations: if True, also returns the annotations of the explanations generated in this call, in seed example order
+            max_concurrency: maximum number of concurrent requests to the LLM
+            overwrite: if True, explanations are generated for every example. By default examples that already have an explanation are skipped, so rerunning only generates the missing ones.
+
+        """
         out_file = None
         if isinstance(seed_examples, str):
             out_file = seed_examples
@@ -612,85 +1452,271 @@ class LabelingAgent:
             raise ValueError(
                 "The explanation column needs to be specified in the dataset config.",
             )
-        llm_annotations = []
-        for seed_example in track(
-            seed_examples,
-            description="Generating explanations",
-            console=self.console,
-        ):
-            explanation_prompt = self.task.get_explanation_prompt(
-                seed_example, include_label=include_label,
-            )
-            if self.task.image_cols is not None and len(self.task.image_cols) > 0:
-                explanation_prompt = {"text": explanation_prompt}
-                for col in self.task.image_cols:
-                    if col in seed_example and seed_example[col] is not None:
-                        explanation_prompt[col] = seed_example[col]
-                explanation_prompt = json.dumps(explanation_prompt)
-            response = await self.llm.label([explanation_prompt], output_schema=None)
-            explanation = response.generations[0][0].text
-            seed_example[explanation_column] = str(explanation) if explanation else ""
-            if return_annotations:
-                error = response.errors[0]
-                input_tokens = self.llm.get_num_tokens(explanation_prompt)
-                if error is not None:
-                    annotation = LLMAnnotation(
-                        successfully_labeled=False,
-                        label=self.task.NULL_LABEL_TOKEN,
-                        raw_response=explanation,
-                        curr_sample=pickle.dumps(seed_example),
-                        prompt=explanation_prompt,
-                        confidence_score=0,
-                        error=error,
-                        input_tokens=input_tokens,
-                        cost=0,
-                        latency=0,
-                    )
-                else:
-                    annotation = LLMAnnotation(
-                        successfully_labeled=True,
-                        label=explanation,
-                        raw_response=explanation,
-                        curr_sample=pickle.dumps(seed_example),
-                        prompt=explanation_prompt,
-                        error=None,
-                        input_tokens=input_tokens,
-                        output_tokens=self.llm.get_num_tokens(explanation),
-                        cost=sum(response.costs),
-                        latency=response.latencies[0],
-                    )
-                llm_annotations.append(annotation)
+        pending_indices = [
+            i
+            for i, seed_example in enumerate(seed_examples)
+            if overwrite or not self._has_explanation(seed_example, explanation_column)
+        ]
+        if len(pending_indices) < len(seed_examples):
+            logger.info(
+                f"Skipping {len(seed_examples) - len(pending_indices)} seed examples that already have an explanation",
+            )
+
+        dispatcher = BoundedDispatcher(max_concurrency=max_concurrency)
+        results = dispatcher.map(
+            functools.partial(
+                self._generate_explanation,
+                include_label=include_label,
+                return_annotation=return_annotations,
+            ),
+            (seed_examples[i] for i in pending_indices),
+        )
+        if self.console_output:
+            results = atrack_with_stats(
+                results,
+                {},
+                total=len(pending_indices),
+                description="Generating explanations",
+                console=self.console,
+            )
+
+        llm_annotations = [None] * len(pending_indices)
+        num_unsaved = 0
+        async for pending_index, annotation in results:
+            llm_annotations[pending_index] = annotation
+            num_unsaved += 1
+            if out_file and num_unsaved >= self.STREAMING_WRITE_BATCH_SIZE:
+                self._save_seed_examples(seed_examples, out_file)
+                num_unsaved = 0
 
         if out_file:
-            df = pd.DataFrame.from_records(seed_examples)
-            df.to_csv(out_file, index=False)
+            self._save_seed_examples(seed_examples, out_file)
         if return_annotations:
             return seed_examples, llm_annotations
         return seed_examples
 
-    def generate_synthetic_dataset(self) -> AutolabelDataset:
+    async def _generate_explanation(
+        self,
+        seed_example: Dict,
+        include_label: bool = True,
+        return_annotation: bool = False,
+    ) -> Optional[LLMAnnotation]:
+        """Generates the explanation of a single seed example and stores it in the example."""
+        explanation_prompt = self.task.get_explanation_prompt(
+            seed_example, include_label=include_label,
+        )
+        if self.task.image_cols is not None and len(self.task.image_cols) > 0:
+            explanation_prompt = {"text": explanation_prompt}
+            for col in self.task.image_cols:
+                if col in seed_example and seed_example[col] is not None:
+                    explanation_prompt[col] = seed_example[col]
+            explanation_prompt = json.dumps(explanation_prompt)
+        response = await self.llm.label([explanation_prompt], output_schema=None)
+        explanation = response.generations[0][0].text
+        seed_example[self.config.explanation_column()] = (
+            str(explanation) if explanation else ""
+        )
+        if not return_annotation:
+            return None
+
+        error = response.errors[0]
+        input_tokens = self.llm.get_num_tokens(explanation_prompt)
+        if error is not None:
+            return LLMAnnotation(
+                successfully_labeled=False,
+                label=self.task.NULL_LABEL_TOKEN,
+                raw_response=explanation,
+                curr_sample=pickle.dumps(seed_example),
+                prompt=explanation_prompt,
+                confidence_score=0,
+                error=error,
+                input_tokens=input_tokens,
+                cost=0,
+                latency=0,
+            )
+        return LLMAnnotation(
+            successfully_labeled=True,
+            label=explanation,
+            raw_response=explanation,
+            curr_sample=pickle.dumps(seed_example),
+            prompt=explanation_prompt,
+            error=None,
+            input_tokens=input_tokens,
+            output_tokens=self.llm.get_num_tokens(explanation),
+            cost=sum(response.costs),
+            latency=response.latencies[0],
+        )
+
+    @staticmethod
+    def _has_explanation(seed_example: Dict, explanation_column: str) -> bool:
+        explanation = seed_example.get(explanation_column)
+        return (
+            explanation is not None
+            and not pd.isna(explanation)
+            and str(explanation).strip() != ""
+        )
+
+    @staticmethod
+    def _save_seed_examples(seed_examples: List[Dict], out_file: str) -> None:
+        """Rewrites the seed file, replacing it atomically so that an interrupted write never corrupts it"""
+        df = pd.DataFrame.from_records(seed_examples)
+        tmp_file = f"{out_file}.tmp"
+        if out_file.endswith(".jsonl"):
+            df.to_json(tmp_file, orient="records", lines=True)
+        else:
+            df.to_csv(tmp_file, index=False)
+        os.replace(tmp_file, out_file)
+
+    def generate_synthetic_dataset(
+        self,
+        max_concurrency: int = 1,
+        rows_per_request: int = SYNTHETIC_ROWS_PER_REQUEST,
+        output_name: Optional[str] = None,
+    ) -> AutolabelDataset:
+        return asyncio.run(
+            self.agenerate_synthetic_dataset(
+                max_concurrency=max_concurrency,
+                rows_per_request=rows_per_request,
+                output_name=output_name,
+            ),
+        )
+
+    async def agenerate_synthetic_dataset(
+        self,
+        max_concurrency: int = 1,
+        rows_per_request: int = SYNTHETIC_ROWS_PER_REQUEST,
+        output_name: Optional[str] = None,
+    ) -> AutolabelDataset:
+        """
+        Generates dataset_generation_num_rows rows for every label in the config.
+
+        Args:
+            max_concurrency: maximum number of labels whose rows are generated concurrently
+            rows_per_request: maximum number of rows requested from the LLM at a time. Labels that need more rows are generated over several requests.
+            output_name: if provided, generated rows are written to this file (csv, jsonl or parquet) as soon as they arrive
+        Returns:
+            The generated dataset, ordered by label
+
+        """
+        if not self.config.label_column():
+            raise ValueError(
+                "The label column needs to be specified in the dataset config to generate a synthetic dataset.",
+            )
         columns = get_format_variables(self.config.example_template())
-        df = pd.DataFrame(columns=columns)
-        for label in track(
-            self.config.labels_list(),
-            description="Generating dataset",
-            console=self.console,
-        ):
-            prompt = self.task.get_generate_dataset_prompt(label)
+        if self.config.label_column() not in columns:
+            columns.append(self.config.label_column())
+        labels = self.config.labels_list()
+        sink = (
+            SinkFactory.from_path(output_name, self.config, fieldnames=columns)
+            if output_name
+            else None
+        )
+
+        dispatcher = BoundedDispatcher(max_concurrency=max_concurrency)
+        results = dispatcher.map(
+            functools.partial(
+                self._generate_label_rows,
+                num_rows=self.config.dataset_generation_num_rows(),
+                rows_per_request=rows_per_request,
+                columns=columns,
+                sink=sink,
+            ),
+            labels,
+        )
+        cost = 0.0
+        postfix_dict = {}
+        if self.console_output:
+            results = atrack_with_stats(
+                results,
+                postfix_dict,
+                total=len(labels),
+                description="Generating dataset",
+                console=self.console,
+            )
+
+        label_frames = [[] for _ in labels]
+        try:
+            async for index, (frames, label_cost) in results:
+                label_frames[index] = frames
+                cost += label_cost
+                postfix_dict[self.COST_KEY] = f"{cost:.2f}"
+        finally:
+            if sink:
+                sink.close()
+
+        self.console.print(f"Actual Cost: {maybe_round(cost)}")
+        frames = [frame for frames in label_frames for frame in frames]
+        df = (
+            pd.concat(frames, axis=0, ignore_index=True)
+            if frames
+            else pd.DataFrame(columns=columns)
+        )
+        return AutolabelDataset(df, self.config)
+
+    async def _generate_label_rows(
+        self,
+        label: str,
+        num_rows: int,
+        rows_per_request: int,
+        columns: List[str],
+        sink: Optional[BaseSink] = None,
+    ) -> Tuple[List[pd.DataFrame], float]:
+        """
+        Requests rows for a single label until num_rows rows were generated or
+        MAX_FAILED_GENERATION_REQUESTS requests in a row did not return any rows.
 
-            result = self.llm.label([prompt], output_schema=None)
+        Returns:
+            The generated rows and the cost of generating them
+
+        """
+        frames = []
+        cost = 0.0
+        num_generated = 0
+        num_failed = 0
+        while (
+            num_generated < num_rows
+            and num_failed < self.MAX_FAILED_GENERATION_REQUESTS
+        ):
+            num_requested = min(rows_per_request, num_rows - num_generated)
+            prompt = self.task.get_generate_dataset_prompt(
+                label, num_requested, self.task.dataset_generation_guidelines,
+            )
+            # Every page of a label has the same prompt, so a cached generation
+            # would repeat the rows of the first page
+            result = await self.llm.label(
+                [prompt], output_schema=None, use_cache=False,
+            )
+            cost += sum(result.costs)
+            label_df = None
             if result.errors[0] is not None:
-                self.console.print(
+                logger.warning(
                     f"Error generating rows for label {label}: {result.errors[0]}",
                 )
             else:
-                response = result.generations[0][0].text.strip()
-
-                response = io.StringIO(response)
-                label_df = pd.read_csv(response, sep=self.config.delimiter())
-                label_df[self.config.label_column()] = label
-                df = pd.concat([df, label_df], axis=0, ignore_index=True)
-        return AutolabelDataset(df, self.config)
+                try:
+                    label_df = pd.read_csv(
+                        io.StringIO(result.generations[0][0].text.strip()),
+                        sep=self.config.delimiter(),
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not parse rows generated for {label}: {e}")
+            if label_df is None or label_df.empty:
+                num_failed += 1
+                continue
+
+            num_failed = 0
+            label_df = label_df.head(num_requested)
+            label_df[self.config.label_column()] = label
+            label_df = label_df.reindex(columns=columns)
+            if sink:
+                sink.write(label_df.to_dict(orient="records"))
+            frames.append(label_df)
+            num_generated += len(label_df)
+        if num_generated < num_rows:
+            logger.warning(
+                f"Generated {num_generated} of {num_rows} rows for label {label}",
+            )
+        return frames, cost
 
     def clear_cache(self, use_ttl: bool = True):
         """
@@ -5,3 +5,11 @@ from .classification_report import ClassificationReportMetric
 from .completion_rate import CompletionRateMetric
 from .f1 import F1Metric
 from .support import SupportMetric
+from .running import (
+    RunningAccuracyMetric,
+    RunningAUROCMetric,
+    RunningCompletionRateMetric,
+    RunningEvaluator,
+    RunningMetric,
+    RunningSupportMetric,
+)
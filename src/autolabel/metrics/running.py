@@ -0,0 +1,183 @@
+"""Metrics that are updated one annotation at a time while a labeling run is in progress."""
+
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+from autolabel.schema import LLMAnnotation, MetricResult, MetricType
+
+from .auroc import AUROCMetric
+
+
+class RunningMetric(ABC):
+
+    """
+    A metric that is accumulated in O(1) per annotation, so that it can be reported
+    while labeling without re-evaluating every annotation seen so far.
+    """
+
+    @abstractmethod
+    def update(self, llm_label: LLMAnnotation, gt_label: Any) -> None:
+        pass
+
+    @abstractmethod
+    def result(self) -> List[MetricResult]:
+        pass
+
+    @staticmethod
+    def _is_evaluated(llm_label: LLMAnnotation, gt_label: Any) -> bool:
+        """Annotations with errors or without a ground truth label are left out of the quality metrics, as in the batch metrics"""
+        return llm_label.error is None and gt_label != "nan"
+
+
+class RunningSupportMetric(RunningMetric):
+    def __init__(self) -> None:
+        self.count = 0
+
+    def update(self, llm_label: LLMAnnotation, gt_label: Any) -> None:
+        self.count += 1
+
+    def result(self) -> List[MetricResult]:
+        return [MetricResult(name=MetricType.SUPPORT, value=self.count)]
+
+
+class RunningCompletionRateMetric(RunningMetric):
+    def __init__(self) -> None:
+        self.count = 0
+        self.completed = 0
+
+    def update(self, llm_label: LLMAnnotation, gt_label: Any) -> None:
+        self.count += 1
+        if llm_label.error is None:
+            self.completed += 1
+
+    def result(self) -> List[MetricResult]:
+        completion_rate = self.completed / self.count if self.count > 0 else 0.0
+        return [MetricResult(name=MetricType.COMPLETION_RATE, value=completion_rate)]
+
+
+class RunningAccuracyMetric(RunningMetric):
+
+    """Counts the evaluated and correctly labeled rows and reports accuracy from them"""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.correct = 0
+
+    def update(self, llm_label: LLMAnnotation, gt_label: Any) -> None:
+        if not self._is_evaluated(llm_label, gt_label):
+            return
+        self.count += 1
+        if llm_label.label == gt_label:
+            self.correct += 1
+
+    def result(self) -> List[MetricResult]:
+        accuracy = self.correct / self.count if self.count > 0 else 0.0
+        return [MetricResult(name=MetricType.ACCURACY, value=accuracy)]
+
+
+class RunningAUROCMetric(RunningMetric):
+
+    """
+    Approximates AUROC of the confidence scores from histograms of the scores of
+    correct and incorrect labels. Scores that fall into the same bin count as ties,
+    so the approximation error is bounded by the bin width.
+    """
+
+    DEFAULT_NUM_BINS = 1000
+
+    def __init__(self, num_bins: int = DEFAULT_NUM_BINS) -> None:
+        self.num_bins = num_bins
+        self.positive_counts = [0] * num_bins
+        self.negative_counts = [0] * num_bins
+        self.num_positive = 0
+        self.num_negative = 0
+        self.auroc_metric = AUROCMetric()
+
+    def update(self, llm_label: LLMAnnotation, gt_label: Any) -> None:
+        if not self._is_evaluated(llm_label, gt_label):
+            return
+        match = (
+            self.auroc_metric.similarity_acceptance(llm_label.label, gt_label) > 0.95
+        )
+        confidence = min(max(float(llm_label.confidence_score or 0.0), 0.0), 1.0)
+        bin_index = min(int(confidence * self.num_bins), self.num_bins - 1)
+        if match:
+            self.positive_counts[bin_index] += 1
+            self.num_positive += 1
+        else:
+            self.negative_counts[bin_index] += 1
+            self.num_negative += 1
+
+    def result(self) -> List[MetricResult]:
+        if self.num_positive == 0 or self.num_negative == 0:
+            # all labels are either correct or incorrect
+            auroc = 1 if self.num_positive > 0 else 0
+        else:
+            # Probability that a correct label is scored above an incorrect one
+            negatives_below = 0
+            concordant = 0.0
+            for positives, negatives in zip(self.positive_counts, self.negative_counts):
+                concordant += positives * (negatives_below + 0.5 * negatives)
+                negatives_below += negatives
+            auroc = concordant / (self.num_positive * self.num_negative)
+        return [MetricResult(name=MetricType.AUROC, value=auroc)]
+
+
+class RunningEvaluator:
+
+    """
+    Tracks running metrics for every attribute of the task, mirroring the metric
+    names produced by the task's eval ("<attribute>:<metric>" and "Macro:<metric>").
+    """
+
+    def __init__(self, metrics_factory: Callable[[], List[RunningMetric]]) -> None:
+        self.metrics_factory = metrics_factory
+        self.attribute_metrics: Dict[str, List[RunningMetric]] = {}
+
+    def update(
+        self, llm_label: LLMAnnotation, gt_labels: Optional[Dict[str, Any]],
+    ) -> None:
+        """
+        Adds an annotation to the running metrics.
+
+        Args:
+            llm_label: the annotation for a row
+            gt_labels: mapping from attribute name to the ground truth label of the row
+
+        """
+        if not gt_labels or not isinstance(llm_label.label, dict):
+            return
+        for attribute, value in llm_label.label.items():
+            if attribute not in gt_labels or gt_labels[attribute] is None:
+                continue
+            if attribute not in self.attribute_metrics:
+                self.attribute_metrics[attribute] = self.metrics_factory()
+            attribute_label = LLMAnnotation(
+                successfully_labeled=llm_label.successfully_labeled,
+                label=value,
+                error=llm_label.error,
+                confidence_score=(
+                    llm_label.confidence_score[attribute]
+                    if llm_label.confidence_score
+                    else 0
+                ),
+            )
+            for metric in self.attribute_metrics[attribute]:
+                metric.update(attribute_label, gt_labels[attribute])
+
+    def result(self) -> List[MetricResult]:
+        eval_metrics = []
+        macro_metrics = defaultdict(list)
+        for attribute, metrics in self.attribute_metrics.items():
+            for metric in metrics:
+                for m in metric.result():
+                    eval_metrics.append(
+                        MetricResult(name=f"{attribute}:{m.name}", value=m.value),
+                    )
+                    macro_metrics[m.name].append(m.value)
+        for key, values in macro_metrics.items():
+            eval_metrics.append(
+                MetricResult(name=f"Macro:{key}", value=sum(values) / len(values)),
+            )
+        return eval_metrics
@@ -1,7 +1,7 @@
 from time import time
 from typing import Dict, List, Optional
 
-from langchain.schema import Generation, HumanMessage
+from langchain.schema import Generation, HumanMessage, LLMResult
 from transformers import AutoTokenizer
 
 from autolabel.cache import BaseCache
@@ -16,6 +16,8 @@ class AnthropicLLM(BaseModel):
         "max_tokens_to_sample": 1000,
         "temperature": 0.0,
     }
+    # Reference: https://docs.anthropic.com/en/docs/build-with-claude/prompt-caching
+    PROMPT_CACHING_HEADERS = {"anthropic-beta": "prompt-caching-2024-07-31"}
 
     # Reference: https://www.anthropic.com/api#pricing
     COST_PER_PROMPT_TOKEN = {
@@ -50,6 +52,7 @@ class AnthropicLLM(BaseModel):
         super().__init__(config, cache, tokenizer)
 
         try:
+            import anthropic
             from anthropic._tokenizers import sync_get_tokenizer
             from langchain_anthropic import ChatAnthropic
         except ImportError:
@@ -63,13 +66,56 @@ class AnthropicLLM(BaseModel):
         model_params = config.model_params()
         self.model_params = {**self.DEFAULT_PARAMS, **model_params}
         # initialize LLM
-        self.llm = ChatAnthropic(model=self.model_name, **self.model_params)
+        llm_params = self.model_params
+        if config.prompt_caching():
+            llm_params = {
+                **self.model_params,
+                "default_headers": {
+                    **self.PROMPT_CACHING_HEADERS,
+                    **self.model_params.get("default_headers", {}),
+                },
+            }
+        self.llm = ChatAnthropic(model=self.model_name, **llm_params)
 
         self.tokenizer = sync_get_tokenizer()
+        self.error_type_mapping = {
+            anthropic.RateLimitError: ErrorType.RATE_LIMIT_ERROR,
+            anthropic.APITimeoutError: ErrorType.TIMEOUT_ERROR,
+        }
+
+    def _get_error_type(self, error: Exception) -> ErrorType:
+        for error_cls, error_type in self.error_type_mapping.items():
+            if isinstance(error, error_cls):
+                return error_type
+        return ErrorType.LLM_PROVIDER_ERROR
+
+    def _message(self, prompt: str) -> HumanMessage:
+        """The cacheable prefix of the prompt is sent as its own content block, marked with a cache breakpoint"""
+        prefix, rest = self._split_cacheable_prefix(prompt)
+        if prefix is None:
+            return HumanMessage(content=prompt)
+        return HumanMessage(
+            content=[
+                {
+                    "type": "text",
+                    "text": prefix,
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {"type": "text", "text": rest},
+            ],
+        )
+
+    def _cached_tokens(self, result: LLMResult) -> List[int]:
+        cached_tokens = []
+        for generations in result.generations:
+            message = getattr(generations[0], "message", None) if generations else None
+            usage = (message.response_metadata if message else {}).get("usage") or {}
+            cached_tokens.append(usage.get("cache_read_input_tokens") or 0)
+        return cached_tokens
 
     async def _alabel(self, prompts: List[str], output_schema: Dict) -> RefuelLLMResult:
         try:
-            prompts = [[HumanMessage(content=prompt)] for prompt in prompts]
+            prompts = [[self._message(prompt)] for prompt in prompts]
             start_time = time()
             result = await self.llm.agenerate(prompts)
             end_time = time()
@@ -77,13 +123,14 @@ class AnthropicLLM(BaseModel):
                 generations=result.generations,
                 errors=[None] * len(result.generations),
                 latencies=[end_time - start_time] * len(result.generations),
+                cached_tokens=self._cached_tokens(result),
             )
         except Exception as e:
             return RefuelLLMResult(
                 generations=[[Generation(text="")] for _ in prompts],
                 errors=[
                     LabelingError(
-                        error_type=ErrorType.LLM_PROVIDER_ERROR,
+                        error_type=self._get_error_type(e),
                         error_message=str(e),
                     )
                     for _ in prompts
@@ -93,7 +140,7 @@ class AnthropicLLM(BaseModel):
 
     def _label(self, prompts: List[str], output_schema: Dict) -> RefuelLLMResult:
         try:
-            prompts = [[HumanMessage(content=prompt)] for prompt in prompts]
+            prompts = [[self._message(prompt)] for prompt in prompts]
             start_time = time()
             result = self.llm.generate(prompts)
             end_time = time()
@@ -101,13 +148,14 @@ class AnthropicLLM(BaseModel):
                 generations=result.generations,
                 errors=[None] * len(result.generations),
                 latencies=[end_time - start_time] * len(result.generations),
+                cached_tokens=self._cached_tokens(result),
             )
         except Exception as e:
             return RefuelLLMResult(
                 generations=[[Generation(text="")] for _ in prompts],
                 errors=[
                     LabelingError(
-                        error_type=ErrorType.LLM_PROVIDER_ERROR,
+                        error_type=self._get_error_type(e),
                         error_message=str(e),
                     )
                     for _ in prompts
@@ -116,9 +164,9 @@ class AnthropicLLM(BaseModel):
             )
 
     def get_cost(self, prompt: str, label: Optional[str] = "") -> float:
-        num_prompt_toks = len(self.tokenizer.encode(prompt).ids)
+        num_prompt_toks = self.get_num_tokens(prompt)
         if label:
-            num_label_toks = len(self.tokenizer.encode(label).ids)
+            num_label_toks = self.get_num_tokens(label)
         else:
             # get an upper bound
             num_label_toks = self.model_params["max_tokens_to_sample"]
@@ -132,5 +180,11 @@ class AnthropicLLM(BaseModel):
     def returns_token_probs(self) -> bool:
         return False
 
-    def get_num_tokens(self, prompt: str) -> int:
-        return len(self.tokenizer.encode(prompt).ids)
+    def _count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text).ids)
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts)]
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        return [start for start, _ in self.tokenizer.encode(text).offsets]
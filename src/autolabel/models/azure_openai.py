@@ -2,7 +2,7 @@
 import json
 import logging
 import os
-from functools import partial
+from functools import cached_property, partial
 from time import time
 from typing import Dict, List, Optional
 
@@ -175,11 +175,10 @@ class AzureOpenAILLM(BaseModel):
         )
 
     def get_cost(self, prompt: str, label: Optional[str] = "") -> float:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        num_prompt_tokens = len(encoding.encode(prompt))
-        
+        num_prompt_tokens = self.get_num_tokens(prompt)
+
         if label:
-            num_completion_tokens = len(encoding.encode(label))
+            num_completion_tokens = self.get_num_tokens(label)
         else:
             num_completion_tokens = self.model_params["max_tokens"]
 
@@ -194,7 +193,17 @@ class AzureOpenAILLM(BaseModel):
             and self.model_name in self.MODELS_WITH_TOKEN_PROBS
         )
 
-    def get_num_tokens(self, prompt: str) -> int:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        return len(encoding.encode(prompt))
+    @cached_property
+    def _encoding(self):
+        return self.tiktoken.encoding_for_model(self.model_name)
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self._encoding.encode(text))
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self._encoding.encode_batch(texts)]
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        _, offsets = self._encoding.decode_with_offsets(self._encoding.encode(text))
+        return offsets
 
@@ -1,21 +1,40 @@
 """Base interface that all model providers will implement."""
 
+import asyncio
+import functools
 from abc import ABC, abstractmethod
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
+from langchain.schema import Generation
 from transformers import AutoTokenizer
 
 from autolabel.cache import BaseCache
+from autolabel.concurrency import (
+    DeadlineExceeded,
+    HedgingPolicy,
+    deadline_exceeded_error,
+    get_deadline,
+    get_rate_limiter,
+)
 from autolabel.configs import AutolabelConfig
 from autolabel.schema import (
     GenerationCacheEntry,
     RefuelLLMResult,
 )
 
+from .tokenizer import TokenizerService
+
 
 class BaseModel(ABC):
     TTL_MS = 60 * 60 * 24 * 7 * 1000  # 1 week
     DEFAULT_CONTEXT_LENGTH = None
+    # model_params keys that hold the maximum number of completion tokens
+    MAX_OUTPUT_TOKENS_PARAMS = [
+        "max_tokens",
+        "max_tokens_to_sample",
+        "max_new_tokens",
+        "max_output_tokens",
+    ]
 
     def __init__(
         self, config: AutolabelConfig, cache: BaseCache, tokenizer: AutoTokenizer,
@@ -27,50 +46,237 @@ class BaseModel(ABC):
         self.max_context_length = config.max_context_length(
             default=self.DEFAULT_CONTEXT_LENGTH,
         )
+        self.rate_limiter = get_rate_limiter(
+            config.provider(),
+            config.model_name(),
+            requests_per_minute=config.requests_per_minute(),
+            tokens_per_minute=config.tokens_per_minute(),
+        )
+        self.hedging_policy = None
+        if config.hedge_latency_percentile():
+            self.hedging_policy = HedgingPolicy(
+                percentile=config.hedge_latency_percentile(),
+                max_hedge_fraction=config.max_hedge_fraction(),
+            )
+        # Futures of the prompts that are being labeled right now, so that concurrent
+        # callers with the same prompt share one provider call
+        self._in_flight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+        if self._overrides_get_num_tokens():
+            # Subclasses that implement get_num_tokens instead of _count_tokens count
+            # tokens with it, and their counts are memoized as well
+            self.tokenizer_service = TokenizerService(
+                functools.partial(type(self).get_num_tokens, self),
+            )
+            self.get_num_tokens = self.tokenizer_service.num_tokens
+        else:
+            self.tokenizer_service = TokenizerService(
+                self._count_tokens, self._count_tokens_batch,
+            )
+        # Start of the prompt that is the same for every row of the run. Providers
+        # that cache prompt prefixes send it as a separate segment of the message
+        self.cacheable_prefix: Optional[str] = None
         # Specific classes that implement this interface should run initialization steps here
         # E.g. initializing the LLM model with required parameters from ModelConfig
 
-    async def label(self, prompts: List[str], output_schema: Dict) -> RefuelLLMResult:
-        """Label a list of prompts."""
+    async def label(
+        self, prompts: List[str], output_schema: Dict, use_cache: bool = True,
+    ) -> RefuelLLMResult:
+        """Label a list of prompts. With use_cache=False every prompt is sent to the provider, e.g. to draw independent samples."""
+        deadline = get_deadline()
         existing_prompts = {}
         missing_prompt_idxs = list(range(len(prompts)))
         missing_prompts = prompts
-        costs = []
+        costs = [0.0 for i in range(len(prompts))]
         errors = [None for i in range(len(prompts))]
         latencies = [0 for i in range(len(prompts))]
-        if self.cache:
+        cached_tokens = [0 for i in range(len(prompts))]
+        if self.cache and use_cache:
             (
                 existing_prompts,
                 missing_prompt_idxs,
                 missing_prompts,
             ) = self.get_cached_prompts(prompts)
+        # prompts that another caller is already labeling wait for its result
+        # instead of calling the provider again
+        waiting_prompts = {}
+        owned_futures = []
+        owned_prompt_idxs = []
+        for i in missing_prompt_idxs:
+            key = self._in_flight_key(prompts[i])
+            if not use_cache:
+                owned_prompt_idxs.append(i)
+            elif key in self._in_flight:
+                waiting_prompts[i] = self._in_flight[key]
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self._in_flight[key] = future
+                owned_futures.append((key, future))
+                owned_prompt_idxs.append(i)
+        missing_prompt_idxs = owned_prompt_idxs
+        missing_prompts = [prompts[i] for i in owned_prompt_idxs]
+
         # label missing prompts
         if len(missing_prompts) > 0:
-            if hasattr(self, "_alabel"):
-                new_results = await self._alabel(missing_prompts, output_schema)
-            else:
-                new_results = self._label(missing_prompts, output_schema)
-            for ind, prompt in enumerate(missing_prompts):
-                costs.append(
-                    self.get_cost(prompt, label=new_results.generations[ind][0].text),
+            try:
+                if deadline is not None:
+                    new_results, hedged = await deadline.wait_for(
+                        self._label_missing_prompts(missing_prompts, output_schema),
+                    )
+                else:
+                    new_results, hedged = await self._label_missing_prompts(
+                        missing_prompts, output_schema,
+                    )
+
+                # Set the existing prompts to the new results
+                for i, result, error, latency, num_cached in zip(
+                    missing_prompt_idxs,
+                    new_results.generations,
+                    new_results.errors,
+                    new_results.latencies,
+                    new_results.cached_tokens
+                    or [0 for _ in missing_prompt_idxs],
+                ):
+                    existing_prompts[i] = result
+                    errors[i] = error
+                    latencies[i] = latency
+                    cached_tokens[i] = num_cached
+                    costs[i] = self.get_cost(prompts[i], label=result[0].text)
+                    if hedged:
+                        # The duplicate request is billed as well, and is charged
+                        # like the request that won
+                        costs[i] *= 2
+
+                if self.cache and use_cache:
+                    self.update_cache(missing_prompt_idxs, new_results, prompts)
+            except DeadlineExceeded:
+                # Let waiting callers with a later deadline label the prompts themselves
+                self._release_in_flight(
+                    owned_futures, error=asyncio.CancelledError(),
                 )
+                for i in missing_prompt_idxs:
+                    existing_prompts[i] = [Generation(text="")]
+                    errors[i] = deadline_exceeded_error()
+                owned_futures = []
+            except BaseException as e:
+                self._release_in_flight(owned_futures, error=e)
+                raise
+            self._release_in_flight(
+                owned_futures,
+                results=[
+                    (existing_prompts[i], errors[i], latencies[i])
+                    for i in missing_prompt_idxs
+                ],
+            )
 
-            # Set the existing prompts to the new results
-            for i, result, error, latency in zip(
-                missing_prompt_idxs,
-                new_results.generations,
-                new_results.errors,
-                new_results.latencies,
-            ):
-                existing_prompts[i] = result
-                errors[i] = error
-                latencies[i] = latency
-
-            if self.cache:
-                self.update_cache(missing_prompt_idxs, new_results, prompts)
+        # coalesced prompts are not charged, like cache hits
+        for i, future in waiting_prompts.items():
+            try:
+                if deadline is not None:
+                    (
+                        existing_prompts[i],
+                        errors[i],
+                        latencies[i],
+                    ) = await deadline.wait_for(asyncio.shield(future))
+                else:
+                    (
+                        existing_prompts[i],
+                        errors[i],
+                        latencies[i],
+                    ) = await asyncio.shield(future)
+            except DeadlineExceeded:
+                existing_prompts[i] = [Generation(text="")]
+                errors[i] = deadline_exceeded_error()
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # The caller that owned the prompt was cancelled, label it here instead
+                result = await self.label([prompts[i]], output_schema)
+                existing_prompts[i] = result.generations[0]
+                errors[i] = result.errors[0]
+                latencies[i] = result.latencies[0]
+                costs[i] = result.costs[0]
+                if result.cached_tokens:
+                    cached_tokens[i] = result.cached_tokens[0]
         generations = [existing_prompts[i] for i in range(len(prompts))]
         return RefuelLLMResult(
-            generations=generations, costs=costs, errors=errors, latencies=latencies,
+            generations=generations,
+            costs=costs,
+            errors=errors,
+            latencies=latencies,
+            cached_tokens=cached_tokens,
+        )
+
+    async def _label_missing_prompts(
+        self, prompts: List[str], output_schema: Dict,
+    ) -> Tuple[RefuelLLMResult, bool]:
+        """Labels the prompts with the provider. Returns the result and whether the request was hedged with a duplicate request"""
+        # Only async providers can be hedged, a blocking _label holds the event loop
+        if self.hedging_policy and hasattr(self, "_alabel"):
+            return await self.hedging_policy.run(
+                lambda: self._request_provider(prompts, output_schema),
+            )
+        return await self._request_provider(prompts, output_schema), False
+
+    async def _request_provider(
+        self, prompts: List[str], output_schema: Dict,
+    ) -> RefuelLLMResult:
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(
+                num_tokens=self.estimate_num_tokens(prompts),
+                num_requests=len(prompts),
+            )
+        if hasattr(self, "_alabel"):
+            return await self._alabel(prompts, output_schema)
+        return self._label(prompts, output_schema)
+
+    def _in_flight_key(self, prompt: str) -> Tuple[str, str, str]:
+        """Same fields as the GenerationCacheEntry of the prompt"""
+        model_params_string = str(
+            sorted([(k, v) for k, v in self.model_params.items()]),
+        )
+        return (self.model_name, model_params_string, prompt)
+
+    def _release_in_flight(
+        self,
+        owned_futures: List[Tuple[Tuple[str, str, str], asyncio.Future]],
+        results: Optional[List[Tuple]] = None,
+        error: Optional[BaseException] = None,
+    ) -> None:
+        """Hands the results (or the error) of the owned prompts to the callers waiting on them"""
+        for j, (key, future) in enumerate(owned_futures):
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+            if future.done():
+                continue
+            if results is not None:
+                future.set_result(results[j])
+            elif isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+                # Mark the exception as retrieved in case no caller is waiting
+                future.exception()
+
+    def _split_cacheable_prefix(self, prompt: str) -> Tuple[Optional[str], str]:
+        """Splits prompt into the cacheable prefix and the rest of the prompt. The prefix is None if the prompt does not start with it, e.g. because it was trimmed"""
+        prefix = self.cacheable_prefix
+        if prefix and len(prompt) > len(prefix) and prompt.startswith(prefix):
+            return prefix, prompt[len(prefix) :]
+        return None, prompt
+
+    def max_output_tokens(self) -> int:
+        """Returns the maximum number of tokens the model generates for a prompt, or 0 if it is not configured"""
+        for param in self.MAX_OUTPUT_TOKENS_PARAMS:
+            if self.model_params.get(param):
+                return self.model_params[param]
+        return 0
+
+    def estimate_num_tokens(self, prompts: List[str]) -> int:
+        """Returns an upper bound on the number of tokens (prompt and completion) used to label the prompts"""
+        max_output_tokens = self.max_output_tokens()
+        return sum(
+            num_tokens + max_output_tokens
+            for num_tokens in self.get_num_tokens_batch(prompts)
         )
 
     @abstractmethod
@@ -140,7 +346,29 @@ class BaseModel(ABC):
 
         """
 
-    @abstractmethod
     def get_num_tokens(self, prompt: str) -> int:
         """
         Get the number of tokens in the prompt"""
+        return self.tokenizer_service.num_tokens(prompt)
+
+    def get_num_tokens_batch(self, prompts: List[str]) -> List[int]:
+        """Returns the number of tokens in each of the prompts"""
+        return self.tokenizer_service.num_tokens_batch(prompts)
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        """Returns the character offset at which each token of text starts, or None if the model's tokenizer does not report offsets"""
+        return None
+
+    def _count_tokens(self, text: str) -> int:
+        """Tokenizes text with the model's tokenizer and returns the number of tokens. Callers go through get_num_tokens, which memoizes the counts. Defaults to the get_num_tokens of subclasses that implement it instead"""
+        if not self._overrides_get_num_tokens():
+            raise NotImplementedError(
+                f"{type(self).__name__} must implement _count_tokens",
+            )
+        return type(self).get_num_tokens(self, text)
+
+    def _overrides_get_num_tokens(self) -> bool:
+        return type(self).get_num_tokens is not BaseModel.get_num_tokens
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        return [self._count_tokens(text) for text in texts]
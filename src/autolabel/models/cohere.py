@@ -73,9 +73,9 @@ class CohereLLM(BaseModel):
             )
 
     def get_cost(self, prompt: str, label: Optional[str] = "") -> float:
-        num_prompt_toks = len(self.co.tokenize(prompt).tokens)
+        num_prompt_toks = self.get_num_tokens(prompt)
         if label:
-            num_label_toks = len(self.co.tokenize(label).tokens)
+            num_label_toks = self.get_num_tokens(label)
         else:
             num_label_toks = self.model_params["max_tokens"]
 
@@ -84,5 +84,5 @@ class CohereLLM(BaseModel):
     def returns_token_probs(self) -> bool:
         return False
 
-    def get_num_tokens(self, prompt: str) -> int:
-        return len(self.co.tokenize(prompt).tokens)
+    def _count_tokens(self, text: str) -> int:
+        return len(self.co.tokenize(text).tokens)
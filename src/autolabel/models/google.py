@@ -177,7 +177,7 @@ class GoogleLLM(BaseModel):
     def returns_token_probs(self) -> bool:
         return False
 
-    def get_num_tokens(self, prompt: str) -> int:
-        if prompt:
-            return self.vertexaiModel.count_tokens(prompt).total_tokens
+    def _count_tokens(self, text: str) -> int:
+        if text:
+            return self.vertexaiModel.count_tokens(text).total_tokens
         return 0
@@ -130,5 +130,5 @@ class HFPipelineLLM(BaseModel):
     def returns_token_probs(self) -> bool:
         return False
 
-    def get_num_tokens(self, prompt: str) -> int:
-        return len(self.tokenizer.encode(prompt))
+    def _count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
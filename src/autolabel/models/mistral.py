@@ -17,6 +17,7 @@ from tenacity import (
 from transformers import AutoTokenizer
 
 from autolabel.cache import BaseCache
+from autolabel.concurrency import stop_at_deadline, timeout_before_deadline
 from autolabel.configs import AutolabelConfig
 from autolabel.models import BaseModel
 from autolabel.schema import ErrorType, LabelingError, RefuelLLMResult
@@ -79,7 +80,7 @@ class MistralLLM(BaseModel):
 
     @retry(
         reraise=True,
-        stop=stop_after_attempt(5),
+        stop=stop_after_attempt(5) | stop_at_deadline(),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         before_sleep=before_sleep_log(logger, logging.WARNING),
         retry=retry_if_not_exception_type(UnretryableError),
@@ -97,7 +98,10 @@ class MistralLLM(BaseModel):
         }
         start_time = time()
         response = requests.post(
-            self.url, json=data, headers=headers, timeout=self.timeout,
+            self.url,
+            json=data,
+            headers=headers,
+            timeout=timeout_before_deadline(self.timeout),
         )
         end_time = time()
         # raise Exception if status != 200
@@ -110,7 +114,7 @@ class MistralLLM(BaseModel):
 
     @retry(
         reraise=True,
-        stop=stop_after_attempt(5),
+        stop=stop_after_attempt(5) | stop_at_deadline(),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         before_sleep=before_sleep_log(logger, logging.WARNING),
         retry=retry_if_not_exception_type(UnretryableError),
@@ -127,7 +131,9 @@ class MistralLLM(BaseModel):
             "Authorization": "Bearer " + os.getenv("MISTRAL_API_KEY"),
         }
         async with httpx.AsyncClient() as client:
-            timeout = httpx.Timeout(self.DEFAULT_CONNECT_TIMEOUT, read=self.timeout)
+            timeout = httpx.Timeout(
+                self.DEFAULT_CONNECT_TIMEOUT, read=timeout_before_deadline(self.timeout),
+            )
             start_time = time()
             response = await client.post(
                 self.url, json=data, headers=headers, timeout=timeout,
@@ -174,29 +180,32 @@ class MistralLLM(BaseModel):
         generations = []
         errors = []
         latencies = []
-        try:
-            requests = [self._alabel_with_retry(prompt) for prompt in prompts]
-            responses = await asyncio.gather(*requests)
-            for response, latency in responses:
+        requests = [self._alabel_with_retry(prompt) for prompt in prompts]
+        # Collect errors per prompt so that the results stay aligned with the prompts
+        responses = await asyncio.gather(*requests, return_exceptions=True)
+        for response in responses:
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                response, latency = response
                 response = response.json()
                 generations.append(
                     [Generation(text=response["choices"][0]["message"]["content"])],
                 )
                 errors.append(None)
                 latencies.append(latency)
-        except Exception as e:
-            print(e)
-            # This signifies an error in generating the response using RefuelLLm
-            logger.error(
-                f"Unable to generate prediction: {e}",
-            )
-            generations.append([Generation(text="")])
-            errors.append(
-                LabelingError(
-                    error_type=ErrorType.LLM_PROVIDER_ERROR, error_message=str(e),
-                ),
-            )
-            latencies.append(0)
+            except Exception as e:
+                # This signifies an error in generating the response using RefuelLLm
+                logger.error(
+                    f"Unable to generate prediction: {e}",
+                )
+                generations.append([Generation(text="")])
+                errors.append(
+                    LabelingError(
+                        error_type=ErrorType.LLM_PROVIDER_ERROR, error_message=str(e),
+                    ),
+                )
+                latencies.append(0)
         return RefuelLLMResult(
             generations=generations, errors=errors, latencies=latencies,
         )
@@ -211,5 +220,9 @@ class MistralLLM(BaseModel):
     def returns_token_probs(self) -> bool:
         return False
 
-    def get_num_tokens(self, prompt: str) -> int:
-        return len(prompt) // 4
+    def _count_tokens(self, text: str) -> int:
+        return len(text) // 4
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        # Tokens are estimated as every 4 characters
+        return list(range(0, 4 * self._count_tokens(text), 4))
@@ -142,6 +142,10 @@ class OpenAILLM(BaseModel):
         "rate_limit_exceeded": ErrorType.RATE_LIMIT_ERROR,
     }
 
+    @cached_property
+    def _encoding(self):
+        return self.tiktoken.encoding_for_model(self.model_name)
+
     @cached_property
     def _engine(self) -> str:
         if self.model_name is not None and self.model_name in self.CHAT_ENGINE_MODELS:
@@ -156,12 +160,14 @@ class OpenAILLM(BaseModel):
     ) -> None:
         super().__init__(config, cache, tokenizer)
         try:
+            import openai
             import tiktoken
             from langchain_openai import ChatOpenAI, OpenAI
         except ImportError:
             raise ImportError(
                 "openai is required to use the OpenAILLM. Please install it with the following command: pip install 'refuel-autolabel[openai]'",
             )
+        self.openai = openai
         self.tiktoken = tiktoken
         # populate model name
         self.model_name = config.model_name() or self.DEFAULT_MODEL
@@ -189,6 +195,27 @@ class OpenAILLM(BaseModel):
                 **self.model_params,
             )
 
+    def _message(self, prompt: str) -> HumanMessage:
+        """The cacheable prefix of the prompt is sent as its own content part"""
+        prefix, rest = self._split_cacheable_prefix(prompt)
+        if prefix is None:
+            return HumanMessage(content=prompt)
+        return HumanMessage(
+            content=[{"type": "text", "text": prefix}, {"type": "text", "text": rest}],
+        )
+
+    def _cached_tokens(self, result: LLMResult) -> List[int]:
+        """Prompt tokens read from the prompt cache, which OpenAI applies to the longest previously seen prefix of a prompt automatically"""
+        cached_tokens = []
+        for generations in result.generations:
+            message = getattr(generations[0], "message", None) if generations else None
+            usage = (message.response_metadata if message else {}).get(
+                "token_usage",
+            ) or {}
+            details = usage.get("prompt_tokens_details") or {}
+            cached_tokens.append(details.get("cached_tokens") or 0)
+        return cached_tokens
+
     def _chat_backward_compatibility(
         self,
         generations: List[LLMResult],
@@ -208,7 +235,7 @@ class OpenAILLM(BaseModel):
         try:
             start_time = time()
             if self._engine == "chat":
-                prompts = [[HumanMessage(content=prompt)] for prompt in prompts]
+                prompts = [[self._message(prompt)] for prompt in prompts]
                 generations = None
                 if (
                     output_schema is not None
@@ -247,24 +274,29 @@ class OpenAILLM(BaseModel):
                 generations=generations,
                 errors=[None] * len(generations),
                 latencies=[end_time - start_time] * len(generations),
+                cached_tokens=self._cached_tokens(result),
             )
         except Exception as e:
             logger.exception(f"Unable to generate prediction: {e}")
             error_message = str(e)
             error_type = ErrorType.LLM_PROVIDER_ERROR
-            try:
-                json_start, json_end = error_message.find("{"), error_message.rfind("}")
-                error_json = ast.literal_eval(error_message[json_start : json_end + 1])[
-                    "error"
-                ]
-                error_code = error_json.get("code")
-                error_type = self.ERROR_TYPE_MAPPING.get(
-                    error_code,
-                    ErrorType.LLM_PROVIDER_ERROR,
-                )
-                error_message = error_json.get("message")
-            except Exception as e:
-                logger.error(f"Unable to parse OpenAI error message: {e}")
+            if isinstance(e, self.openai.APITimeoutError):
+                error_type = ErrorType.TIMEOUT_ERROR
+            else:
+                try:
+                    json_start = error_message.find("{")
+                    json_end = error_message.rfind("}")
+                    error_json = ast.literal_eval(
+                        error_message[json_start : json_end + 1],
+                    )["error"]
+                    error_code = error_json.get("code")
+                    error_type = self.ERROR_TYPE_MAPPING.get(
+                        error_code,
+                        ErrorType.LLM_PROVIDER_ERROR,
+                    )
+                    error_message = error_json.get("message")
+                except Exception as e:
+                    logger.error(f"Unable to parse OpenAI error message: {e}")
 
             return RefuelLLMResult(
                 generations=[[Generation(text="")] for _ in prompts],
@@ -282,7 +314,7 @@ class OpenAILLM(BaseModel):
         try:
             start_time = time()
             if self._engine == "chat":
-                prompts = [[HumanMessage(content=prompt)] for prompt in prompts]
+                prompts = [[self._message(prompt)] for prompt in prompts]
                 if (
                     output_schema is not None
                     and self.model_name in self.SUPPORTS_STRUCTURED_OUTPUTS
@@ -320,25 +352,30 @@ class OpenAILLM(BaseModel):
                 generations=generations,
                 errors=[None] * len(generations),
                 latencies=[end_time - start_time] * len(generations),
+                cached_tokens=self._cached_tokens(result),
             )
         except Exception as e:
             logger.exception(f"Unable to generate prediction: {e}")
 
             error_message = str(e)
             error_type = ErrorType.LLM_PROVIDER_ERROR
-            try:
-                json_start, json_end = error_message.find("{"), error_message.rfind("}")
-                error_json = ast.literal_eval(error_message[json_start : json_end + 1])[
-                    "error"
-                ]
-                error_code = error_json.get("code")
-                error_type = self.ERROR_TYPE_MAPPING.get(
-                    error_code,
-                    ErrorType.LLM_PROVIDER_ERROR,
-                )
-                error_message = error_json.get("message")
-            except Exception as e:
-                logger.error(f"Unable to parse OpenAI error message: {e}")
+            if isinstance(e, self.openai.APITimeoutError):
+                error_type = ErrorType.TIMEOUT_ERROR
+            else:
+                try:
+                    json_start = error_message.find("{")
+                    json_end = error_message.rfind("}")
+                    error_json = ast.literal_eval(
+                        error_message[json_start : json_end + 1],
+                    )["error"]
+                    error_code = error_json.get("code")
+                    error_type = self.ERROR_TYPE_MAPPING.get(
+                        error_code,
+                        ErrorType.LLM_PROVIDER_ERROR,
+                    )
+                    error_message = error_json.get("message")
+                except Exception as e:
+                    logger.error(f"Unable to parse OpenAI error message: {e}")
             return RefuelLLMResult(
                 generations=[[Generation(text="")] for _ in prompts],
                 errors=[
@@ -352,10 +389,9 @@ class OpenAILLM(BaseModel):
             )
 
     def get_cost(self, prompt: str, label: Optional[str] = "") -> float:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        num_prompt_toks = len(encoding.encode(prompt))
+        num_prompt_toks = self.get_num_tokens(prompt)
         if label:
-            num_label_toks = len(encoding.encode(label))
+            num_label_toks = self.get_num_tokens(label)
         else:
             # get an upper bound
             num_label_toks = self.model_params["max_tokens"]
@@ -372,6 +408,12 @@ class OpenAILLM(BaseModel):
             and self.model_name in self.MODELS_WITH_TOKEN_PROBS
         )
 
-    def get_num_tokens(self, prompt: str) -> int:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        return len(encoding.encode(prompt))
+    def _count_tokens(self, text: str) -> int:
+        return len(self._encoding.encode(text))
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self._encoding.encode_batch(texts)]
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        _, offsets = self._encoding.decode_with_offsets(self._encoding.encode(text))
+        return offsets
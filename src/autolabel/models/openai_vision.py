@@ -47,6 +47,10 @@ class OpenAIVisionLLM(BaseModel):
         "gpt-4o-2024-08-06": 0.01 / 1000,
     }
 
+    @cached_property
+    def _encoding(self):
+        return self.tiktoken.encoding_for_model(self.model_name)
+
     @cached_property
     def _engine(self) -> str:
         if self.model_name is not None and self.model_name in self.CHAT_ENGINE_MODELS:
@@ -142,10 +146,9 @@ class OpenAIVisionLLM(BaseModel):
         )
 
     def get_cost(self, prompt: str, label: Optional[str] = "") -> float:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        num_prompt_toks = len(encoding.encode(prompt))
+        num_prompt_toks = self.get_num_tokens(prompt)
         if label:
-            num_label_toks = len(encoding.encode(label))
+            num_label_toks = self.get_num_tokens(label)
         else:
             # get an upper bound
             num_label_toks = self.model_params["max_tokens"]
@@ -166,6 +169,12 @@ class OpenAIVisionLLM(BaseModel):
             and self.model_name in self.MODELS_WITH_TOKEN_PROBS
         )
 
-    def get_num_tokens(self, prompt: str) -> int:
-        encoding = self.tiktoken.encoding_for_model(self.model_name)
-        return len(encoding.encode(prompt))
+    def _count_tokens(self, text: str) -> int:
+        return len(self._encoding.encode(text))
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        return [len(tokens) for tokens in self._encoding.encode_batch(texts)]
+
+    def get_token_offsets(self, text: str) -> Optional[List[int]]:
+        _, offsets = self._encoding.decode_with_offsets(self._encoding.encode(text))
+        return offsets
@@ -0,0 +1,100 @@
+"""Memoized token counting shared by the model providers."""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TokenizerService:
+
+    """
+    Counts the tokens in strings for a model. The same prompt is counted several
+    times while a row is labeled (while trimming it to the context length, for the
+    row's input tokens and for its cost), so the counts of the most recently seen
+    strings are memoized. Entries are keyed by the hash and length of the string,
+    which keeps the strings themselves from being held in memory. Strings missing
+    from the memo are counted in a single batch call where the provider supports it.
+    """
+
+    DEFAULT_MAX_ENTRIES = 50_000
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        count_tokens_batch: Optional[Callable[[List[str]], List[int]]] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        """
+        Args:
+            count_tokens: counts the tokens in a single string
+            count_tokens_batch: counts the tokens in each of a list of strings. Defaults to calling count_tokens for each string
+            max_entries: number of counts kept, least recently used first out
+
+        """
+        self.count_tokens = count_tokens
+        self.count_tokens_batch = count_tokens_batch or (
+            lambda texts: [count_tokens(text) for text in texts]
+        )
+        self.max_entries = max_entries
+        self.memo: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        # Prompts are constructed in worker threads as well as on the event loop
+        self.lock = threading.Lock()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    @staticmethod
+    def key(text: str) -> Tuple[int, int]:
+        return hash(text), len(text)
+
+    def num_tokens(self, text: str) -> int:
+        """Returns the number of tokens in text"""
+        key = self.key(text)
+        with self.lock:
+            num_tokens = self._lookup(key)
+        if num_tokens is not None:
+            return num_tokens
+        num_tokens = self.count_tokens(text)
+        with self.lock:
+            self._store(key, num_tokens)
+        return num_tokens
+
+    def num_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Returns the number of tokens in each of texts, counting the ones not seen before in one batch"""
+        keys = [self.key(text) for text in texts]
+        counts = [None for _ in texts]
+        missing = {}
+        with self.lock:
+            for i, key in enumerate(keys):
+                counts[i] = self._lookup(key)
+                if counts[i] is None:
+                    missing.setdefault(key, texts[i])
+        if missing:
+            missing_counts = dict(
+                zip(missing, self.count_tokens_batch(list(missing.values()))),
+            )
+            with self.lock:
+                for key, num_tokens in missing_counts.items():
+                    self._store(key, num_tokens)
+            counts = [
+                missing_counts[key] if count is None else count
+                for key, count in zip(keys, counts)
+            ]
+        return counts
+
+    def _lookup(self, key: Tuple[int, int]) -> Optional[int]:
+        num_tokens = self.memo.get(key)
+        if num_tokens is None:
+            self.num_misses += 1
+            return None
+        self.memo.move_to_end(key)
+        self.num_hits += 1
+        return num_tokens
+
+    def _store(self, key: Tuple[int, int], num_tokens: int) -> None:
+        self.memo[key] = num_tokens
+        self.memo.move_to_end(key)
+        if len(self.memo) > self.max_entries:
+            self.memo.popitem(last=False)
@@ -1,5 +1,6 @@
 import logging
-from typing import List, Optional
+from time import time
+from typing import Dict, List, Optional
 
 from langchain.schema import Generation
 from transformers import AutoTokenizer
@@ -55,12 +56,10 @@ class VLLMModel(BaseModel):
             ),
         )
 
-    def _label(self, prompts: List[str]) -> RefuelLLMResult:
-        generations = []
-        errors = []
-        latencies = []
-        for prompt in prompts:
-            try:
+    def _label(self, prompts: List[str], output_schema: Dict = None) -> RefuelLLMResult:
+        try:
+            tokenized_prompts = []
+            for prompt in prompts:
                 messages = [{"role": "user", "content": prompt}]
                 tokenized_prompt = self.tokenizer.apply_chat_template(
                     messages, add_generation_prompt=True,
@@ -69,49 +68,57 @@ class VLLMModel(BaseModel):
                     logger.warning(
                         f"Input is greater than 4096 tokens: {len(tokenized_prompt)}",
                     )
-                response = self.llm.generate(
-                    prompt_token_ids=[tokenized_prompt],
-                    sampling_params=self.params,
-                    use_tqdm=False,
-                )
-                generations.append(
-                    [
-                        Generation(
-                            text=response[0]
-                            .outputs[0]
-                            .text.strip()
-                            .replace("<|eot_id|>", ""),
-                            generation_info=(
-                                {
-                                    "logprobs": {
-                                        "top_logprobs": self._process_confidence_request(
-                                            response[0].outputs[0].logprobs,
-                                        ),
-                                    },
-                                }
-                                if self.config.confidence()
-                                else None
-                            ),
+                tokenized_prompts.append(tokenized_prompt)
+
+            # Generate all prompts in a single call so that vLLM can batch them on the device
+            start_time = time()
+            responses = self.llm.generate(
+                prompt_token_ids=tokenized_prompts,
+                sampling_params=self.params,
+                use_tqdm=False,
+            )
+            end_time = time()
+            generations = [
+                [
+                    Generation(
+                        text=response.outputs[0]
+                        .text.strip()
+                        .replace("<|eot_id|>", ""),
+                        generation_info=(
+                            {
+                                "logprobs": {
+                                    "top_logprobs": self._process_confidence_request(
+                                        response.outputs[0].logprobs,
+                                    ),
+                                },
+                            }
+                            if self.config.confidence()
+                            else None
                         ),
-                    ],
-                )
-                errors.append(None)
-                latencies.append(0)
-            except Exception as e:
-                # This signifies an error in generating the response using RefuelLLm
-                logger.error(
-                    f"Unable to generate prediction: {e}",
-                )
-                generations.append([Generation(text="")])
-                errors.append(
+                    ),
+                ]
+                for response in responses
+            ]
+            return RefuelLLMResult(
+                generations=generations,
+                errors=[None] * len(generations),
+                latencies=[end_time - start_time] * len(generations),
+            )
+        except Exception as e:
+            # This signifies an error in generating the response using RefuelLLm
+            logger.error(
+                f"Unable to generate prediction: {e}",
+            )
+            return RefuelLLMResult(
+                generations=[[Generation(text="")] for _ in prompts],
+                errors=[
                     LabelingError(
                         error_type=ErrorType.LLM_PROVIDER_ERROR, error_message=str(e),
-                    ),
-                )
-                latencies.append(0)
-        return RefuelLLMResult(
-            generations=generations, errors=errors, latencies=latencies,
-        )
+                    )
+                    for _ in prompts
+                ],
+                latencies=[0 for _ in prompts],
+            )
 
     def _process_confidence_request(self, logprobs):
         resp = []
@@ -127,5 +134,5 @@ class VLLMModel(BaseModel):
     def returns_token_probs(self) -> bool:
         return True
 
-    def get_num_tokens(self, prompt: str) -> int:
-        return len(self.tokenizer.encode(prompt))
+    def _count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text))
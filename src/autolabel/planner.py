@@ -0,0 +1,218 @@
+"""Fast estimates of the cost and duration of a labeling run."""
+
+import logging
+import math
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel
+from scipy import stats
+
+logger = logging.getLogger(__name__)
+
+
+class RunPlan(BaseModel):
+
+    """Estimated cost, token usage and wall-clock time of labeling a dataset"""
+
+    num_rows: int
+    num_sampled_rows: int
+    total_cost: float
+    cost_lower_bound: float
+    cost_upper_bound: float
+    confidence_level: float
+    total_tokens: int
+    projected_seconds: float
+    limited_by: str
+    example_prompt: Optional[str] = None
+
+    @property
+    def cost_per_row(self) -> float:
+        return self.total_cost / self.num_rows if self.num_rows > 0 else 0.0
+
+
+class RunPlanner:
+
+    """
+    Estimates the cost of labeling a dataset from a sample of its rows instead of
+    constructing a prompt for every row. Rows are stratified by the length of their
+    input columns (one stratum per power of two) in a single pass over the dataset,
+    keeping a fixed size random sample of each stratum, so the dataset is never
+    held in memory. Prompts are only constructed and tokenized for the sampled rows,
+    and the per stratum means are combined into a total with a confidence interval.
+    """
+
+    DEFAULT_SAMPLES_PER_STRATUM = 20
+    DEFAULT_SECONDS_PER_REQUEST = 2.0
+    DEFAULT_CHUNK_SIZE = 100_000
+
+    def __init__(
+        self,
+        llm,
+        build_prompt: Callable[[Dict], str],
+        input_columns: Optional[List[str]] = None,
+        samples_per_stratum: int = DEFAULT_SAMPLES_PER_STRATUM,
+        confidence_level: float = 0.95,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            llm: the model the dataset would be labeled with
+            build_prompt: constructs the prompt for a row
+            input_columns: columns whose length the rows are stratified by. Defaults to all columns
+            samples_per_stratum: number of rows sampled from each stratum
+            confidence_level: confidence level of the cost interval
+            seed: seed of the random sample
+
+        """
+        if samples_per_stratum < 1:
+            raise ValueError("samples_per_stratum must be at least 1")
+        if not 0 < confidence_level < 1:
+            raise ValueError("confidence_level must be between 0 and 1")
+        self.llm = llm
+        self.build_prompt = build_prompt
+        self.input_columns = input_columns
+        self.samples_per_stratum = samples_per_stratum
+        self.confidence_level = confidence_level
+        self.seed = seed
+
+    def estimate(
+        self,
+        chunks: Iterable[pd.DataFrame],
+        max_concurrency: int = 1,
+        seconds_per_request: float = DEFAULT_SECONDS_PER_REQUEST,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+    ) -> RunPlan:
+        """
+        Estimates the cost and duration of labeling the rows in chunks.
+
+        Args:
+            chunks: the dataset, as dataframes of consecutive rows
+            max_concurrency: number of rows labeled at the same time
+            seconds_per_request: assumed latency of a single provider request
+            requests_per_minute: request rate limit of the provider, if any
+            tokens_per_minute: token rate limit of the provider, if any
+        Returns:
+            RunPlan with the estimates
+
+        """
+        counts, samples = self._sample(chunks)
+        num_rows = sum(counts.values())
+        max_output_tokens = self.llm.max_output_tokens()
+
+        total_cost, cost_variance, total_tokens = 0.0, 0.0, 0.0
+        num_sampled_rows, example_prompt = 0, None
+        for stratum in sorted(counts, key=counts.get, reverse=True):
+            prompts = [self.build_prompt(row) for _, row in samples[stratum]]
+            if example_prompt is None and prompts:
+                example_prompt = prompts[0]
+            num_tokens = np.array(self.llm.get_num_tokens_batch(prompts))
+            costs = np.array(
+                [self.llm.get_cost(prompt, label="") for prompt in prompts]
+            )
+            population, sampled = counts[stratum], len(prompts)
+            num_sampled_rows += sampled
+            total_cost += population * costs.mean()
+            total_tokens += population * (num_tokens.mean() + max_output_tokens)
+            if sampled > 1:
+                # Finite population correction, strata that were sampled in full add no variance
+                cost_variance += (
+                    population**2
+                    * (1 - sampled / population)
+                    * costs.var(ddof=1)
+                    / sampled
+                )
+
+        margin = stats.norm.ppf(0.5 + self.confidence_level / 2) * math.sqrt(
+            cost_variance,
+        )
+        projected_seconds, limited_by = self._projected_seconds(
+            num_rows,
+            total_tokens,
+            max_concurrency,
+            seconds_per_request,
+            requests_per_minute,
+            tokens_per_minute,
+        )
+        return RunPlan(
+            num_rows=num_rows,
+            num_sampled_rows=num_sampled_rows,
+            total_cost=total_cost,
+            cost_lower_bound=max(total_cost - margin, 0.0),
+            cost_upper_bound=total_cost + margin,
+            confidence_level=self.confidence_level,
+            total_tokens=int(round(total_tokens)),
+            projected_seconds=projected_seconds,
+            limited_by=limited_by,
+            example_prompt=example_prompt,
+        )
+
+    def _sample(
+        self,
+        chunks: Iterable[pd.DataFrame],
+    ) -> Tuple[Dict[int, int], Dict[int, List[Tuple[float, Dict]]]]:
+        """
+        Counts the rows of every stratum and keeps the samples_per_stratum rows with
+        the lowest random priority in each, which is a uniform sample of the stratum.
+        """
+        rng = np.random.default_rng(self.seed)
+        counts = defaultdict(int)
+        samples = defaultdict(list)
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            rows = pd.DataFrame(
+                {"stratum": self._strata(chunk), "priority": rng.random(len(chunk))},
+            )
+            for stratum, group in rows.groupby("stratum", sort=False):
+                counts[stratum] += len(group)
+                sample = samples[stratum]
+                candidates = group.nsmallest(self.samples_per_stratum, "priority")
+                if len(sample) == self.samples_per_stratum:
+                    candidates = candidates[candidates["priority"] < sample[-1][0]]
+                if candidates.empty:
+                    continue
+                sample.extend(
+                    zip(
+                        candidates["priority"].tolist(),
+                        chunk.iloc[candidates.index].to_dict(orient="records"),
+                    ),
+                )
+                sample.sort(key=lambda item: item[0])
+                del sample[self.samples_per_stratum :]
+        return counts, samples
+
+    def _strata(self, chunk: pd.DataFrame) -> np.ndarray:
+        columns = [column for column in self.input_columns or [] if column in chunk]
+        inputs = chunk[columns] if columns else chunk
+        lengths = (
+            inputs.fillna("")
+            .astype(str)
+            .apply(lambda column: column.str.len())
+            .sum(axis=1)
+            .to_numpy()
+        )
+        return np.floor(np.log2(lengths + 1)).astype(int)
+
+    @staticmethod
+    def _projected_seconds(
+        num_rows: int,
+        total_tokens: float,
+        max_concurrency: int,
+        seconds_per_request: float,
+        requests_per_minute: Optional[int],
+        tokens_per_minute: Optional[int],
+    ) -> Tuple[float, str]:
+        """Returns the projected duration of the run and what limits it"""
+        bounds = {
+            "concurrency": num_rows * seconds_per_request / max(max_concurrency, 1),
+        }
+        if requests_per_minute:
+            bounds["requests_per_minute"] = 60 * num_rows / requests_per_minute
+        if tokens_per_minute:
+            bounds["tokens_per_minute"] = 60 * total_tokens / tokens_per_minute
+        limited_by = max(bounds, key=bounds.get)
+        return bounds[limited_by], limited_by
@@ -3,7 +3,7 @@ from enum import Enum
 from typing import Any, Dict, List, Optional, Union
 
 from langchain.schema import ChatGeneration, Generation
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator, validator
 
 from autolabel.utils import calculate_md5
 
@@ -100,6 +100,8 @@ class ErrorType(str, Enum):
 
     CONTEXT_LENGTH_ERROR = "context_length_exceeded_error"
     RATE_LIMIT_ERROR = "rate_limit_exceeded_error"
+    TIMEOUT_ERROR = "timeout_error"
+    DEADLINE_EXCEEDED_ERROR = "deadline_exceeded_error"
     LLM_PROVIDER_ERROR = "llm_provider_error"
     PARSING_ERROR = "parsing_error"
     OUTPUT_GUIDELINES_NOT_FOLLOWED_ERROR = "output_guidelines_not_followed_error"
@@ -130,6 +132,7 @@ class LLMAnnotation(BaseModel):
     prompt: Optional[str] = ""
     input_tokens: Optional[int] = None
     output_tokens: Optional[int] = None
+    cached_input_tokens: Optional[int] = None
     cost: Optional[float] = None
     latency: Optional[float] = None
     error: Optional[LabelingError] = None
@@ -221,6 +224,9 @@ class RefuelLLMResult(BaseModel):
     """Latencies incurred during the labeling job"""
     latencies: Optional[List[float]] = []
 
+    """Number of prompt tokens that the provider read from its prompt cache"""
+    cached_tokens: Optional[List[int]] = []
+
 
 class AggregationFunction(str, Enum):
 
@@ -230,5 +236,86 @@ class AggregationFunction(str, Enum):
     MEAN = "mean"
 
 
+class SchedulingStrategy(str, Enum):
+
+    """Enum of supported orders in which rows are sent to the LLM"""
+
+    LONGEST_FIRST = "longest_first"
+    INTERLEAVED = "interleaved"
+
+
+class RunOptions(BaseModel):
+
+    """
+    Options of a labeling run that control how rows are sent to the LLM, passed to
+    LabelingAgent.run and run_streaming. Options that do not work together are
+    rejected with a ValueError when the options are created.
+    """
+
+    """Maximum number of concurrent requests to the LLM. Labels are returned in dataset order regardless of completion order"""
+    max_concurrency: int = 1
+
+    """Maximum number of prompts sent to the LLM in a single label call. Only prompts with the same output schema are batched together"""
+    batch_size: int = 1
+
+    """Maximum number of prompt tokens in a single batch. Requires batch_size > 1"""
+    max_batch_tokens: Optional[int] = None
+
+    """If True, max_concurrency is treated as an upper bound. The number of concurrent requests is raised while requests succeed and cut on rate limit or timeout errors, and the affected rows are retried instead of being labeled NO_LABEL"""
+    adaptive_concurrency: bool = False
+
+    """Number of worker threads that construct prompts and parse responses, so that this work does not block the event loop. 0 does this work on the event loop"""
+    num_workers: int = 0
+
+    """If True, rows that construct the same prompt share a single LLM request. The fraction of deduplicated rows is reported at the end of the run"""
+    deduplicate: bool = False
+
+    """If provided, every labeled row is recorded in a checkpoint journal in this directory. Rerunning with the same checkpoint_dir and run_id only labels the rows that are missing from the journal"""
+    checkpoint_dir: Optional[str] = None
+
+    """Identifies the checkpoint journal of the run. Defaults to a hash of the config and the dataset. Requires checkpoint_dir"""
+    run_id: Optional[str] = None
+
+    """Maximum number of seconds spent labeling a row, including retries. Rows that take longer are labeled NO_LABEL with a DEADLINE_EXCEEDED_ERROR"""
+    row_timeout: Optional[float] = None
+
+    """Maximum number of seconds the run may take. Once it is spent no more rows are dispatched, rows in flight are cut off and all unlabeled rows get a DEADLINE_EXCEEDED_ERROR. These rows are not recorded in the checkpoint journal, so rerunning with the same checkpoint_dir labels them"""
+    time_budget: Optional[float] = None
+
+    """Order in which rows are sent to the LLM, by the number of tokens in their prompts. All prompts are constructed before the first row is sent. Defaults to dataset order. Labels are returned in dataset order regardless"""
+    schedule: Optional[SchedulingStrategy] = None
+
+    class Config:
+        extra = "forbid"
+
+    @validator("max_concurrency", "batch_size", "max_batch_tokens")
+    def _positive(cls, value: Optional[int], field) -> Optional[int]:
+        if value is not None and value < 1:
+            raise ValueError(f"{field.name} must be a positive integer, got {value}")
+        return value
+
+    @validator("num_workers")
+    def _not_negative(cls, value: int) -> int:
+        if value < 0:
+            raise ValueError(f"num_workers must not be negative, got {value}")
+        return value
+
+    @validator("row_timeout", "time_budget")
+    def _positive_seconds(cls, value: Optional[float], field) -> Optional[float]:
+        if value is not None and value <= 0:
+            raise ValueError(f"{field.name} must be a positive number, got {value}")
+        return value
+
+    @root_validator(skip_on_failure=True)
+    def _compatible(cls, values: Dict) -> Dict:
+        if values["run_id"] and not values["checkpoint_dir"]:
+            raise ValueError("run_id identifies a checkpoint, it requires checkpoint_dir")
+        if values["max_batch_tokens"] and values["batch_size"] == 1:
+            raise ValueError(
+                "max_batch_tokens limits the size of a batch, it requires batch_size > 1",
+            )
+        return values
+
+
 AUTO_CONFIDENCE_CHUNKING_COLUMN = "auto"
 TASK_CHAIN_TYPE = "task_chain"
@@ -4,7 +4,8 @@ import logging
 import pickle
 import re
 from collections import defaultdict
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from functools import cached_property
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 
 import json5
 from langchain.prompts.prompt import PromptTemplate
@@ -16,6 +17,12 @@ from autolabel.metrics import (
     AUROCMetric,
     BaseMetric,
     CompletionRateMetric,
+    RunningAccuracyMetric,
+    RunningAUROCMetric,
+    RunningCompletionRateMetric,
+    RunningEvaluator,
+    RunningMetric,
+    RunningSupportMetric,
     SupportMetric,
 )
 from autolabel.schema import (
@@ -28,10 +35,17 @@ from autolabel.schema import (
 from autolabel.utils import get_format_variables
 
 from .base import BaseTask
+from .prompt_plan import PromptPlan
 
 logger = logging.getLogger(__name__)
 
 
+def _as_dict(value) -> Dict:
+    if not isinstance(value, dict):
+        raise ValueError(f"Expected a json object, got {type(value).__name__}")
+    return value
+
+
 class AttributeExtractionTask(BaseTask):
     NULL_LABEL = {}
     DEFAULT_TASK_GUIDELINES = "You are an expert at extracting attributes from text. Given a piece of text, extract the required attributes."
@@ -55,6 +69,102 @@ class AttributeExtractionTask(BaseTask):
         if self.config.confidence():
             self.metrics.append(AUROCMetric())
 
+    def _running_metrics(self) -> List[RunningMetric]:
+        metrics = [
+            RunningSupportMetric(),
+            RunningCompletionRateMetric(),
+            RunningAccuracyMetric(),
+        ]
+        if self.config.confidence():
+            metrics.append(RunningAUROCMetric())
+        return metrics
+
+    def get_running_evaluator(self) -> RunningEvaluator:
+        """Returns an evaluator that tracks the metrics computed by eval one annotation at a time"""
+        return RunningEvaluator(self._running_metrics)
+
+    @cached_property
+    def _prompt_plan(self) -> PromptPlan:
+        """Prompt plan used for the rows that do not select their own labels"""
+        attribute_json, output_schema = self._construct_attribute_json()
+        return PromptPlan(
+            self.prompt_template.template,
+            {
+                "task_guidelines": self.task_guidelines,
+                "output_guidelines": self.output_guidelines.format(
+                    attribute_json=attribute_json,
+                ),
+            },
+            output_schema=output_schema,
+        )
+
+    @cached_property
+    def _attribute_options(self) -> List[Tuple[str, Optional[str], Set[str]]]:
+        """Name, task type and set of options of every attribute, for validating the labels in LLM responses"""
+        return [
+            (
+                attribute["name"],
+                attribute.get("task_type"),
+                set(attribute.get("options") or []),
+            )
+            for attribute in self.config.attributes()
+        ]
+
+    @staticmethod
+    def _load_response_json(text: str) -> Dict:
+        """
+        Parses the json object in an LLM response. Most responses are strict json,
+        so the json module is tried before json5, which is pure Python and much
+        slower but also accepts e.g. single quotes and trailing commas. If the
+        response is not a json object as a whole, the object is searched for between
+        the first and last brace, allowing raw newlines inside its strings.
+        """
+        # Remove markdown formatting from the completion text
+        completion_text = text.lstrip("```json").rstrip("```")
+        try:
+            return _as_dict(json.loads(completion_text))
+        except ValueError:
+            pass
+        try:
+            return _as_dict(json5.loads(completion_text))
+        except Exception as e:
+            logger.info(
+                f"Error parsing LLM response: {text}, Error: {e}. Now searching for valid JSON in response",
+            )
+
+        json_str = text[text.find("{") : text.rfind("}") + 1]
+        try:
+            return _as_dict(json.loads(json_str, strict=False))
+        except ValueError:
+            pass
+        json_str = re.sub(
+            r'"[^"]*"', lambda m: m.group().replace("\n", "\\n"), json_str,
+        )
+        return _as_dict(json5.loads(json_str))
+
+    def static_prompt_prefix(self, examples: Optional[List[Dict]] = None) -> str:
+        if self.image_cols:
+            # The prompt is sent as json with the image columns
+            return ""
+        static_sections = dict(self._prompt_plan.static_sections)
+        if self._is_few_shot_mode() and examples is not None:
+            static_sections["seed_examples"] = "\n\n".join(
+                self._format_seed_examples(copy.deepcopy(examples)),
+            )
+        return PromptPlan(self.prompt_template.template, static_sections).static_prefix
+
+    def _format_seed_examples(self, examples: List[Dict]) -> List[str]:
+        example_template = self.config.example_template()
+        fmt_examples = []
+        for eg in examples:
+            if self.OUTPUT_DICT_KEY not in eg:
+                output_dict = self._generate_output_dict(eg)
+                if output_dict is None:
+                    continue
+                eg.update({self.OUTPUT_DICT_KEY: output_dict})
+            fmt_examples.append(example_template.format_map(defaultdict(str, eg)))
+        return fmt_examples
+
     def _construct_attribute_json(
         self,
         selected_labels_map: Dict[str, List[str]] = None,
@@ -197,6 +307,7 @@ class AttributeExtractionTask(BaseTask):
         output_guidelines_override: Optional[str] = None,
         max_input_tokens: Optional[int] = None,
         get_num_tokens: Optional[Callable] = None,
+        get_token_offsets: Optional[Callable] = None,
         selected_labels_map: Dict[str, List[str]] = None,
         selected_labels_desc_map: Dict[str, Dict[str, str]] = None,
         **kwargs,
@@ -226,27 +337,35 @@ class AttributeExtractionTask(BaseTask):
                         if l not in selected_labels_map[attribute_name]:
                             selected_labels_map[attribute_name].append(l)
 
-        attribute_json, output_schema = self._construct_attribute_json(
-            selected_labels_map=selected_labels_map,
-            selected_labels_desc_map=selected_labels_desc_map,
-        )
-        output_guidelines = (
-            self.output_guidelines
-            if output_guidelines_override is None
-            else output_guidelines_override
-        )
-        fmt_output_guidelines = output_guidelines.format(attribute_json=attribute_json)
+        # Unless the labels are selected per row, the attribute json, output
+        # guidelines and output schema are the same for every row
+        prompt_plan = None
+        if (
+            not selected_labels_map
+            and not selected_labels_desc_map
+            and output_guidelines_override is None
+            and prompt_template_override is None
+        ):
+            prompt_plan = self._prompt_plan
+            fmt_output_guidelines = prompt_plan.static_sections["output_guidelines"]
+            output_schema = prompt_plan.output_schema
+        else:
+            attribute_json, output_schema = self._construct_attribute_json(
+                selected_labels_map=selected_labels_map,
+                selected_labels_desc_map=selected_labels_desc_map,
+            )
+            output_guidelines = (
+                self.output_guidelines
+                if output_guidelines_override is None
+                else output_guidelines_override
+            )
+            fmt_output_guidelines = output_guidelines.format(
+                attribute_json=attribute_json,
+            )
 
         # prepare seed examples
         example_template = self.config.example_template()
-        fmt_examples = []
-        for eg in examples:
-            if self.OUTPUT_DICT_KEY not in eg:
-                output_dict = self._generate_output_dict(eg)
-                if output_dict is None:
-                    continue
-                eg.update({self.OUTPUT_DICT_KEY: output_dict})
-            fmt_examples.append(example_template.format_map(defaultdict(str, eg)))
+        fmt_examples = self._format_seed_examples(examples)
 
         input[self.OUTPUT_DICT_KEY] = ""
 
@@ -286,6 +405,8 @@ class AttributeExtractionTask(BaseTask):
                 current_example=current_example,
                 max_input_tokens=max_input_tokens,
                 get_num_tokens=get_num_tokens,
+                get_token_offsets=get_token_offsets,
+                prompt_plan=prompt_plan,
             )
         else:
             curr_text_prompt = self.trim_prompt(
@@ -295,6 +416,8 @@ class AttributeExtractionTask(BaseTask):
                 current_example=current_example,
                 max_input_tokens=max_input_tokens,
                 get_num_tokens=get_num_tokens,
+                get_token_offsets=get_token_offsets,
+                prompt_plan=prompt_plan,
             )
         if self.image_cols:
             prompt_dict = {"text": curr_text_prompt}
@@ -348,79 +471,47 @@ class AttributeExtractionTask(BaseTask):
         successfully_labeled = False
         error = None
         try:
-            completion_text = response.text
-
-            # Remove markdown formatting from the completion text
-            completion_text = completion_text.lstrip("```json")
-            completion_text = completion_text.rstrip("```")
-            llm_label = {}
-            for k, v in json5.loads(completion_text).items():
-                if isinstance(v, list) or isinstance(v, dict):
-                    llm_label[k] = v
-                else:
-                    llm_label[k] = str(v)
+            llm_label = {
+                k: v if isinstance(v, (list, dict)) else str(v)
+                for k, v in self._load_response_json(response.text).items()
+            }
             successfully_labeled = True
         except Exception as e:
-            logger.info(
-                f"Error parsing LLM response: {response.text}, Error: {e}. Now searching for valid JSON in response",
+            logger.error(f"Error parsing LLM response: {response.text}, Error: {e}")
+            llm_label = self.NULL_LABEL
+            error = LabelingError(
+                error_type=ErrorType.INVALID_LLM_RESPONSE_ERROR,
+                error_message=str(e),
             )
-            try:
-                json_start, json_end = response.text.find("{"), response.text.rfind("}")
-                json_str = re.sub(
-                    r'"[^"]*"',
-                    lambda m: m.group().replace("\n", "\\n"),
-                    response.text[json_start : json_end + 1],
-                )
-                llm_label = {}
-                for k, v in json5.loads(
-                    json_str,
-                ).items():
-                    if isinstance(v, list) or isinstance(v, dict):
-                        llm_label[k] = v
-                    else:
-                        llm_label[k] = str(v)
-                successfully_labeled = True
-            except Exception as e:
-                logger.error(f"Error parsing LLM response: {response.text}, Error: {e}")
-                llm_label = self.NULL_LABEL
-                error = LabelingError(
-                    error_type=ErrorType.INVALID_LLM_RESPONSE_ERROR,
-                    error_message=str(e),
-                )
 
         if successfully_labeled:
-            for attribute in self.config.attributes():
-                attr_options = attribute.get("options")
-                if selected_labels_map and attribute["name"] in selected_labels_map:
-                    attr_options = selected_labels_map[attribute["name"]]
-                attr_type = attribute.get("task_type")
-                if attr_options is not None and len(attr_options) > 0:
-                    attr_label = str(llm_label.get(attribute["name"]))
-                    if attr_type == TaskType.CLASSIFICATION:
-                        if attr_label is not None and attr_label not in attr_options:
-                            logger.warning(
-                                f"Attribute {attr_label} from the LLM response {llm_label} is not in the labels list",
-                            )
-                            llm_label.pop(attribute["name"], None)
-                    elif attr_type == TaskType.MULTILABEL_CLASSIFICATION:
-                        original_attr_labels = attr_label.split(
-                            self.config.label_separator(),
+            label_separator = self.config.label_separator()
+            for name, attr_type, attr_options in self._attribute_options:
+                if selected_labels_map and name in selected_labels_map:
+                    attr_options = set(selected_labels_map[name])
+                if not attr_options:
+                    continue
+                attr_label = str(llm_label.get(name))
+                if attr_type == TaskType.CLASSIFICATION:
+                    if attr_label not in attr_options:
+                        logger.warning(
+                            f"Attribute {attr_label} from the LLM response {llm_label} is not in the labels list",
                         )
-                        filtered_attr_labels = list(
-                            filter(
-                                lambda x: x.strip() in attr_options,
-                                original_attr_labels,
-                            ),
+                        llm_label.pop(name, None)
+                elif attr_type == TaskType.MULTILABEL_CLASSIFICATION:
+                    original_attr_labels = attr_label.split(label_separator)
+                    filtered_attr_labels = [
+                        label
+                        for label in original_attr_labels
+                        if label.strip() in attr_options
+                    ]
+                    llm_label[name] = label_separator.join(filtered_attr_labels)
+                    if len(filtered_attr_labels) != len(original_attr_labels):
+                        logger.warning(
+                            f"Attribute {attr_label} from the LLM response {llm_label} is not in the labels list. Filtered list: {filtered_attr_labels}",
                         )
-                        llm_label[
-                            attribute["name"]
-                        ] = self.config.label_separator().join(filtered_attr_labels)
-                        if len(filtered_attr_labels) != len(original_attr_labels):
-                            logger.warning(
-                                f"Attribute {attr_label} from the LLM response {llm_label} is not in the labels list. Filtered list: {filtered_attr_labels}",
-                            )
-                        if len(filtered_attr_labels) == 0:
-                            llm_label.pop(attribute["name"], None)
+                    if len(filtered_attr_labels) == 0:
+                        llm_label.pop(name, None)
         return LLMAnnotation(
             curr_sample=pickle.dumps(curr_sample),
             successfully_labeled=successfully_labeled,
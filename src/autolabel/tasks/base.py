@@ -10,7 +10,7 @@ from langchain.prompts.prompt import PromptTemplate
 from langchain.schema import ChatGeneration, Generation
 
 from autolabel.configs import AutolabelConfig
-from autolabel.metrics import BaseMetric
+from autolabel.metrics import BaseMetric, RunningEvaluator
 from autolabel.schema import (
     ErrorType,
     FewShotAlgorithm,
@@ -20,6 +20,9 @@ from autolabel.schema import (
 )
 from autolabel.utils import extract_valid_json_substring, get_format_variables
 
+from .prompt_plan import PromptPlan
+from .trimming import trim_to_token_budget
+
 logger = logging.getLogger(__name__)
 
 REFUEL_LLM_MODEL = "refuel-llm"
@@ -77,10 +80,27 @@ class BaseTask(ABC):
         output_guidelines_override: Optional[str] = None,
         max_input_tokens: Optional[int] = None,
         get_num_tokens: Optional[Callable] = None,
+        get_token_offsets: Optional[Callable] = None,
         **kwargs,
     ) -> Tuple[str, str]:
         pass
 
+    def static_prompt_prefix(self, examples: Optional[List[Dict]] = None) -> str:
+        """
+        Returns the start of the prompt that is the same for every row, or an empty
+        string if the task does not know it ahead of time. The templates put the
+        sections that are shared by every row (the guidelines, and the seed examples
+        when they are the same for every row) first, so the prefix can be cached by
+        the provider.
+
+        Args:
+            examples: the seed examples, if every row uses the same ones
+        Returns:
+            The static prefix of the prompt
+
+        """
+        return ""
+
     def trim_prompt(
         self,
         prompt_template: PromptTemplate,
@@ -90,52 +110,46 @@ class BaseTask(ABC):
         seed_examples: Optional[str] = None,
         max_input_tokens: Optional[int] = None,
         get_num_tokens: Optional[Callable] = None,
+        prompt_plan: Optional[PromptPlan] = None,
+        get_token_offsets: Optional[Callable] = None,
     ) -> str:
-        complete_prompt = prompt_template.format(
-            task_guidelines=task_guidelines,
-            output_guidelines=output_guidelines,
-            seed_examples=seed_examples,
-            current_example=current_example,
-        )
-        if not max_input_tokens or not get_num_tokens:
-            return complete_prompt
-
-        trimming_priority = [
-            seed_examples,
-            task_guidelines,
-            output_guidelines,
-            current_example,
-        ]
-        trimmed_elements = {key: key for key in trimming_priority if key is not None}
-        for trimming_candidate in trimming_priority:
-            current_prompt_length = get_num_tokens(complete_prompt)
-            if current_prompt_length <= max_input_tokens:
-                break
-            if trimming_candidate is None:
-                continue
-            extra_tokens = current_prompt_length - max_input_tokens
-            trimming_candidate_tokens = get_num_tokens(trimming_candidate)
-            max_chars = (
-                float(len(trimming_candidate))
-                * (trimming_candidate_tokens - extra_tokens - 1)
-                / (trimming_candidate_tokens + 1)
+        if prompt_plan is not None:
+            # The guidelines are already rendered into the plan
+            complete_prompt = prompt_plan.render(
+                seed_examples=seed_examples, current_example=current_example,
             )
-            final_candidate_chars = int(max(0, max_chars))
-            trimmed_elements[trimming_candidate] = trimming_candidate[
-                :final_candidate_chars
-            ]
+        else:
             complete_prompt = prompt_template.format(
-                task_guidelines=trimmed_elements[task_guidelines],
-                output_guidelines=trimmed_elements[output_guidelines],
-                seed_examples=(
-                    trimmed_elements[seed_examples]
-                    if seed_examples is not None
-                    else None
-                ),
-                current_example=trimmed_elements[current_example],
+                task_guidelines=task_guidelines,
+                output_guidelines=output_guidelines,
+                seed_examples=seed_examples,
+                current_example=current_example,
             )
+        if not max_input_tokens or not get_num_tokens:
+            return complete_prompt
 
-        return complete_prompt
+        # The guidelines are the same for every row, so they are tokenized once
+        section_counts, section_offsets = (
+            prompt_plan.static_tokens(get_num_tokens, get_token_offsets)
+            if prompt_plan is not None
+            else (None, None)
+        )
+
+        return trim_to_token_budget(
+            prompt_template.template,
+            {
+                "task_guidelines": task_guidelines,
+                "output_guidelines": output_guidelines,
+                "seed_examples": seed_examples,
+                "current_example": current_example,
+            },
+            max_input_tokens,
+            get_num_tokens,
+            get_token_offsets=get_token_offsets,
+            complete_prompt=complete_prompt,
+            section_counts=section_counts,
+            section_offsets=section_offsets,
+        )
 
     @abstractmethod
     def eval(
@@ -146,6 +160,10 @@ class BaseTask(ABC):
     ) -> List[MetricResult]:
         pass
 
+    def get_running_evaluator(self) -> Optional[RunningEvaluator]:
+        """Returns an evaluator that updates the task metrics one annotation at a time, or None if the task does not support running metrics"""
+        return None
+
     @abstractmethod
     def get_explanation_prompt(self, example: Dict, include_label=True) -> str:
         raise NotImplementedError(
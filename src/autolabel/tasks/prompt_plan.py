@@ -0,0 +1,101 @@
+"""Prompt templates with the sections shared by every row rendered ahead of time."""
+
+import logging
+from string import Formatter
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PromptPlan:
+
+    """
+    A prompt template compiled against the sections of the prompt that are the same
+    for every row of a run, such as the task and output guidelines. The static
+    sections are rendered into the template once, so building the prompt of a row
+    only joins the rendered text with the row's own sections (e.g. the current
+    example and the seed examples). The output schema of the prompt is kept with
+    the plan and shared by every row, so it must not be modified by callers.
+    """
+
+    def __init__(
+        self,
+        template: str,
+        static_sections: Dict[str, str],
+        output_schema: Optional[Dict] = None,
+    ) -> None:
+        """
+        Args:
+            template: the prompt template, with plain {section} fields
+            static_sections: values of the sections that are the same for every row
+            output_schema: output schema of the prompts built from the plan
+
+        """
+        self.template = template
+        self.static_sections = static_sections
+        self.output_schema = output_schema
+        # Each segment is either rendered text (is_section=False) or the name of a
+        # section that is filled in per row (is_section=True)
+        self.segments: List[Tuple[bool, str]] = []
+        for text, section, _, _ in Formatter().parse(template):
+            self._append_text(text)
+            if section is None:
+                continue
+            if section in static_sections:
+                self._append_text(static_sections[section])
+            else:
+                self.segments.append((True, section))
+        self.row_sections = [name for is_section, name in self.segments if is_section]
+        # Token counts and offsets of the static sections, per tokenizer
+        self._static_tokens: Dict[
+            Tuple[Callable, Optional[Callable]],
+            Tuple[Dict[str, int], Dict[str, List[int]]],
+        ] = {}
+
+    def _append_text(self, text: str) -> None:
+        if not text:
+            return
+        if self.segments and not self.segments[-1][0]:
+            self.segments[-1] = (False, self.segments[-1][1] + text)
+        else:
+            self.segments.append((False, text))
+
+    @property
+    def static_prefix(self) -> str:
+        """The rendered text before the first section that changes per row"""
+        if self.segments and not self.segments[0][0]:
+            return self.segments[0][1]
+        return ""
+
+    def static_tokens(
+        self,
+        get_num_tokens: Callable[[str], int],
+        get_token_offsets: Optional[Callable[[str], Optional[List[int]]]] = None,
+    ) -> Tuple[Dict[str, int], Dict[str, List[int]]]:
+        """
+        Tokenizes the static sections, only the first time for each tokenizer.
+
+        Returns:
+            The number of tokens in each static section, and the token offsets of the sections whose offsets are known
+
+        """
+        key = (get_num_tokens, get_token_offsets)
+        if key not in self._static_tokens:
+            counts, offsets = {}, {}
+            for section, text in self.static_sections.items():
+                text = str(text)
+                section_offsets = get_token_offsets(text) if get_token_offsets else None
+                if section_offsets is not None:
+                    offsets[section] = section_offsets
+                    counts[section] = len(section_offsets)
+                else:
+                    counts[section] = get_num_tokens(text)
+            self._static_tokens[key] = (counts, offsets)
+        return self._static_tokens[key]
+
+    def render(self, **row_sections: str) -> str:
+        """Returns the prompt for a row. Sections of the row that are not in the template are ignored"""
+        return "".join(
+            str(row_sections[text]) if is_section else text
+            for is_section, text in self.segments
+        )
@@ -0,0 +1,129 @@
+"""Trimming of prompts that do not fit in the context window of the model."""
+
+import functools
+import logging
+from string import Formatter
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Sections of the prompt in the order they are trimmed in
+TRIMMING_PRIORITY = [
+    "seed_examples",
+    "task_guidelines",
+    "output_guidelines",
+    "current_example",
+]
+# Tokens can merge across the boundaries of the sections, so the trimmed prompt is
+# counted again and trimmed further if it still does not fit
+MAX_TRIMMING_PASSES = 4
+
+
+@functools.lru_cache(maxsize=64)
+def _parse_template(template: str) -> Tuple[Tuple[str, Optional[str]], ...]:
+    return tuple(
+        (text, section) for text, section, _, _ in Formatter().parse(template)
+    )
+
+
+def _render(
+    parsed_template: Tuple[Tuple[str, Optional[str]], ...], sections: Dict[str, str],
+) -> str:
+    return "".join(
+        text + (sections[section] if section is not None else "")
+        for text, section in parsed_template
+    )
+
+
+def trim_to_token_budget(
+    template: str,
+    sections: Dict[str, Optional[str]],
+    max_input_tokens: int,
+    get_num_tokens: Callable[[str], int],
+    get_token_offsets: Optional[Callable[[str], Optional[List[int]]]] = None,
+    complete_prompt: Optional[str] = None,
+    section_counts: Optional[Dict[str, int]] = None,
+    section_offsets: Optional[Dict[str, List[int]]] = None,
+) -> str:
+    """
+    Renders template with sections, trimming the end of the sections in TRIMMING_PRIORITY order until the prompt fits in max_input_tokens.
+
+    Every section that has to be trimmed is tokenized once. With the offsets of its
+    tokens, the section is cut exactly after the tokens that fit. Without offsets,
+    the cut is estimated from the section's characters per token, and the next pass
+    trims whatever still does not fit.
+
+    Args:
+        template: the prompt template, with plain {section} fields
+        sections: values of the sections of the template
+        max_input_tokens: maximum number of tokens in the prompt
+        get_num_tokens: counts the tokens in a string
+        get_token_offsets: returns the character offset at which each token of a string starts, or None if unknown
+        complete_prompt: the untrimmed prompt, if it was already rendered
+        section_counts: number of tokens in sections that were counted before, e.g. the sections that are the same for every row
+        section_offsets: token offsets of sections that were tokenized before
+    Returns:
+        The prompt, trimmed to fit in max_input_tokens where possible
+
+    """
+    parsed_template = _parse_template(template)
+    texts = {
+        section: str(sections.get(section))
+        for _, section in parsed_template
+        if section is not None
+    }
+    prompt = (
+        complete_prompt
+        if complete_prompt is not None
+        else _render(parsed_template, texts)
+    )
+    num_tokens = get_num_tokens(prompt)
+    # Number of tokens in each section, once it is known
+    counts: Dict[str, int] = dict(section_counts or {})
+    known_offsets = dict(section_offsets or {})
+    for section, offsets in known_offsets.items():
+        counts[section] = len(offsets)
+    for _ in range(MAX_TRIMMING_PASSES):
+        if num_tokens <= max_input_tokens:
+            return prompt
+        excess = num_tokens - max_input_tokens
+        trimmed = False
+        for section in TRIMMING_PRIORITY:
+            if excess <= 0:
+                break
+            if section not in texts or sections.get(section) is None:
+                continue
+            text = texts[section]
+            if not text:
+                continue
+            # Offsets are only known for the untrimmed text of a section
+            offsets = known_offsets.pop(section, None)
+            if section not in counts:
+                offsets = get_token_offsets(text) if get_token_offsets else None
+                counts[section] = (
+                    len(offsets) if offsets is not None else get_num_tokens(text)
+                )
+            section_tokens = counts[section]
+            keep = max(section_tokens - excess, 0)
+            if offsets is None and get_token_offsets and keep > 0:
+                offsets = get_token_offsets(text)
+            if offsets is not None:
+                end = offsets[keep] if keep < len(offsets) else len(text)
+                counts[section] = keep
+            else:
+                end = int(len(text) * keep / section_tokens) if section_tokens else 0
+                # The number of tokens left is only estimated, count them again if needed
+                counts.pop(section)
+            texts[section] = text[:end]
+            excess -= section_tokens - keep
+            trimmed = True
+        if not trimmed:
+            break
+        prompt = _render(parsed_template, texts)
+        num_tokens = get_num_tokens(prompt)
+
+    if num_tokens > max_input_tokens:
+        logger.warning(
+            f"Prompt has {num_tokens} tokens after trimming, more than the maximum of {max_input_tokens}",
+        )
+    return prompt
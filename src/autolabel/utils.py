@@ -7,7 +7,17 @@ import re
 import shutil
 import string
 from string import Formatter
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
 import regex
 import wget
@@ -306,6 +316,66 @@ def track_with_stats(
             live.refresh()
 
 
+async def atrack_with_stats(
+    sequence: AsyncIterable[ProgressType],
+    stats: Dict[str, str],
+    total: Optional[int],
+    description: str = None,
+    advance: int = 1,
+    transient: bool = False,
+    console: Optional[Console] = None,
+    disable: bool = False,
+) -> AsyncIterator[ProgressType]:
+    """
+    Track progress and displays stats by iterating over an async iterable.
+
+    Args:
+        sequence (AsyncIterable[ProgressType]): An async iterable you wish to iterate over.
+        stats (Dict[str, str]): A dictionary of stats to display.
+        total (int, optional): Total number of steps. If `None`, the progress bar is indeterminate.
+        description (str, optional): Description of task show next to progress bar. Defaults to `None`.
+        advance (int, optional): Number of steps to advance progress by. Defaults to 1.
+        transient (bool, optional): Clear the progress on exit. Defaults to False.
+        console (Console, optional): Console to write to. Default creates internal Console instance.
+        disable (bool, optional): Disable display of progress.
+
+    Returns:
+        AsyncIterator[ProgressType]: An async iterator over the values in the sequence.
+
+    """
+    progress = _autolabel_progress(
+        description=description,
+        transient=transient,
+        console=console,
+        disable=disable,
+    )
+    stats_progress = Progress(
+        TextColumn("{task.fields[stats]}"),
+        console=console,
+    )
+
+    group = Group(progress, stats_progress)
+    live = LiveDisplay.get_instance(group, console=console).live
+
+    with live:
+        progress_task = progress.add_task(description=description, total=total)
+        stats_task = stats_progress.add_task(
+            "Stats",
+            stats=", ".join(f"{k}={v}" for k, v in stats.items()),
+        )
+        async for value in sequence:
+            yield value
+            step = advance
+            if total is not None:
+                step = min(advance, total - progress.tasks[progress_task].completed)
+            progress.advance(progress_task, advance=step)
+            stats_progress.update(
+                stats_task,
+                stats=", ".join(f"{k}={v}" for k, v in stats.items()),
+            )
+            live.refresh()
+
+
 def maybe_round(value: Any) -> Any:
     """Round's value only if it has a round function"""
     if hasattr(value, "__round__"):
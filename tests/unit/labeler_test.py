@@ -0,0 +1,737 @@
+import asyncio
+import copy
+import itertools
+import json
+import pickle
+import random
+import threading
+
+import pandas as pd
+import pytest
+from langchain.schema import Generation
+
+from autolabel import LabelingAgent
+from autolabel.cache import BaseCache
+from autolabel.checkpoint import CheckpointJournal
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import AutolabelDataset
+from autolabel.schema import ErrorType, LabelingError, RefuelLLMResult, RunOptions
+
+BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
+
+
+def _zero_shot_config():
+    config = copy.deepcopy(BANKING_CONFIG)
+    config["model"]["compute_confidence"] = False
+    del config["prompt"]["few_shot_examples"]
+    del config["prompt"]["few_shot_selection"]
+    del config["prompt"]["few_shot_num"]
+    return AutolabelConfig(config)
+
+
+def _agent(mocker, config=None):
+    agent = LabelingAgent(
+        config=config or _zero_shot_config(),
+        console_output=False,
+        generation_cache=None,
+        transform_cache=None,
+        confidence_cache=None,
+    )
+    mocker.patch.object(agent.llm, "get_num_tokens", side_effect=len)
+    return agent
+
+
+def _dataset(config, num_rows):
+    df = pd.DataFrame({"example": [f"example {i}" for i in range(num_rows)]})
+    return AutolabelDataset(df, config)
+
+
+def _example_in(prompt):
+    return prompt.split("Input: ")[-1].split("\n")[0]
+
+
+def _label_with_echo(state):
+    """Fake LLM which labels every prompt with the example it contains after a random delay."""
+
+    async def label(prompts, output_schema=None, use_cache=True):
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(random.random() / 100)
+        state["in_flight"] -= 1
+        return RefuelLLMResult(
+            generations=[
+                [Generation(text=json.dumps({"label": _example_in(prompt)}))]
+                for prompt in prompts
+            ],
+            errors=[None for _ in prompts],
+            costs=[0.5 for _ in prompts],
+            latencies=[0.01 for _ in prompts],
+        )
+
+    return label
+
+
+def test_concurrent_run_preserves_dataset_order(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(20)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    mocker.patch.object(agent.llm, "label", side_effect=_label_with_echo(state))
+
+    dataset = agent.run(_dataset(config, 20), options=RunOptions(max_concurrency=4))
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(20)]
+    assert 1 < state["max_in_flight"] <= 4
+
+
+def test_sequential_run_has_single_request_in_flight(mocker):
+    config = _zero_shot_config()
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    mocker.patch.object(agent.llm, "label", side_effect=_label_with_echo(state))
+
+    dataset = agent.run(_dataset(config, 5))
+
+    assert state["max_in_flight"] == 1
+    assert len(dataset.df) == 5
+
+
+def test_batched_run_splits_results_onto_rows(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(10)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    label = mocker.patch.object(
+        agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+
+    dataset = agent.run(
+        _dataset(config, 10), options=RunOptions(max_concurrency=2, batch_size=4),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(10)]
+    batch_sizes = [len(call.args[0]) for call in label.call_args_list]
+    assert sum(batch_sizes) == 10
+    assert max(batch_sizes) == 4
+
+
+def test_adaptive_run_retries_rate_limited_rows(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(4)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0, "rate_limited": False}
+    echo = _label_with_echo(state)
+
+    async def label(prompts, output_schema=None, use_cache=True):
+        if _example_in(prompts[0]) == "example 2" and not state["rate_limited"]:
+            state["rate_limited"] = True
+            return RefuelLLMResult(
+                generations=[[Generation(text="")]],
+                errors=[
+                    LabelingError(
+                        error_type=ErrorType.RATE_LIMIT_ERROR,
+                        error_message="Rate limit exceeded",
+                    ),
+                ],
+                costs=[0.0],
+                latencies=[0.01],
+            )
+        return await echo(prompts, output_schema)
+
+    mocker.patch.object(agent.llm, "label", side_effect=label)
+
+    dataset = agent.run(
+        _dataset(config, 4),
+        options=RunOptions(max_concurrency=2, adaptive_concurrency=True),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(4)]
+    assert state["rate_limited"]
+
+
+def test_streaming_run_writes_rows_in_order(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(250)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    mocker.patch.object(agent.llm, "label", side_effect=_label_with_echo(state))
+    input_file = tmp_path / "input.jsonl"
+    pd.DataFrame({"example": [f"example {i}" for i in range(250)]}).to_json(
+        input_file, orient="records", lines=True,
+    )
+    output_file = tmp_path / "output.jsonl"
+
+    cost = agent.run_streaming(
+        str(input_file),
+        str(output_file),
+        start_index=10,
+        options=RunOptions(max_concurrency=8),
+    )
+
+    output = pd.read_json(output_file, lines=True, dtype=str)
+    assert output["example"].tolist() == [f"example {i}" for i in range(10, 250)]
+    assert output["label_label"].tolist() == [
+        f"example {i}" for i in range(10, 250)
+    ]
+    assert cost == 0.5 * 240
+
+
+def test_streaming_run_with_console_output(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(5)
+    ]
+    agent = _agent(mocker, config)
+    agent.console_output = True
+    state = {"in_flight": 0, "max_in_flight": 0}
+    mocker.patch.object(agent.llm, "label", side_effect=_label_with_echo(state))
+    input_file = tmp_path / "input.jsonl"
+    pd.DataFrame({"example": [f"example {i}" for i in range(5)]}).to_json(
+        input_file, orient="records", lines=True,
+    )
+    output_file = tmp_path / "output.jsonl"
+
+    agent.run_streaming(
+        str(input_file), str(output_file), options=RunOptions(max_concurrency=2),
+    )
+
+    output = pd.read_json(output_file, lines=True, dtype=str)
+    assert output["label_label"].tolist() == [f"example {i}" for i in range(5)]
+
+
+def test_checkpointed_run_resumes_unfinished_rows(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(6)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    label = mocker.patch.object(
+        agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+    dataset = _dataset(config, 6)
+
+    agent.run(
+        dataset, max_items=4, options=RunOptions(checkpoint_dir=str(tmp_path)),
+    )
+    assert label.call_count == 4
+
+    label.reset_mock()
+    resumed = agent.run(dataset, options=RunOptions(checkpoint_dir=str(tmp_path)))
+
+    assert label.call_count == 2
+    labels = resumed.df[resumed.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(6)]
+
+
+def test_checkpoint_journal_is_closed_when_labeling_fails(mocker, tmp_path):
+    config = _zero_shot_config()
+    agent = _agent(mocker, config)
+    mocker.patch.object(agent.llm, "label", side_effect=KeyboardInterrupt)
+    close = mocker.spy(CheckpointJournal, "close")
+
+    with pytest.raises(KeyboardInterrupt):
+        agent.run(
+            _dataset(config, 2), options=RunOptions(checkpoint_dir=str(tmp_path)),
+        )
+
+    assert close.call_count == 1
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"run_id": "run"},
+        {"max_batch_tokens": 100},
+        {"max_concurrency": 0},
+        {"num_workers": -1},
+        {"row_timeout": 0},
+        {"max_concurency": 4},
+    ],
+)
+def test_run_options_reject_invalid_combinations(options):
+    with pytest.raises(ValueError):
+        RunOptions(**options)
+
+
+def test_streaming_run_rejects_unsupported_options(mocker, tmp_path):
+    agent = _agent(mocker, _zero_shot_config())
+
+    with pytest.raises(ValueError, match="checkpoint_dir"):
+        agent.run_streaming(
+            [{"example": "a"}],
+            str(tmp_path / "out.jsonl"),
+            options=RunOptions(checkpoint_dir=str(tmp_path)),
+        )
+
+
+def test_worker_pool_run_builds_prompts_off_the_event_loop(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(10)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    mocker.patch.object(agent.llm, "label", side_effect=_label_with_echo(state))
+    threads = set()
+    construct_row_prompt = agent._construct_row_prompt
+
+    def record_thread(chunk):
+        threads.add(threading.current_thread().name)
+        return construct_row_prompt(chunk)
+
+    mocker.patch.object(agent, "_construct_row_prompt", side_effect=record_thread)
+
+    dataset = agent.run(
+        _dataset(config, 10), options=RunOptions(max_concurrency=4, num_workers=2),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(10)]
+    assert threads and all(name.startswith("autolabel-worker") for name in threads)
+
+
+def test_deduplicated_run_labels_each_unique_prompt_once(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(3)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    label = mocker.patch.object(
+        agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+    df = pd.DataFrame({"example": [f"example {i % 3}" for i in range(9)]})
+
+    dataset = agent.run(
+        AutolabelDataset(df, config),
+        options=RunOptions(max_concurrency=4, deduplicate=True),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i % 3}" for i in range(9)]
+    assert label.call_count == 3
+    costs = [
+        annotation.cost
+        for annotation in dataset.df[dataset.generate_label_name("annotation")]
+    ]
+    assert sum(costs) == 1.5
+
+
+def test_time_budget_stops_dispatching_and_resume_labels_the_rest(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(6)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    echo = _label_with_echo(state)
+
+    async def hang_on_third_row(prompts, output_schema=None, use_cache=True):
+        if _example_in(prompts[0]) == "example 2":
+            await asyncio.sleep(60)
+        return await echo(prompts, output_schema)
+
+    label = mocker.patch.object(agent.llm, "label", side_effect=hang_on_third_row)
+    dataset = _dataset(config, 6)
+
+    labeled = agent.run(
+        dataset, options=RunOptions(checkpoint_dir=str(tmp_path), time_budget=0.5),
+    )
+
+    labels = labeled.df[labeled.generate_label_name("label", "label")].tolist()
+    assert labels[:2] == ["example 0", "example 1"]
+    assert labels[2:] == [agent.task.NULL_LABEL_TOKEN] * 4
+    errors = labeled.df[labeled.generate_label_name("error")].tolist()
+    assert all(
+        ErrorType.DEADLINE_EXCEEDED_ERROR.value in str(error) for error in errors[2:]
+    )
+    assert label.call_count == 3
+
+    label.reset_mock()
+    mocker.patch.object(agent.llm, "label", side_effect=echo)
+    resumed = agent.run(dataset, options=RunOptions(checkpoint_dir=str(tmp_path)))
+
+    labels = resumed.df[resumed.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(6)]
+
+
+def test_row_timeout_labels_slow_rows_with_deadline_error(mocker):
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(4)
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    echo = _label_with_echo(state)
+
+    async def hang_on_second_row(prompts, output_schema=None, use_cache=True):
+        if _example_in(prompts[0]) == "example 1":
+            await asyncio.sleep(60)
+        return await echo(prompts, output_schema)
+
+    mocker.patch.object(agent.llm, "label", side_effect=hang_on_second_row)
+
+    dataset = agent.run(
+        _dataset(config, 4), options=RunOptions(max_concurrency=2, row_timeout=0.2),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [
+        "example 0",
+        agent.task.NULL_LABEL_TOKEN,
+        "example 2",
+        "example 3",
+    ]
+
+
+def test_scheduled_run_sends_longest_prompts_first(mocker):
+    config = _zero_shot_config()
+    examples = [f"example {'x' * n}" for n in [3, 50, 1, 20]]
+    config.config["prompt"]["attributes"][0]["options"] = examples
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    label = mocker.patch.object(
+        agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+    df = pd.DataFrame({"example": examples})
+
+    dataset = agent.run(
+        AutolabelDataset(df, config), options=RunOptions(schedule="longest_first"),
+    )
+
+    sent = [_example_in(call.args[0][0]) for call in label.call_args_list]
+    assert sent == [examples[1], examples[3], examples[0], examples[2]]
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == examples
+
+
+def test_self_consistency_stops_sampling_at_unbeatable_majority(mocker):
+    config = _zero_shot_config()
+    config.config["model"]["self_consistency_samples"] = 5
+    config.config["prompt"]["attributes"][0]["options"] = ["example 0", "other"]
+    agent = _agent(mocker, config)
+    delays = iter([0.01, 0.02, 0.03, 5, 5])
+    state = {"cancelled": 0}
+
+    async def sample(prompts, output_schema=None, use_cache=True):
+        assert not use_cache
+        try:
+            await asyncio.sleep(next(delays))
+        except asyncio.CancelledError:
+            state["cancelled"] += 1
+            raise
+        return RefuelLLMResult(
+            generations=[[Generation(text=json.dumps({"label": "example 0"}))]],
+            errors=[None],
+            costs=[0.5],
+            latencies=[0.01],
+        )
+
+    label = mocker.patch.object(agent.llm, "label", side_effect=sample)
+
+    dataset = agent.run(_dataset(config, 1))
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == ["example 0"]
+    assert label.call_count == 5
+    assert state["cancelled"] == 2
+    annotation = dataset.df[dataset.generate_label_name("annotation")][0]
+    assert annotation.cost == 1.5
+
+
+def test_self_consistency_without_generations_labels_row_as_failed(mocker, caplog):
+    config = _zero_shot_config()
+    config.config["model"]["self_consistency_samples"] = 3
+    agent = _agent(mocker, config)
+    # The default temperature of 0 makes every sample the same
+    assert "temperature 0" in caplog.text
+
+    async def sample(prompts, output_schema=None, use_cache=True):
+        return RefuelLLMResult(
+            generations=[[]], errors=[None], costs=[0.1], latencies=[0.01],
+        )
+
+    mocker.patch.object(agent.llm, "label", side_effect=sample)
+
+    dataset = agent.run(_dataset(config, 1))
+
+    annotation = dataset.df[dataset.generate_label_name("annotation")][0]
+    assert not annotation.successfully_labeled
+    assert annotation.error.error_type == ErrorType.INVALID_LLM_RESPONSE_ERROR
+
+
+def test_self_consistency_samples_are_batched(mocker):
+    config = _zero_shot_config()
+    config.config["model"]["self_consistency_samples"] = 3
+    config.config["prompt"]["attributes"][0]["options"] = ["example 0", "example 1"]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    echo = _label_with_echo(state)
+
+    async def sample(prompts, output_schema=None, use_cache=True):
+        assert not use_cache
+        return await echo(prompts, output_schema)
+
+    label = mocker.patch.object(agent.llm, "label", side_effect=sample)
+
+    dataset = agent.run(_dataset(config, 2), options=RunOptions(batch_size=3))
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == ["example 0", "example 1"]
+    assert [len(call.args[0]) for call in label.call_args_list] == [3, 3]
+
+
+def test_self_consistency_samples_stop_at_row_timeout(mocker):
+    config = _zero_shot_config()
+    config.config["model"]["self_consistency_samples"] = 3
+    config.config["prompt"]["attributes"][0]["options"] = ["example 0"]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    echo = _label_with_echo(state)
+    delays = iter([0, 60, 60])
+
+    async def sample(prompts, output_schema=None, use_cache=True):
+        await asyncio.sleep(next(delays))
+        return await echo(prompts, output_schema)
+
+    mocker.patch.object(agent.llm, "label", side_effect=sample)
+
+    dataset = asyncio.run(
+        asyncio.wait_for(
+            agent.arun(_dataset(config, 1), options=RunOptions(row_timeout=0.2)), 10,
+        ),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == ["example 0"]
+
+
+def test_cascade_escalates_low_confidence_rows(mocker):
+    options = [f"example {i}" for i in range(6)]
+    config = _zero_shot_config()
+    config.config["prompt"]["attributes"][0]["options"] = options
+    config.config["model"]["compute_confidence"] = True
+    config.config["model"]["cascade"] = [
+        {"provider": "openai", "name": "gpt-4o", "escalate_below": 0.5},
+    ]
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    echo = _label_with_echo(state)
+
+    async def label_odd_rows_wrong(prompts, output_schema=None, use_cache=True):
+        result = await echo(prompts, output_schema)
+        if int(_example_in(prompts[0]).split()[-1]) % 2:
+            result.generations = [
+                [Generation(text=json.dumps({"label": "example 0"}))],
+            ]
+        return result
+
+    async def confident_if_correct(model_generation, keys=None, **kwargs):
+        example = pickle.loads(model_generation.curr_sample)["example"]
+        model_generation.confidence_score = {
+            "label": 0.9 if model_generation.label["label"] == example else 0.2,
+        }
+        return model_generation.confidence_score
+
+    mocker.patch(
+        "autolabel.labeler.ConfidenceCalculator.calculate",
+        side_effect=confident_if_correct,
+    )
+    mocker.patch.object(agent.llm, "label", side_effect=label_odd_rows_wrong)
+    strong_config = _zero_shot_config()
+    strong_config.config["prompt"]["attributes"][0]["options"] = options
+    strong_config.config["model"]["compute_confidence"] = True
+    strong_agent = _agent(mocker, strong_config)
+    strong_label = mocker.patch.object(
+        strong_agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+    mocker.patch.object(agent, "_cascade_agent", return_value=strong_agent)
+
+    dataset = agent.run(_dataset(config, 6))
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == options
+    escalated = [
+        _example_in(call.args[0][0]) for call in strong_label.call_args_list
+    ]
+    assert sorted(escalated) == ["example 1", "example 3", "example 5"]
+    costs = [a.cost for a in dataset.df[dataset.generate_label_name("annotation")]]
+    assert costs == [0.5, 1.0, 0.5, 1.0, 0.5, 1.0]
+
+
+def test_cascade_requires_confidence():
+    config = _zero_shot_config()
+    config.config["model"]["cascade"] = [
+        {"provider": "openai", "name": "gpt-4o", "escalate_below": 0.5},
+    ]
+    with pytest.raises(ValueError):
+        LabelingAgent(
+            config=config,
+            generation_cache=None,
+            transform_cache=None,
+            confidence_cache=None,
+        )
+
+
+def test_plan_streams_file_and_reports_interval(mocker, tmp_path):
+    path = tmp_path / "input.csv"
+    pd.DataFrame(
+        {"example": [f"example {'x' * (i % 300)}" for i in range(3000)]},
+    ).to_csv(path, index=False)
+    agent = _agent(mocker)
+    mocker.patch.object(
+        agent.llm,
+        "get_num_tokens_batch",
+        side_effect=lambda prompts: [len(prompt) for prompt in prompts],
+    )
+    mocker.patch.object(
+        agent.llm, "get_cost", side_effect=lambda prompt, label: len(prompt) * 1e-6,
+    )
+    construct_prompt = mocker.spy(agent.task, "construct_prompt")
+
+    plan = agent.plan(str(path), max_concurrency=4)
+
+    assert plan.num_rows == 3000
+    assert construct_prompt.call_count == plan.num_sampled_rows < 3000
+    assert plan.cost_lower_bound <= plan.total_cost <= plan.cost_upper_bound
+    assert plan.limited_by == "concurrency"
+    assert "example" in plan.example_prompt
+
+
+def test_explanations_are_generated_concurrently_for_missing_rows(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["dataset"]["explanation_column"] = "explanation"
+    agent = _agent(mocker, config)
+    state = {"in_flight": 0, "max_in_flight": 0}
+    label = mocker.patch.object(
+        agent.llm, "label", side_effect=_label_with_echo(state),
+    )
+    mocker.patch.object(
+        agent.task,
+        "get_explanation_prompt",
+        side_effect=lambda example, include_label=True: f"Input: {example['example']}",
+    )
+    seed_file = tmp_path / "seed.csv"
+    pd.DataFrame(
+        {
+            "example": [f"example {i}" for i in range(8)],
+            "explanation": ["kept", None, "kept", None, None, None, None, None],
+        },
+    ).to_csv(seed_file, index=False)
+
+    agent.generate_explanations(str(seed_file), max_concurrency=4)
+
+    assert label.call_count == 6
+    assert state["max_in_flight"] > 1
+    explanations = pd.read_csv(seed_file)["explanation"].tolist()
+    assert explanations[0] == "kept" and explanations[2] == "kept"
+    assert explanations[1] == json.dumps({"label": "example 1"})
+    assert all(isinstance(e, str) and e for e in explanations)
+
+
+def test_synthetic_dataset_is_generated_in_pages_per_label(mocker, tmp_path):
+    config = _zero_shot_config()
+    config.config["dataset"]["label_column"] = "label"
+    config.config["prompt"]["labels"] = ["a", "b", "c"]
+    config.config["dataset_generation"] = {"num_rows": 70}
+    agent = _agent(mocker, config)
+    mocker.patch.object(
+        agent.task,
+        "get_generate_dataset_prompt",
+        side_effect=lambda label, num_rows, guidelines=None: f"{label}|{num_rows}",
+    )
+    requested = []
+
+    async def generate(prompts, output_schema=None, use_cache=True):
+        label, num_rows = prompts[0].split("|")
+        requested.append((label, int(num_rows)))
+        rows = [f"{label} row" for _ in range(min(int(num_rows), 30))]
+        return RefuelLLMResult(
+            generations=[[Generation(text="\n".join(["example"] + rows))]],
+            errors=[None],
+            costs=[0.1],
+            latencies=[0.01],
+        )
+
+    mocker.patch.object(agent.llm, "label", side_effect=generate)
+    output_file = tmp_path / "synthetic.csv"
+
+    dataset = agent.generate_synthetic_dataset(
+        max_concurrency=3, output_name=str(output_file),
+    )
+
+    assert dataset.df["label"].tolist() == ["a"] * 70 + ["b"] * 70 + ["c"] * 70
+    assert sorted(n for label, n in requested if label == "a") == [10, 40, 50]
+    assert len(pd.read_csv(output_file)) == 210
+
+
+class InMemoryGenerationCache(BaseCache):
+
+    """Generation cache that keeps its entries in a dict"""
+
+    def initialize(self):
+        self.entries = {}
+
+    @staticmethod
+    def _key(entry):
+        return entry.model_name, entry.model_params, entry.prompt
+
+    def lookup(self, entry):
+        return self.entries.get(self._key(entry), [])
+
+    def update(self, entry):
+        self.entries[self._key(entry)] = entry.generations
+
+    def clear(self):
+        self.entries = {}
+
+
+def test_synthetic_dataset_pages_are_not_served_from_the_cache(mocker):
+    config = _zero_shot_config()
+    config.config["dataset"]["label_column"] = "label"
+    config.config["prompt"]["labels"] = ["a"]
+    config.config["dataset_generation"] = {"num_rows": 30}
+    agent = LabelingAgent(
+        config=config,
+        console_output=False,
+        generation_cache=InMemoryGenerationCache(),
+        transform_cache=None,
+        confidence_cache=None,
+    )
+    mocker.patch.object(agent.llm, "get_num_tokens", side_effect=len)
+    # Every page of the label gets the same prompt
+    mocker.patch.object(
+        agent.task,
+        "get_generate_dataset_prompt",
+        side_effect=lambda label, num_rows, guidelines=None: f"{label}|{num_rows}",
+    )
+    num_requests = itertools.count()
+
+    async def generate(prompts, output_schema):
+        page = next(num_requests)
+        rows = [f"page {page} row {i}" for i in range(10)]
+        return RefuelLLMResult(
+            generations=[[Generation(text="\n".join(["example"] + rows))]],
+            errors=[None],
+            latencies=[0.01],
+        )
+
+    mocker.patch.object(agent.llm, "_alabel", side_effect=generate)
+
+    dataset = agent.generate_synthetic_dataset(rows_per_request=10)
+
+    examples = dataset.df["example"].tolist()
+    assert len(examples) == 30
+    assert len(set(examples)) == 30
@@ -1,3 +1,4 @@
+import asyncio
 import json
 
 from langchain.schema import Generation, LLMResult
@@ -5,11 +6,13 @@ from openai.types.chat.chat_completion import ChatCompletion, Choice
 from openai.types.chat.chat_completion_message import ChatCompletionMessage
 from pytest import approx
 
+from autolabel.concurrency import Deadline, HedgingPolicy, deadline_scope
 from autolabel.configs import AutolabelConfig
 from autolabel.models.anthropic import AnthropicLLM
 from autolabel.models.azure_openai import AzureOpenAILLM
 from autolabel.models.openai import OpenAILLM
 from autolabel.models.openai_vision import OpenAIVisionLLM
+from autolabel.schema import ErrorType, RefuelLLMResult
 
 
 ################### ANTHROPIC TESTS #######################
@@ -204,3 +207,92 @@ def test_azure_openai_initialization():
         config=AutolabelConfig(config="tests/assets/banking/config_banking_azureopenai.json"),
     )
     assert model.model_name == "gpt-4o-mini"
+
+
+def test_concurrent_identical_prompts_share_one_call(mocker):
+    model = AnthropicLLM(
+        config=AutolabelConfig(
+            config="tests/assets/banking/config_banking_anthropic.json",
+        ),
+    )
+    calls = []
+
+    async def alabel(prompts, output_schema):
+        calls.append(list(prompts))
+        await asyncio.sleep(0.01)
+        return RefuelLLMResult(
+            generations=[[Generation(text=prompt.upper())] for prompt in prompts],
+            errors=[None for _ in prompts],
+            latencies=[0.01 for _ in prompts],
+        )
+
+    mocker.patch.object(model, "_alabel", side_effect=alabel)
+
+    async def run():
+        return await asyncio.gather(
+            model.label(["a", "b"], None),
+            model.label(["a"], None),
+            model.label(["b", "b"], None),
+        )
+
+    results = asyncio.run(run())
+
+    assert calls == [["a", "b"]]
+    assert [[g[0].text for g in r.generations] for r in results] == [
+        ["A", "B"],
+        ["A"],
+        ["B", "B"],
+    ]
+    assert results[1].costs == [0.0]
+    assert model._in_flight == {}
+
+
+def test_label_returns_deadline_error_when_deadline_expires(mocker):
+    model = AnthropicLLM(
+        config=AutolabelConfig(
+            config="tests/assets/banking/config_banking_anthropic.json",
+        ),
+    )
+
+    async def alabel(prompts, output_schema):
+        await asyncio.sleep(10)
+
+    mocker.patch.object(model, "_alabel", side_effect=alabel)
+
+    async def run():
+        with deadline_scope(Deadline.after(0.05)):
+            return await model.label(["a"], None)
+
+    result = asyncio.run(run())
+
+    assert result.errors[0].error_type == ErrorType.DEADLINE_EXCEEDED_ERROR
+    assert model._in_flight == {}
+
+
+def test_hedged_request_is_charged(mocker):
+    model = AnthropicLLM(
+        config=AutolabelConfig(
+            config="tests/assets/banking/config_banking_anthropic.json",
+        ),
+    )
+    model.hedging_policy = HedgingPolicy(
+        percentile=0.5, max_hedge_fraction=1.0, min_samples=1,
+    )
+    model.hedging_policy.record([0.01])
+    delays = iter([1.0, 0.0])
+
+    async def alabel(prompts, output_schema):
+        await asyncio.sleep(next(delays))
+        return RefuelLLMResult(
+            generations=[[Generation(text="A")] for _ in prompts],
+            errors=[None for _ in prompts],
+            latencies=[0.01 for _ in prompts],
+        )
+
+    mocker.patch.object(model, "_alabel", side_effect=alabel)
+    mocker.patch.object(model, "get_cost", return_value=1.0)
+
+    result = asyncio.run(model.label(["a"], None))
+
+    assert model.hedging_policy.num_hedged == 1
+    assert result.costs == [2.0]
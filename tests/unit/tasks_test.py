@@ -1,12 +1,15 @@
 import copy
 import json
 
+import json5
 from langchain.schema import Generation
 
 from autolabel.configs import AutolabelConfig
 from autolabel.tasks import (
     AttributeExtractionTask,
 )
+from autolabel.tasks.prompt_plan import PromptPlan
+from autolabel.tasks.trimming import trim_to_token_budget
 
 BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
 
@@ -70,6 +73,132 @@ def test_classification_no_label_column_in_input():
         assert example["label"] in prompt
 
 
+def test_prompt_plan_renders_static_sections_once():
+    plan = PromptPlan(
+        "{task_guidelines}\n\n{output_guidelines}\n{{literal}}\n{current_example}",
+        {"task_guidelines": "Label {this}", "output_guidelines": "As json"},
+    )
+
+    assert plan.row_sections == ["current_example"]
+    assert plan.static_prefix == "Label {this}\n\nAs json\n{literal}\n"
+    assert (
+        plan.render(current_example="Example: x", seed_examples="unused")
+        == "Label {this}\n\nAs json\n{literal}\nExample: x"
+    )
+
+
+def test_construct_prompt_reuses_prompt_plan(mocker):
+    task = AttributeExtractionTask(config=AutolabelConfig(BANKING_CONFIG))
+    construct_attribute_json = mocker.spy(task, "_construct_attribute_json")
+    examples = [{"example": "Here is a seed example", "label": "label1"}]
+
+    prompts = [
+        task.construct_prompt({"example": f"Example {i}"}, copy.deepcopy(examples))
+        for i in range(3)
+    ]
+    # Building the prompt the way every row did without the plan gives the same prompt
+    prompt, schema = task.construct_prompt(
+        {"example": "Example 0"},
+        copy.deepcopy(examples),
+        output_guidelines_override=task.output_guidelines,
+    )
+
+    assert prompts[0] == (prompt, schema)
+    assert all(s is prompts[0][1] for _, s in prompts)
+    assert construct_attribute_json.call_count == 2
+
+    prompt, _ = task.construct_prompt(
+        {"example": "Example 0"},
+        copy.deepcopy(examples),
+        selected_labels_map={"label": ["label1", "label2"]},
+    )
+    assert "Options:\\nlabel1,label2" in prompt
+    assert construct_attribute_json.call_count == 3
+
+
+def _count_words(text):
+    return len(text.split())
+
+
+def _word_offsets(text):
+    return [
+        i
+        for i, c in enumerate(text)
+        if not c.isspace() and (i == 0 or text[i - 1].isspace())
+    ]
+
+
+def test_trim_cuts_sections_exactly_at_the_budget():
+    template = "{task_guidelines}\n{seed_examples}\nExample: {current_example}"
+    sections = {
+        "task_guidelines": "label the text",
+        "seed_examples": " ".join(f"seed{i}" for i in range(50)),
+        "current_example": " ".join(f"word{i}" for i in range(100)),
+    }
+    tokenized = []
+
+    def get_num_tokens(text):
+        tokenized.append(text)
+        return _count_words(text)
+
+    prompt = trim_to_token_budget(
+        template, sections, 120, get_num_tokens, get_token_offsets=_word_offsets,
+    )
+
+    # The end of the seed examples is trimmed first, the current example is kept
+    assert _count_words(prompt) == 120
+    assert "seed15" in prompt and "seed16" not in prompt
+    assert prompt.endswith("word99")
+    # The prompt before and after trimming, the seed examples only by their offsets
+    assert len(tokenized) == 2
+
+    prompt = trim_to_token_budget(template, sections, 200, get_num_tokens)
+    assert prompt == template.format(**sections)
+
+
+def test_trim_counts_static_sections_once_per_plan():
+    task = AttributeExtractionTask(config=AutolabelConfig(BANKING_CONFIG))
+    static_sections = task._prompt_plan.static_sections
+    tokenized = []
+
+    def get_num_tokens(text):
+        tokenized.append(text)
+        return _count_words(text)
+
+    def get_token_offsets(text):
+        tokenized.append(text)
+        return _word_offsets(text)
+
+    for i in range(3):
+        prompt, _ = task.construct_prompt(
+            {"example": f"Example {i} " + "word " * 50},
+            [],
+            max_input_tokens=40,
+            get_num_tokens=get_num_tokens,
+            get_token_offsets=get_token_offsets,
+        )
+        assert _count_words(prompt) <= 40
+    # The guidelines were trimmed for every row but only tokenized for the first
+    for text in static_sections.values():
+        assert tokenized.count(text) == 1
+
+
+def test_trim_without_offsets_still_fits():
+    template = "{task_guidelines}\n\n{output_guidelines}\n\n{current_example}"
+    sections = {
+        "task_guidelines": "label the text",
+        "output_guidelines": "answer in json",
+        "current_example": " ".join("w" * (i % 7 + 1) for i in range(1000)),
+    }
+
+    prompt = trim_to_token_budget(template, sections, 300, _count_words)
+
+    # The cut is estimated from the characters per token, so it can fall a few tokens short
+    assert 290 <= _count_words(prompt) <= 300
+    # The guidelines are trimmed before the current example
+    assert prompt.startswith("\n\n\n\nw ww www")
+
+
 def test_classification_parse_llm_response():
     new_config = copy.deepcopy(BANKING_CONFIG)
     new_config["prompt"]["attributes"][0]["options"].append("label-true")
@@ -91,3 +220,63 @@ def test_classification_parse_llm_response():
     parsed = task.parse_llm_response(response, input, prompt)
     assert parsed.label == {}
     assert parsed.successfully_labeled == False
+
+
+def test_parse_llm_response_tiers(mocker):
+    task = AttributeExtractionTask(config=AutolabelConfig(BANKING_CONFIG))
+    json5_loads = mocker.spy(json5, "loads")
+
+    # Strict json does not need json5
+    parsed = task.parse_llm_response(
+        Generation(text='```json\n{"label": "card_arrival"}\n```'), {}, "prompt",
+    )
+    assert parsed.label == {"label": "card_arrival"}
+    assert json5_loads.call_count == 0
+
+    # Newlines inside strings of an object embedded in text
+    parsed = task.parse_llm_response(
+        Generation(text='Answer: {"label": "card_arrival", "note": "a\nb"} done'),
+        {},
+        "prompt",
+    )
+    assert parsed.label == {"label": "card_arrival", "note": "a\nb"}
+
+    # json5 is the fallback for responses that are not strict json
+    parsed = task.parse_llm_response(
+        Generation(text="{'label': 'card_arrival', 'score': 1,}"), {}, "prompt",
+    )
+    assert parsed.label == {"label": "card_arrival", "score": "1"}
+    assert parsed.successfully_labeled
+
+    parsed = task.parse_llm_response(Generation(text="[1, 2]"), {}, "prompt")
+    assert not parsed.successfully_labeled
+
+
+def test_parse_llm_response_filters_options():
+    config = copy.deepcopy(BANKING_CONFIG)
+    config["prompt"]["attributes"][0]["task_type"] = "classification"
+    config["prompt"]["attributes"].append(
+        {
+            "name": "topics",
+            "description": "Topics of the query",
+            "options": ["cards", "transfers", "fees"],
+            "task_type": "multilabel_classification",
+        },
+    )
+    task = AttributeExtractionTask(config=AutolabelConfig(config))
+
+    parsed = task.parse_llm_response(
+        Generation(text='{"label": "not_an_option", "topics": "cards; pets;fees"}'),
+        {},
+        "prompt",
+    )
+    assert parsed.label == {"topics": "cards;fees"}
+
+    # Labels selected for the row replace the options of the attribute
+    parsed = task.parse_llm_response(
+        Generation(text='{"label": "card_arrival", "topics": "cards"}'),
+        {},
+        "prompt",
+        selected_labels_map={"label": ["card_arrival"], "topics": ["fees"]},
+    )
+    assert parsed.label == {"label": "card_arrival"}
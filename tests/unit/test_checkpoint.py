@@ -0,0 +1,64 @@
+import os
+import pickle
+
+import pytest
+
+from autolabel.checkpoint import CheckpointJournal
+from autolabel.schema import LLMAnnotation
+
+
+def _annotation(label):
+    return LLMAnnotation(successfully_labeled=True, label=label, curr_sample=b"row")
+
+
+def test_journal_round_trip(tmp_path):
+    with CheckpointJournal(str(tmp_path), "run") as journal:
+        journal.record(3, _annotation("a"), 0.5)
+        journal.record(1, _annotation("b"), 0.25)
+
+    completed = CheckpointJournal(str(tmp_path), "run").load()
+
+    assert sorted(completed) == [1, 3]
+    assert completed[3][0].label == "a"
+    assert completed[1][1] == 0.25
+    assert CheckpointJournal(str(tmp_path), "other_run").load() == {}
+
+
+def test_journal_drops_partially_written_record(tmp_path):
+    journal = CheckpointJournal(str(tmp_path), "run")
+    journal.record(0, _annotation("a"), 0.5)
+    journal.close()
+    with open(journal.path, "ab") as f:
+        f.write(b"\x80\x04\x95partial")
+
+    journal = CheckpointJournal(str(tmp_path), "run")
+    assert list(journal.load()) == [0]
+    journal.record(1, _annotation("b"), 0.5)
+    journal.close()
+
+    assert sorted(CheckpointJournal(str(tmp_path), "run").load()) == [0, 1]
+
+
+@pytest.mark.parametrize(
+    "record, error",
+    [
+        # Refers to a class that does not exist
+        (b"cautolabel.schema\nMissing\n.", AttributeError),
+        # Invalid opcode
+        (b"\xffgarbage", pickle.UnpicklingError),
+    ],
+)
+def test_journal_keeps_records_after_one_that_fails_to_load(tmp_path, record, error):
+    journal = CheckpointJournal(str(tmp_path), "run")
+    journal.record(0, _annotation("a"), 0.5)
+    journal.close()
+    with open(journal.path, "ab") as f:
+        f.write(record)
+    journal.record(1, _annotation("b"), 0.5)
+    journal.close()
+    size = os.path.getsize(journal.path)
+
+    with pytest.raises(error):
+        CheckpointJournal(str(tmp_path), "run").load()
+
+    assert os.path.getsize(journal.path) == size
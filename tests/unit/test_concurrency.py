@@ -0,0 +1,477 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from tenacity import retry, stop_after_attempt, wait_fixed
+from langchain.schema import Generation
+
+from autolabel.concurrency import (
+    AIMDConcurrencyController,
+    BoundedDispatcher,
+    Deadline,
+    DeadlineExceeded,
+    HedgingPolicy,
+    MicroBatcher,
+    PromptDeduplicator,
+    RateLimiter,
+    RequeueItem,
+    SizeAwareScheduler,
+    StagedPipeline,
+    TokenBucket,
+    deadline_scope,
+    get_deadline,
+    get_rate_limiter,
+    stop_at_deadline,
+)
+from autolabel.schema import ErrorType, LabelingError, RefuelLLMResult
+
+
+async def _collect(async_iterator):
+    return [item async for item in async_iterator]
+
+
+def test_dispatcher_bounds_in_flight_calls():
+    state = {"in_flight": 0, "max_in_flight": 0}
+
+    async def work(item):
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.001 * (item % 3))
+        state["in_flight"] -= 1
+        return item * 2
+
+    dispatcher = BoundedDispatcher(max_concurrency=3)
+    results = asyncio.run(_collect(dispatcher.map(work, range(10))))
+
+    assert sorted(results) == [(i, i * 2) for i in range(10)]
+    assert state["max_in_flight"] == 3
+
+
+def test_dispatcher_propagates_errors():
+    async def work(item):
+        if item == 2:
+            raise RuntimeError("boom")
+        return item
+
+    dispatcher = BoundedDispatcher(max_concurrency=2)
+    with pytest.raises(RuntimeError):
+        asyncio.run(_collect(dispatcher.map(work, range(5))))
+
+
+def test_dispatcher_bounds_results_ahead_of_a_slow_item():
+    async def work(item):
+        await asyncio.sleep(0.05 if item == 0 else 0.001)
+        return item
+
+    dispatcher = BoundedDispatcher(max_concurrency=3, max_reorder=4)
+    results = asyncio.run(_collect(dispatcher.map(work, range(20))))
+
+    # Only the items within max_reorder of the slow first item finish before it
+    indices = [index for index, _ in results]
+    assert sorted(indices[: indices.index(0)]) == [1, 2, 3]
+    assert sorted(indices) == list(range(20))
+
+
+def test_dispatcher_rejects_invalid_concurrency():
+    with pytest.raises(ValueError):
+        BoundedDispatcher(max_concurrency=0)
+
+
+class _FakeLLM:
+    def __init__(self):
+        self.calls = []
+
+    def get_num_tokens(self, prompt):
+        return len(prompt)
+
+    async def label(self, prompts, output_schema, use_cache=True):
+        self.calls.append((list(prompts), output_schema))
+        await asyncio.sleep(0)
+        return RefuelLLMResult(
+            generations=[[Generation(text=prompt.upper())] for prompt in prompts],
+            errors=[None for _ in prompts],
+            costs=[float(len(prompt)) for prompt in prompts],
+            latencies=[0.1 for _ in prompts],
+        )
+
+
+def test_micro_batcher_groups_prompts_by_schema():
+    llm = _FakeLLM()
+    batcher = MicroBatcher(llm, batch_size=2)
+    schema_a, schema_b = {"type": "a"}, {"type": "b"}
+
+    async def run():
+        return await asyncio.gather(
+            batcher.label("p1", schema_a),
+            batcher.label("p2", schema_b),
+            batcher.label("p3", schema_a),
+            batcher.label("p4", schema_b),
+            batcher.label("p5", schema_a),
+        )
+
+    results = asyncio.run(run())
+
+    assert [r.generations[0][0].text for r in results] == ["P1", "P2", "P3", "P4", "P5"]
+    assert [r.costs for r in results] == [[2.0]] * 5
+    assert (["p1", "p3"], schema_a) in llm.calls
+    assert (["p2", "p4"], schema_b) in llm.calls
+    assert (["p5"], schema_a) in llm.calls
+
+
+def test_micro_batcher_labels_batch_under_earliest_deadline():
+    llm = _FakeLLM()
+    deadlines = []
+    label = llm.label
+
+    async def label_with_deadline(prompts, output_schema, use_cache=True):
+        deadlines.append(get_deadline())
+        return await label(prompts, output_schema, use_cache)
+
+    llm.label = label_with_deadline
+    batcher = MicroBatcher(llm, batch_size=10)
+    loose, tight = Deadline.after(60), Deadline.after(30)
+
+    async def label_row(prompt, deadline):
+        with deadline_scope(deadline):
+            return await batcher.label(prompt, None)
+
+    async def run():
+        # The batch is flushed by the timer started by the first row
+        return await asyncio.gather(label_row("p1", loose), label_row("p2", tight))
+
+    asyncio.run(run())
+
+    assert llm.calls == [(["p1", "p2"], None)]
+    assert deadlines == [tight]
+
+
+def test_micro_batcher_respects_token_budget():
+    llm = _FakeLLM()
+    batcher = MicroBatcher(llm, batch_size=10, max_batch_tokens=5)
+
+    async def run():
+        return await asyncio.gather(
+            *[batcher.label(p, None) for p in ["aa", "bb", "cc"]]
+        )
+
+    asyncio.run(run())
+
+    assert [prompts for prompts, _ in llm.calls] == [["aa", "bb"], ["cc"]]
+
+
+def test_aimd_controller_increases_and_backs_off():
+    controller = AIMDConcurrencyController(
+        max_concurrency=8,
+        initial_concurrency=2,
+        cooldown_seconds=60,
+    )
+    for _ in range(11):
+        controller.on_success()
+    assert controller.limit == 5
+
+    controller.on_backoff()
+    assert controller.limit == 2
+    # Backoffs within the cooldown period are ignored
+    controller.on_backoff()
+    assert controller.limit == 2
+
+    for _ in range(1000):
+        controller.on_success()
+    assert controller.limit == 8
+
+
+def test_dispatcher_requeues_items():
+    attempts = {}
+
+    async def flaky(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 1 and attempts[item] < 3:
+            raise RequeueItem(result="failed")
+        return item
+
+    async def run():
+        dispatcher = BoundedDispatcher(
+            max_concurrency=2,
+            controller=AIMDConcurrencyController(max_concurrency=2),
+            requeue_delay_seconds=0,
+        )
+        return await _collect(dispatcher.map(flaky, range(4)))
+
+    results = asyncio.run(run())
+
+    assert sorted(results) == [(0, 0), (1, 1), (2, 2), (3, 3)]
+    assert attempts[1] == 3
+
+
+def test_dispatcher_gives_up_after_max_requeues():
+    async def always_rate_limited(item):
+        raise RequeueItem(result="failed")
+
+    async def run():
+        dispatcher = BoundedDispatcher(max_requeues=2, requeue_delay_seconds=0)
+        return await _collect(dispatcher.map(always_rate_limited, [0]))
+
+    assert asyncio.run(run()) == [(0, "failed")]
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(capacity=10, refill_rate=100)
+    assert bucket.try_acquire(8) == 0
+    wait = bucket.try_acquire(8)
+    assert 0 < wait <= 0.06
+    # Requests larger than the capacity are clamped so they never block forever
+    time.sleep(0.1)
+    assert bucket.try_acquire(50) == 0
+
+
+def test_rate_limiter_throttles_to_requests_per_minute():
+    limiter = RateLimiter(requests_per_minute=600)
+    # The bucket starts full, so the first 600 requests go through immediately
+    limiter.request_bucket._available = 1
+
+    async def run():
+        start = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    # 600 RPM refills one request every 0.1 seconds
+    assert asyncio.run(run()) >= 0.19
+
+
+def test_rate_limiter_only_takes_when_both_budgets_allow():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=60)
+    limiter.token_bucket._available = 0
+
+    async def run():
+        await asyncio.wait_for(limiter.acquire(num_tokens=1), timeout=0.01)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
+    assert limiter.request_bucket._available == pytest.approx(60, abs=0.1)
+
+
+def test_rate_limiters_are_shared_per_model():
+    limiter = get_rate_limiter("openai", "gpt-4o", requests_per_minute=100)
+    assert get_rate_limiter("openai", "gpt-4o", requests_per_minute=100) is limiter
+    other_limiter = get_rate_limiter("openai", "gpt-4o-mini", requests_per_minute=100)
+    assert other_limiter is not limiter
+    assert get_rate_limiter("openai", "gpt-4o") is None
+
+
+def test_staged_pipeline_runs_blocking_stages_in_workers():
+    pipeline = StagedPipeline(num_workers=2)
+    release = threading.Event()
+
+    def blocking(item):
+        release.wait(timeout=5)
+        return item, threading.current_thread().name
+
+    async def run():
+        tasks = [
+            asyncio.ensure_future(pipeline.run_blocking("prompt", blocking, i))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0.05)
+        # The event loop is not blocked while the workers are busy
+        depths = pipeline.queue_depths()
+        release.set()
+        return depths, await asyncio.gather(*tasks)
+
+    depths, results = asyncio.run(run())
+    pipeline.close()
+
+    assert depths == {"prompt queue": 5}
+    assert [item for item, _ in results] == list(range(5))
+    assert all(name.startswith("autolabel-worker") for _, name in results)
+    assert pipeline.stats["prompt"].completed == 5
+
+
+def test_staged_pipeline_without_workers_runs_inline():
+    pipeline = StagedPipeline()
+
+    async def run():
+        async with pipeline.track("llm"):
+            depths = pipeline.queue_depths()
+        thread = await pipeline.run_blocking(
+            "parse",
+            lambda: threading.current_thread().name,
+        )
+        return depths, thread
+
+    depths, thread = asyncio.run(run())
+
+    assert depths == {"llm queue": 1}
+    assert thread == threading.current_thread().name
+
+
+def test_prompt_deduplicator_sends_each_prompt_once():
+    llm = _FakeLLM()
+    deduplicator = PromptDeduplicator()
+
+    async def run():
+        return await asyncio.gather(
+            *[
+                deduplicator.label(prompt, schema, llm.label)
+                for prompt, schema in [
+                    ("a", None),
+                    ("a", None),
+                    ("b", None),
+                    ("a", {"type": "object"}),
+                    ("a", None),
+                ]
+            ],
+        )
+
+    results = asyncio.run(run())
+
+    assert len(llm.calls) == 3
+    assert [r.generations[0][0].text for r in results] == ["A", "A", "B", "A", "A"]
+    assert [r.costs[0] for r in results] == [1.0, 0.0, 1.0, 1.0, 0.0]
+    assert deduplicator.num_deduplicated == 2
+    assert deduplicator.dedup_ratio == pytest.approx(0.4)
+
+
+def test_prompt_deduplicator_resends_failed_prompts():
+    deduplicator = PromptDeduplicator()
+    calls = []
+
+    async def label(prompt, output_schema):
+        calls.append(prompt)
+        return RefuelLLMResult(
+            generations=[[]],
+            errors=[
+                LabelingError(error_type=ErrorType.LLM_PROVIDER_ERROR, error_message="")
+            ],
+            costs=[0.0],
+            latencies=[0.0],
+        )
+
+    async def run():
+        await deduplicator.label("a", None, label)
+        await deduplicator.label("a", None, label)
+
+    asyncio.run(run())
+
+    assert calls == ["a", "a"]
+
+
+def _result_after(delay):
+    async def request():
+        await asyncio.sleep(delay)
+        return RefuelLLMResult(
+            generations=[[Generation(text="done")]],
+            errors=[None],
+            costs=[0.0],
+            latencies=[delay],
+        )
+
+    return request
+
+
+def test_hedging_policy_keeps_the_faster_request():
+    policy = HedgingPolicy(percentile=0.5, max_hedge_fraction=1.0, min_samples=5)
+    policy.record([0.01] * 5)
+    delays = iter([1.0, 0.01])
+
+    async def request():
+        return await _result_after(next(delays))()
+
+    start = time.monotonic()
+    result, hedged = asyncio.run(policy.run(request))
+
+    assert result.latencies == [0.01]
+    assert hedged
+    assert time.monotonic() - start < 0.5
+    assert policy.num_hedged == 1
+    assert policy.num_hedges_won == 1
+
+
+def test_hedging_policy_caps_extra_requests():
+    policy = HedgingPolicy(percentile=0.5, max_hedge_fraction=0.25, min_samples=1)
+    policy.record([0.001])
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        # Report a latency well below the hedge delay so every request is slow
+        return RefuelLLMResult(
+            generations=[[Generation(text="done")]],
+            errors=[None],
+            costs=[0.0],
+            latencies=[0.001],
+        )
+
+    async def run():
+        return [(await policy.run(request))[1] for _ in range(8)]
+
+    hedged = asyncio.run(run())
+
+    assert sum(hedged) == 2
+    assert policy.num_requests == 8
+    assert policy.num_hedged == 2
+    assert len(calls) == 10
+
+
+def test_hedging_policy_waits_for_latencies_before_hedging():
+    policy = HedgingPolicy(min_samples=3)
+    policy.record([0.1, 0.2])
+    assert policy.hedge_delay() is None
+    policy.record([0.3])
+    assert policy.hedge_delay() == 0.3
+
+
+def test_deadline_cuts_off_slow_work():
+    async def run():
+        with pytest.raises(DeadlineExceeded):
+            await Deadline.after(0.05).wait_for(asyncio.sleep(10))
+        return await Deadline.after(1).wait_for(asyncio.sleep(0, result="done"))
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_deadline_scopes_only_tighten():
+    outer = Deadline.after(1)
+    with deadline_scope(outer):
+        with deadline_scope(Deadline.after(10)):
+            assert get_deadline() is outer
+        with deadline_scope(Deadline.after(0.5)) as inner:
+            assert get_deadline() is inner
+        assert get_deadline() is outer
+    assert get_deadline() is None
+
+
+def test_retries_stop_at_deadline():
+    attempts = []
+
+    @retry(
+        reraise=True,
+        stop=stop_after_attempt(10) | stop_at_deadline(),
+        wait=wait_fixed(0.05),
+    )
+    def fail():
+        attempts.append(1)
+        raise ValueError()
+
+    with deadline_scope(Deadline.after(0.12)), pytest.raises(ValueError):
+        fail()
+
+    assert 1 < len(attempts) < 10
+
+
+def test_size_aware_scheduler_orders_longest_first():
+    scheduler = SizeAwareScheduler("longest_first")
+    assert scheduler.order([5, 30, 1, 30, 10]) == [1, 3, 4, 0, 2]
+
+
+def test_size_aware_scheduler_interleaves_long_and_short_rows():
+    scheduler = SizeAwareScheduler("interleaved")
+    assert scheduler.order([5, 30, 1, 20, 10]) == [1, 2, 3, 0, 4]
+    assert scheduler.order([]) == []
+
+
+def test_size_aware_scheduler_rejects_unknown_strategy():
+    with pytest.raises(ValueError):
+        SizeAwareScheduler("shortest_first")
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from autolabel.planner import RunPlanner
+
+
+class FakeLLM:
+    COST_PER_TOKEN = 0.001
+
+    def __init__(self, max_output_tokens=10):
+        self._max_output_tokens = max_output_tokens
+        self.num_costed = 0
+
+    def max_output_tokens(self):
+        return self._max_output_tokens
+
+    def get_num_tokens_batch(self, prompts):
+        return [len(prompt) for prompt in prompts]
+
+    def get_cost(self, prompt, label=""):
+        self.num_costed += 1
+        return (len(prompt) + self._max_output_tokens) * self.COST_PER_TOKEN
+
+
+def _chunks(texts, chunk_size):
+    df = pd.DataFrame({"text": texts, "other": ["x" * 1000] * len(texts)})
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size]
+
+
+def test_planner_estimate_matches_exact_cost():
+    rng = np.random.default_rng(1)
+    texts = ["a" * int(n) for n in rng.integers(1, 2000, size=20_000)]
+    llm = FakeLLM()
+    planner = RunPlanner(
+        llm,
+        lambda row: row["text"],
+        input_columns=["text"],
+        samples_per_stratum=50,
+    )
+
+    plan = planner.estimate(_chunks(texts, 3000), max_concurrency=10)
+
+    exact = sum(llm.get_cost(text) for text in texts)
+    assert plan.num_rows == len(texts)
+    assert plan.num_sampled_rows <= 50 * 11
+    assert plan.cost_lower_bound <= exact <= plan.cost_upper_bound
+    assert abs(plan.total_cost - exact) / exact < 0.05
+    assert plan.total_tokens == pytest.approx(
+        sum(len(text) + 10 for text in texts),
+        rel=0.05,
+    )
+
+
+def test_planner_only_prompts_sampled_rows():
+    prompts = []
+    planner = RunPlanner(
+        FakeLLM(),
+        lambda row: prompts.append(row["text"]) or row["text"],
+        input_columns=["text"],
+        samples_per_stratum=5,
+    )
+
+    plan = planner.estimate(_chunks(["ab"] * 1000 + ["abcdefgh"] * 1000, 128))
+
+    # Two strata, of 5 sampled rows each
+    assert len(prompts) == 10
+    assert plan.num_sampled_rows == 10
+    assert plan.num_rows == 2000
+
+
+def test_planner_fully_sampled_dataset_has_no_uncertainty():
+    llm = FakeLLM()
+    planner = RunPlanner(llm, lambda row: row["text"], input_columns=["text"])
+
+    plan = planner.estimate(_chunks(["a", "bb", "cccc"], 2))
+
+    assert plan.total_cost == pytest.approx(
+        sum(llm.get_cost(t) for t in ["a", "bb", "cccc"])
+    )
+    assert plan.cost_lower_bound == pytest.approx(plan.total_cost)
+    assert plan.cost_upper_bound == pytest.approx(plan.total_cost)
+
+
+def test_planner_projects_time_from_the_tightest_limit():
+    planner = RunPlanner(FakeLLM(max_output_tokens=0), lambda row: row["text"])
+    chunks = list(_chunks(["a" * 100] * 600, 600))
+
+    plan = planner.estimate(chunks, max_concurrency=10, seconds_per_request=1.0)
+    assert plan.limited_by == "concurrency"
+    assert plan.projected_seconds == pytest.approx(60)
+
+    plan = planner.estimate(
+        chunks,
+        max_concurrency=10,
+        seconds_per_request=1.0,
+        requests_per_minute=300,
+    )
+    assert plan.limited_by == "requests_per_minute"
+    assert plan.projected_seconds == pytest.approx(120)
+
+    plan = planner.estimate(
+        chunks,
+        max_concurrency=10,
+        seconds_per_request=1.0,
+        requests_per_minute=300,
+        tokens_per_minute=6000,
+    )
+    assert plan.limited_by == "tokens_per_minute"
+    assert plan.projected_seconds == pytest.approx(600)
+
+
+def test_planner_empty_dataset():
+    planner = RunPlanner(FakeLLM(), lambda row: row["text"])
+
+    plan = planner.estimate([])
+
+    assert plan.num_rows == 0 and plan.total_cost == 0
+    assert plan.example_prompt is None
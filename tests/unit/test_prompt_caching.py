@@ -0,0 +1,148 @@
+import asyncio
+import copy
+import json
+
+import pandas as pd
+from langchain.schema import AIMessage, ChatGeneration, LLMResult
+
+from autolabel import LabelingAgent
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import AutolabelDataset
+from autolabel.models.anthropic import AnthropicLLM
+from autolabel.tasks import AttributeExtractionTask
+
+BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
+
+
+class CachingChatModel:
+
+    """
+    Local stand-in for a provider that caches prompt prefixes. Content blocks marked
+    with cache_control are cached, and reported as read from the cache when they are
+    sent again. Tokens are whitespace separated words.
+    """
+
+    def __init__(self) -> None:
+        self.cached_blocks = set()
+        self.messages = []
+
+    def _generate_one(self, messages) -> ChatGeneration:
+        self.messages.append(messages[0])
+        content = messages[0].content
+        blocks = [{"text": content}] if isinstance(content, str) else content
+        usage = {
+            "input_tokens": 0,
+            "output_tokens": 1,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        for block in blocks:
+            num_tokens = len(block["text"].split())
+            if "cache_control" not in block:
+                usage["input_tokens"] += num_tokens
+            elif block["text"] in self.cached_blocks:
+                usage["cache_read_input_tokens"] += num_tokens
+            else:
+                self.cached_blocks.add(block["text"])
+                usage["cache_creation_input_tokens"] += num_tokens
+        return ChatGeneration(
+            message=AIMessage(
+                content='{"label": "card_arrival"}',
+                response_metadata={"usage": usage},
+            ),
+        )
+
+    def generate(self, prompts) -> LLMResult:
+        return LLMResult(
+            generations=[[self._generate_one(messages)] for messages in prompts],
+        )
+
+    async def agenerate(self, prompts) -> LLMResult:
+        return self.generate(prompts)
+
+
+def _caching_config(few_shot: bool = False) -> AutolabelConfig:
+    config = copy.deepcopy(BANKING_CONFIG)
+    config["model"] = {
+        "provider": "anthropic",
+        "name": "claude-3-haiku-20240307",
+        "prompt_caching": True,
+    }
+    if not few_shot:
+        del config["prompt"]["few_shot_examples"]
+        del config["prompt"]["few_shot_selection"]
+        del config["prompt"]["few_shot_num"]
+    return AutolabelConfig(config)
+
+
+def test_static_prompt_prefix_starts_every_prompt():
+    config = _caching_config(few_shot=True)
+    task = AttributeExtractionTask(config)
+    examples = [
+        {"example": "Where is my card?", "label": "card_arrival"},
+        {"example": "My card does not work", "label": "card_not_working"},
+    ]
+    prefix = task.static_prompt_prefix(copy.deepcopy(examples))
+
+    assert "Where is my card?" in prefix
+    assert prefix.endswith("Now I want you to label the following example:\n")
+    for example in ["I lost my card", "How do I top up?"]:
+        prompt, _ = task.construct_prompt(
+            {"example": example}, copy.deepcopy(examples),
+        )
+        assert prompt.startswith(prefix)
+        assert prompt[len(prefix) :].startswith(f"Input: {example}")
+    # Seed examples that change per row are not part of the prefix
+    assert "Where is my card?" not in task.static_prompt_prefix()
+
+
+def test_anthropic_sends_prefix_as_cached_block():
+    model = AnthropicLLM(config=_caching_config())
+    assert model.llm.default_headers == AnthropicLLM.PROMPT_CACHING_HEADERS
+    model.llm = CachingChatModel()
+    model.cacheable_prefix = "Shared guidelines for every row.\n"
+
+    first = asyncio.run(
+        model.label(["Shared guidelines for every row.\nInput: a"], None),
+    )
+    second = asyncio.run(
+        model.label(["Shared guidelines for every row.\nInput: b"], None),
+    )
+    unrelated = asyncio.run(model.label(["Other prompt"], None))
+
+    assert model.llm.messages[0].content == [
+        {
+            "type": "text",
+            "text": "Shared guidelines for every row.\n",
+            "cache_control": {"type": "ephemeral"},
+        },
+        {"type": "text", "text": "Input: a"},
+    ]
+    assert model.llm.messages[2].content == "Other prompt"
+    assert first.cached_tokens == [0]
+    assert second.cached_tokens == [5]
+    assert unrelated.cached_tokens == [0]
+
+
+def test_run_reports_cached_prompt_tokens(mocker):
+    config = _caching_config()
+    agent = LabelingAgent(
+        config=config,
+        console_output=False,
+        generation_cache=None,
+        transform_cache=None,
+        confidence_cache=None,
+    )
+    mocker.patch.object(agent.llm, "get_num_tokens", side_effect=len)
+    agent.llm.llm = CachingChatModel()
+    summary = mocker.spy(agent, "_print_prompt_caching_summary")
+    df = pd.DataFrame({"example": [f"example {i}" for i in range(3)]})
+
+    agent.run(AutolabelDataset(df, config))
+
+    prefix = agent.llm.cacheable_prefix
+    assert prefix.endswith("Now I want you to label the following example:\n")
+    num_cached, num_prompt = summary.call_args.args
+    # The first row writes the prefix to the cache and the other rows read it
+    assert num_cached == 2 * len(prefix.split())
+    assert num_prompt > num_cached
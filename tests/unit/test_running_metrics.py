@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from autolabel.metrics import (
+    AccuracyMetric,
+    AUROCMetric,
+    CompletionRateMetric,
+    RunningAccuracyMetric,
+    RunningAUROCMetric,
+    RunningCompletionRateMetric,
+    RunningEvaluator,
+    RunningSupportMetric,
+)
+from autolabel.schema import ErrorType, LabelingError, LLMAnnotation
+
+
+def _random_annotations(num_rows, seed=0):
+    rng = random.Random(seed)
+    llm_labels, gt_labels = [], []
+    for _ in range(num_rows):
+        gt_label = rng.choice(["a", "b", "c", "nan"])
+        correct = rng.random() < 0.7
+        error = (
+            LabelingError(error_type=ErrorType.PARSING_ERROR, error_message="")
+            if rng.random() < 0.1
+            else None
+        )
+        llm_labels.append(
+            LLMAnnotation(
+                successfully_labeled=error is None,
+                label=gt_label if correct else "d",
+                error=error,
+                # Correct labels tend to have higher confidence
+                confidence_score=min(1.0, rng.random() * 0.8 + 0.2 * correct),
+            ),
+        )
+        gt_labels.append(gt_label)
+    return llm_labels, gt_labels
+
+
+@pytest.mark.parametrize(
+    "running_metric,metric,tolerance",
+    [
+        (RunningAccuracyMetric(), AccuracyMetric(), 1e-9),
+        (RunningCompletionRateMetric(), CompletionRateMetric(), 1e-9),
+        (RunningAUROCMetric(), AUROCMetric(), 1e-2),
+    ],
+)
+def test_running_metrics_match_batch_metrics(running_metric, metric, tolerance):
+    llm_labels, gt_labels = _random_annotations(500)
+    for llm_label, gt_label in zip(llm_labels, gt_labels):
+        running_metric.update(llm_label, gt_label)
+
+    expected = metric.compute(llm_labels, gt_labels)[0]
+    actual = running_metric.result()[0]
+
+    assert actual.name == expected.name
+    assert actual.value == pytest.approx(expected.value, abs=tolerance)
+
+
+def test_running_evaluator_reports_attribute_and_macro_metrics():
+    evaluator = RunningEvaluator(
+        lambda: [RunningSupportMetric(), RunningAccuracyMetric()],
+    )
+    for label, gt in [("a", "a"), ("b", "a"), ("a", "a")]:
+        evaluator.update(
+            LLMAnnotation(successfully_labeled=True, label={"x": label, "y": gt}),
+            {"x": gt, "y": gt},
+        )
+
+    values = {m.name: m.value for m in evaluator.result()}
+
+    assert values["x:support"] == 3
+    assert values["x:accuracy"] == pytest.approx(2 / 3)
+    assert values["y:accuracy"] == 1.0
+    assert values["Macro:accuracy"] == pytest.approx(5 / 6)
@@ -0,0 +1,84 @@
+import copy
+import json
+
+import pandas as pd
+from langchain.schema import Generation
+
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import AutolabelDataset
+from autolabel.distributed import ShardedLabelingRunner
+from autolabel.models.openai import OpenAILLM
+from autolabel.schema import RefuelLLMResult, RunOptions
+
+BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
+
+
+def _config(num_rows):
+    config = copy.deepcopy(BANKING_CONFIG)
+    config["model"]["compute_confidence"] = False
+    del config["prompt"]["few_shot_examples"]
+    del config["prompt"]["few_shot_selection"]
+    del config["prompt"]["few_shot_num"]
+    config["prompt"]["attributes"][0]["options"] = [
+        f"example {i}" for i in range(num_rows)
+    ]
+    return AutolabelConfig(config)
+
+
+async def _label_with_echo(self, prompts, output_schema=None, use_cache=True):
+    return RefuelLLMResult(
+        generations=[
+            [
+                Generation(
+                    text=json.dumps(
+                        {"label": prompt.split("Input: ")[-1].split("\n")[0]},
+                    ),
+                ),
+            ]
+            for prompt in prompts
+        ],
+        errors=[None for _ in prompts],
+        costs=[0.5 for _ in prompts],
+        latencies=[0.01 for _ in prompts],
+    )
+
+
+def test_shard_splits_dataset_into_contiguous_shards():
+    config = _config(10)
+    df = pd.DataFrame({"example": [f"example {i}" for i in range(10)]})
+    runner = ShardedLabelingRunner(config, num_shards=3)
+
+    shards = runner.shard(AutolabelDataset(df, config))
+
+    assert [shard.df["example"].tolist() for shard in shards] == [
+        [f"example {i}" for i in range(0, 4)],
+        [f"example {i}" for i in range(4, 7)],
+        [f"example {i}" for i in range(7, 10)],
+    ]
+
+
+def test_sharded_run_merges_results_in_order(mocker):
+    # Patches on the class are inherited by forked worker processes
+    mocker.patch.object(OpenAILLM, "label", _label_with_echo)
+    mocker.patch.object(OpenAILLM, "get_num_tokens", lambda self, prompt: len(prompt))
+    config = _config(9)
+    df = pd.DataFrame({"example": [f"example {i}" for i in range(9)]})
+    runner = ShardedLabelingRunner(
+        config,
+        num_shards=3,
+        agent_kwargs={
+            "generation_cache": None,
+            "transform_cache": None,
+            "confidence_cache": None,
+        },
+        mp_context="fork",
+        console_output=False,
+    )
+
+    dataset = runner.run(
+        AutolabelDataset(df, config), options=RunOptions(max_concurrency=2),
+    )
+
+    labels = dataset.df[dataset.generate_label_name("label", "label")].tolist()
+    assert labels == [f"example {i}" for i in range(9)]
+    assert runner.cost == 0.5 * 9
@@ -0,0 +1,90 @@
+import json
+
+import pandas as pd
+import pytest
+
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import CsvSink, SinkFactory, StreamingDataset
+from autolabel.schema import LLMAnnotation
+
+BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
+
+
+def test_streaming_dataset_reads_csv_in_chunks(tmp_path):
+    path = tmp_path / "input.csv"
+    pd.DataFrame({"example": [f"example {i}" for i in range(25)]}).to_csv(
+        path, index=False,
+    )
+
+    dataset = StreamingDataset(
+        str(path), BANKING_CONFIG, max_items=10, start_index=12, chunk_size=4,
+    )
+
+    assert [row["example"] for row in dataset] == [
+        f"example {i}" for i in range(12, 22)
+    ]
+
+
+def test_streaming_dataset_chunks_respect_row_range(tmp_path):
+    path = tmp_path / "input.csv"
+    pd.DataFrame({"example": [f"example {i}" for i in range(25)]}).to_csv(
+        path, index=False,
+    )
+
+    dataset = StreamingDataset(
+        str(path), BANKING_CONFIG, max_items=10, start_index=6, chunk_size=4,
+    )
+    chunks = list(dataset.chunks())
+
+    assert [len(chunk) for chunk in chunks] == [2, 4, 4]
+    assert pd.concat(chunks)["example"].tolist() == [
+        f"example {i}" for i in range(6, 16)
+    ]
+
+
+def test_streaming_dataset_rejects_unknown_format():
+    with pytest.raises(ValueError, match="Unsupported dataset file format"):
+        StreamingDataset("input.txt", BANKING_CONFIG)
+
+
+def test_annotation_to_row_adds_label_columns():
+    dataset = StreamingDataset([], AutolabelConfig(BANKING_CONFIG))
+    annotation = LLMAnnotation(
+        successfully_labeled=True,
+        label={"label": "card_arrival"},
+        prompt="prompt",
+        confidence_score={"label": 0.9},
+    )
+
+    row = dataset.annotation_to_row({"example": "where is my card"}, annotation)
+
+    assert row["example"] == "where is my card"
+    assert row["label_label"] == "card_arrival"
+    assert row["label_confidence"] == 0.9
+    assert row["BankingComplaintsClassification_task_error"] is None
+    assert list(row) == dataset.output_columns(["example"])
+
+
+def test_csv_sink_appends_under_existing_header(tmp_path):
+    path = str(tmp_path / "output.csv")
+    with SinkFactory.from_path(path) as sink:
+        sink.write([{"a": "1", "b": {"x": 1}}])
+    with CsvSink(path, append=True) as sink:
+        sink.write([{"b": "4", "a": "3"}])
+
+    output = pd.read_csv(path, dtype=str)
+    assert output.columns.tolist() == ["a", "b"]
+    assert output.values.tolist() == [["1", '{"x": 1}'], ["3", "4"]]
+
+
+def test_csv_sink_writes_declared_columns(tmp_path):
+    path = str(tmp_path / "output.csv")
+    with SinkFactory.from_path(path, fieldnames=["a", "b", "error"]) as sink:
+        sink.write([{"a": "1", "b": "2"}])
+        sink.write([{"a": "3", "b": "4", "error": "failed"}])
+        with pytest.raises(ValueError):
+            sink.write([{"a": "5", "c": "6"}])
+
+    output = pd.read_csv(path, dtype=str, keep_default_na=False)
+    assert output.columns.tolist() == ["a", "b", "error"]
+    assert output.values.tolist() == [["1", "2", ""], ["3", "4", "failed"]]
@@ -0,0 +1,97 @@
+from autolabel.configs import AutolabelConfig
+from autolabel.models import BaseModel, OpenAILLM
+from autolabel.models.tokenizer import TokenizerService
+
+
+def test_tokenizer_service_memoizes_counts():
+    counted = []
+    service = TokenizerService(lambda text: counted.append(text) or len(text))
+
+    assert service.num_tokens("abc") == 3
+    assert service.num_tokens("abc") == 3
+    assert service.num_tokens("abcd") == 4
+
+    assert counted == ["abc", "abcd"]
+    assert service.num_hits == 1 and service.num_misses == 2
+
+
+def test_tokenizer_service_counts_missing_strings_in_one_batch():
+    batches = []
+
+    def count_batch(texts):
+        batches.append(texts)
+        return [len(text) for text in texts]
+
+    service = TokenizerService(len, count_batch)
+    service.num_tokens("a")
+
+    assert service.num_tokens_batch(["a", "bb", "ccc", "bb"]) == [1, 2, 3, 2]
+    assert batches == [["bb", "ccc"]]
+    assert service.num_tokens_batch(["ccc", "a"]) == [3, 1]
+    assert len(batches) == 1
+
+
+def test_tokenizer_service_evicts_least_recently_used():
+    counted = []
+    service = TokenizerService(
+        lambda text: counted.append(text) or len(text), max_entries=2,
+    )
+    service.num_tokens("a")
+    service.num_tokens("bb")
+    service.num_tokens("a")
+    service.num_tokens("ccc")
+
+    service.num_tokens("a")
+    service.num_tokens("bb")
+
+    assert counted == ["a", "bb", "ccc", "bb"]
+
+
+def test_get_cost_reuses_token_counts(mocker):
+    count_tokens = mocker.patch.object(
+        OpenAILLM, "_count_tokens", side_effect=lambda text: len(text),
+    )
+    model = OpenAILLM(
+        config=AutolabelConfig(config="tests/assets/banking/config_banking.json"),
+    )
+    prompt = "a prompt that was trimmed to the context length"
+
+    model.get_num_tokens(prompt)
+    model.get_cost(prompt, label="label")
+    model.get_cost(prompt)
+
+    assert [call.args[0] for call in count_tokens.call_args_list] == [
+        prompt,
+        "label",
+    ]
+
+
+def test_model_implementing_get_num_tokens_is_memoized():
+    counted = []
+
+    class LegacyModel(BaseModel):
+        model_name = "legacy"
+
+        def _label(self, prompts, output_schema):
+            pass
+
+        def get_cost(self, prompt, label=""):
+            return 0.0
+
+        def returns_token_probs(self):
+            return False
+
+        def get_num_tokens(self, prompt):
+            counted.append(prompt)
+            return len(prompt)
+
+    model = LegacyModel(
+        AutolabelConfig(config="tests/assets/banking/config_banking.json"),
+        cache=None,
+        tokenizer=None,
+    )
+
+    assert model.get_num_tokens("abc") == 3
+    assert model.get_num_tokens("abc") == 3
+    assert model.get_num_tokens_batch(["abc", "de"]) == [3, 2]
+    assert counted == ["abc", "de"]
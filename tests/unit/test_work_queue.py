@@ -0,0 +1,155 @@
+import asyncio
+import copy
+import json
+import os
+
+import pandas as pd
+import pytest
+from langchain.schema import Generation
+
+from autolabel import LabelingAgent
+from autolabel.configs import AutolabelConfig
+from autolabel.dataset import AutolabelDataset
+from autolabel.distributed import (
+    SQLiteWorkQueue,
+    WorkQueueCoordinator,
+    WorkQueueWorker,
+)
+from autolabel.schema import RefuelLLMResult
+
+BANKING_CONFIG = json.load(open("tests/assets/banking/config_banking.json"))
+
+
+def _queue(tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"))
+    queue.initialize()
+    return queue
+
+
+def _config():
+    config = copy.deepcopy(BANKING_CONFIG)
+    config["model"]["compute_confidence"] = False
+    del config["prompt"]["few_shot_examples"]
+    del config["prompt"]["few_shot_selection"]
+    del config["prompt"]["few_shot_num"]
+    return AutolabelConfig(config)
+
+
+def _agent(mocker, config, label):
+    agent = LabelingAgent(
+        config=config,
+        console_output=False,
+        generation_cache=None,
+        transform_cache=None,
+        confidence_cache=None,
+    )
+    mocker.patch.object(agent.llm, "label", side_effect=label)
+    mocker.patch.object(agent.llm, "get_num_tokens", side_effect=len)
+    return agent
+
+
+def test_expired_leases_are_reissued(tmp_path):
+    now = [1000.0]
+    queue = SQLiteWorkQueue(str(tmp_path / "queue.db"), clock=lambda: now[0])
+    queue.initialize()
+    queue.enqueue("run", [(0, 10), (10, 10)])
+    queue.enqueue("run", [(0, 10)])
+
+    first = queue.lease("run", "worker-1", lease_seconds=10)
+    second = queue.lease("run", "worker-2", lease_seconds=60)
+    assert (first.start_index, second.start_index) == (0, 10)
+    assert queue.lease("run", "worker-3", lease_seconds=60) is None
+
+    now[0] += 20
+    reissued = queue.lease("run", "worker-3", lease_seconds=60)
+    assert reissued.start_index == 0
+    # The worker that lost the lease can no longer renew or complete it
+    assert not queue.renew(first, lease_seconds=60)
+    assert not queue.complete(first)
+
+    assert queue.renew(second, lease_seconds=60)
+    assert queue.complete(second)
+    assert queue.complete(reissued)
+    assert queue.counts("run") == {"pending": 0, "leased": 0, "done": 2}
+    assert queue.is_done("run")
+
+
+def test_empty_run_is_done(tmp_path):
+    queue = _queue(tmp_path)
+    coordinator = WorkQueueCoordinator(queue, "run", str(tmp_path / "output"))
+    assert coordinator.submit(0, range_size=10) == 0
+    assert queue.is_done("run")
+
+    queue.enqueue("other_run", [(0, 10)])
+    other = WorkQueueCoordinator(queue, "other_run", str(tmp_path / "output"))
+    with pytest.raises(ValueError):
+        other.merge(str(tmp_path / "labeled.csv"))
+
+
+def test_workers_label_leased_ranges_into_shared_output(mocker, tmp_path):
+    config = _config()
+    df = pd.DataFrame({"example": [f"example {i}" for i in range(25)]})
+    dataset = AutolabelDataset(df, config)
+
+    async def label(prompts, output_schema=None, use_cache=True):
+        return RefuelLLMResult(
+            generations=[
+                [Generation(text=json.dumps({"label": "x"}))] for _ in prompts
+            ],
+            errors=[None for _ in prompts],
+            costs=[0.0 for _ in prompts],
+            latencies=[0.0 for _ in prompts],
+        )
+
+    queue = _queue(tmp_path)
+    coordinator = WorkQueueCoordinator(queue, "run", str(tmp_path / "output"))
+    assert coordinator.submit(len(df), range_size=10, start_index=2) == 3
+
+    workers = []
+    for worker_id in ["worker-1", "worker-2"]:
+        workers.append(
+            WorkQueueWorker(
+                _agent(mocker, config, label),
+                queue,
+                "run",
+                dataset,
+                str(tmp_path / "output"),
+                worker_id,
+            ),
+        )
+
+    # The first worker labels a single range before it stops
+    lease = queue.lease("run", "worker-1", lease_seconds=60)
+    assert asyncio.run(workers[0]._label_range(lease))
+    completed = workers[1].run()
+
+    assert [lease.start_index for lease in completed] == [12, 22]
+    assert coordinator.progress() == {"pending": 0, "leased": 0, "done": 3}
+    output_file = str(tmp_path / "labeled.csv")
+    coordinator.merge(output_file)
+    output = pd.read_csv(output_file, dtype=str)
+    assert output["example"].tolist() == [f"example {i}" for i in range(2, 25)]
+    assert set(output["label_label"]) == {"x"}
+
+
+def test_worker_stops_labeling_range_once_lease_is_lost(mocker, tmp_path):
+    config = _config()
+    dataset = AutolabelDataset(pd.DataFrame({"example": ["a", "b"]}), config)
+
+    async def label(prompts, output_schema=None, use_cache=True):
+        # Never returns, the range is only finished by cancelling it
+        await asyncio.Event().wait()
+
+    agent = _agent(mocker, config, label)
+    queue = _queue(tmp_path)
+    queue.enqueue("run", [(0, 2)])
+    worker = WorkQueueWorker(
+        agent, queue, "run", dataset, str(tmp_path / "output"), lease_seconds=0.03,
+    )
+    lease = queue.lease("run", worker.worker_id, lease_seconds=60)
+    # Another worker took over the range
+    mocker.patch.object(queue, "renew", return_value=False)
+
+    assert not asyncio.run(asyncio.wait_for(worker._label_range(lease), 5))
+    assert os.listdir(tmp_path / "output" / "run") == []
+    assert queue.counts("run") == {"pending": 0, "leased": 1, "done": 0}